@@ -0,0 +1,80 @@
+from django.db import connection, transaction
+
+from imports.api.models import BirthdayPresents, Citizen
+from imports.api.relatives import get_relatives_storage
+
+
+def qn(name):
+    return connection.ops.quote_name(name)
+
+
+def _presents_sql(where=''):
+    """SQL counting presents of data set as (data_set_id, citizen_id, month, presents) rows.
+
+    Relative of every directed edge buys a present in the month of birth
+    of the citizen, as `get_birthday_stats2` counts them.
+    """
+    citizens = qn(Citizen._meta.db_table)
+    return (f'SELECT e.data_set_id, r.citizen_id, '
+            f'  EXTRACT(MONTH FROM c.birth_date)::smallint AS month, COUNT(*) AS presents '
+            f'FROM ({get_relatives_storage().directed_sql()}) e '
+            f'JOIN {citizens} c ON c.id = e.citizen_id AND c.data_set_id = %(data_set_id)s '
+            f'JOIN {citizens} r ON r.id = e.relative_id AND r.data_set_id = %(data_set_id)s '
+            f'WHERE e.data_set_id = %(data_set_id)s {where}'
+            f'GROUP BY e.data_set_id, r.citizen_id, month')
+
+
+def _insert_presents(cursor, where='', params=None):
+    table = qn(BirthdayPresents._meta.db_table)
+    cursor.execute(f'INSERT INTO {table} (data_set_id, citizen_id, month, presents) '
+                   f'{_presents_sql(where)}',
+                   params)
+
+
+def fill_birthday_presents(data_set_id):
+    """Count presents of all citizens of a new data set with a single INSERT ... SELECT."""
+    with connection.cursor() as cursor:
+        _insert_presents(cursor, params={'data_set_id': data_set_id})
+
+
+def refresh_birthday_presents(data_set_id, citizen_pks):
+    """Recount presents bought by citizens with primary keys `citizen_pks`.
+
+    Called in the transaction of an update with all citizens whose presents
+    may change: updated citizens and their relatives before and after the
+    update. Only rows of these citizens are rewritten.
+    """
+    table = qn(BirthdayPresents._meta.db_table)
+    params = {'data_set_id': data_set_id, 'pks': sorted(citizen_pks)}
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} p USING {qn(Citizen._meta.db_table)} c '
+                       f'WHERE c.data_set_id = %(data_set_id)s AND c.id = ANY(%(pks)s) '
+                       f'AND p.data_set_id = %(data_set_id)s AND p.citizen_id = c.citizen_id',
+                       params)
+        _insert_presents(cursor, where='AND e.relative_id = ANY(%(pks)s) ', params=params)
+
+
+def read_birthday_presents(data_set_id):
+    """Stored (citizen_id, month, presents) rows of data set, ordered by citizen_id."""
+    return (BirthdayPresents.objects.filter(data_set_id=data_set_id)
+            .order_by('citizen_id', 'month')
+            .values_list('citizen_id', 'month', 'presents'))
+
+
+def birthday_presents_differ(data_set_id):
+    """Whether stored presents of data set differ from presents counted anew."""
+    table = qn(BirthdayPresents._meta.db_table)
+    stored = (f'SELECT data_set_id, citizen_id, month, presents FROM {table} '
+              f'WHERE data_set_id = %(data_set_id)s')
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT EXISTS (({_presents_sql()} EXCEPT {stored}) '
+                       f'UNION ALL ({stored} EXCEPT {_presents_sql()}))',
+                       {'data_set_id': data_set_id})
+        return cursor.fetchone()[0]
+
+
+@transaction.atomic
+def rebuild_birthday_presents(data_set_id):
+    """Replace stored presents of data set with presents counted anew."""
+    BirthdayPresents.objects.filter(data_set_id=data_set_id).delete()
+    fill_birthday_presents(data_set_id)
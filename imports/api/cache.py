@@ -0,0 +1,247 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+STATS_KEYS = ('hits', 'misses', 'evictions')
+
+
+class LocMemResultCache:
+    """In-process LRU cache of pickled results bounded by their total size in bytes.
+
+    Keys are `(data_set_id, revision, endpoint)` tuples, so results of an old
+    revision are never returned and only wait for eviction.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.stats = dict.fromkeys(STATS_KEYS, 0)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+        return pickle.loads(value)
+
+    def set(self, key, result):
+        value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(value) > self.max_bytes:
+            return
+
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats['evictions'] += 1
+
+    def delete_data_set(self, data_set_id):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == data_set_id]:
+                self.size -= len(self.entries.pop(key))
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'entries': len(self.entries), 'bytes': self.size,
+                    'max_bytes': self.max_bytes}
+
+
+class SqliteResultCache:
+    """LRU cache of pickled results in a SQLite file shared by all workers of a host.
+
+    Reads do not take the write lock of the file: times of access and hit
+    and miss counts are kept by the process and written in batches, at most
+    every FLUSH_INTERVAL seconds and by writes of results. Every thread
+    keeps a connection of its own.
+    """
+    # seconds between writes of access times and stats collected by reads
+    FLUSH_INTERVAL = 1.0
+    # seconds to wait for the write lock held by another connection
+    TIMEOUT = 10
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.accessed = {}
+        self.counts = dict.fromkeys(STATS_KEYS, 0)
+        self.flushed_at = time.monotonic()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with self.write() as db:
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS results (
+                    data_set_id INTEGER NOT NULL,
+                    revision INTEGER NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (data_set_id, revision, endpoint)
+                )
+            ''')
+            db.execute('CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)')
+            db.execute('CREATE TABLE IF NOT EXISTS stats '
+                       '(name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            db.executemany('INSERT OR IGNORE INTO stats (name, value) VALUES (?, 0)',
+                           [(name,) for name in STATS_KEYS])
+
+    def connect(self):
+        """Connection of this thread, opened again in forked processes."""
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.TIMEOUT, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            self.local.db, self.local.pid = db, os.getpid()
+        return db
+
+    @contextmanager
+    def write(self):
+        """Write transaction, with access times and stats collected by reads flushed first."""
+        db = self.connect()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            self._flush(db)
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _flush(self, db):
+        with self.lock:
+            accessed, self.accessed = self.accessed, {}
+            counts, self.counts = self.counts, dict.fromkeys(STATS_KEYS, 0)
+            self.flushed_at = time.monotonic()
+        if accessed:
+            db.executemany('UPDATE results SET accessed_at = ? '
+                           'WHERE data_set_id = ? AND revision = ? AND endpoint = ?',
+                           [(accessed_at,) + key for key, accessed_at in accessed.items()])
+        self._count(db, counts)
+
+    @staticmethod
+    def _count(db, counts):
+        counts = [(value, name) for name, value in counts.items() if value]
+        if counts:
+            db.executemany('UPDATE stats SET value = value + ? WHERE name = ?', counts)
+
+    def get(self, key):
+        row = self.connect().execute('SELECT value FROM results '
+                                     'WHERE data_set_id = ? AND revision = ? AND endpoint = ?',
+                                     key).fetchone()
+        with self.lock:
+            if row is None:
+                self.counts['misses'] += 1
+            else:
+                self.accessed[tuple(key)] = time.time()
+                self.counts['hits'] += 1
+            flush = time.monotonic() - self.flushed_at > self.FLUSH_INTERVAL
+
+        if flush:
+            # best effort without waiting for writers, what is not written is kept for later
+            db = self.connect()
+            db.execute('PRAGMA busy_timeout = 0')
+            try:
+                with self.write():
+                    pass
+            except sqlite3.OperationalError:
+                pass
+            finally:
+                db.execute(f'PRAGMA busy_timeout = {self.TIMEOUT * 1000}')
+        return None if row is None else pickle.loads(row[0])
+
+    def set(self, key, result):
+        value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(value) > self.max_bytes:
+            return
+
+        with self.write() as db:
+            db.execute('INSERT OR REPLACE INTO results '
+                       '(data_set_id, revision, endpoint, value, size, accessed_at) '
+                       'VALUES (?, ?, ?, ?, ?, ?)',
+                       tuple(key) + (value, len(value), time.time()))
+
+            size, = db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()
+            if size > self.max_bytes:
+                evicted = []
+                for rowid, entry_size in db.execute('SELECT rowid, size FROM results '
+                                                    'ORDER BY accessed_at'):
+                    if size <= self.max_bytes:
+                        break
+                    evicted.append((rowid,))
+                    size -= entry_size
+                db.executemany('DELETE FROM results WHERE rowid = ?', evicted)
+                self._count(db, {'evictions': len(evicted)})
+
+    def delete_data_set(self, data_set_id):
+        with self.write() as db:
+            db.execute('DELETE FROM results WHERE data_set_id = ?', (data_set_id,))
+
+    def get_stats(self):
+        with self.write() as db:
+            stats = dict(db.execute('SELECT name, value FROM stats'))
+            entries, size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) '
+                                       'FROM results').fetchone()
+        return {**stats, 'entries': entries, 'bytes': size, 'max_bytes': self.max_bytes}
+
+
+_result_cache = None
+
+
+def get_result_cache():
+    """Cache configured by IMPORTS_RESULT_CACHE, None when caching is disabled."""
+    global _result_cache
+    if _result_cache is None and settings.IMPORTS_RESULT_CACHE:
+        if settings.IMPORTS_RESULT_CACHE == 'sqlite':
+            _result_cache = SqliteResultCache(settings.IMPORTS_RESULT_CACHE_PATH,
+                                              settings.IMPORTS_RESULT_CACHE_MAX_BYTES)
+        else:
+            _result_cache = LocMemResultCache(settings.IMPORTS_RESULT_CACHE_MAX_BYTES)
+    return _result_cache
+
+
+@receiver(setting_changed)
+def reset_result_cache(setting, **kwargs):
+    global _result_cache
+    if setting.startswith('IMPORTS_RESULT_CACHE'):
+        _result_cache = None
+
+
+def cached_result(data_set, endpoint, func):
+    """Return result of `func()` for the current revision of data set, computing it once."""
+    cache = get_result_cache()
+    if cache is None:
+        return func()
+
+    key = (data_set.id, data_set.revision, endpoint)
+    result = cache.get(key)
+    if result is None:
+        result = func()
+        cache.set(key, result)
+    return result
+
+
+def invalidate_data_set(data_set_id):
+    """Drop cached results of data set, called after its changes are committed."""
+    cache = get_result_cache()
+    if cache is not None:
+        cache.delete_data_set(data_set_id)
@@ -0,0 +1,90 @@
+from collections import Counter
+
+from django.db import connection, transaction
+
+from imports.api.models import Citizen, Town, TownBirthDates
+
+
+def qn(name):
+    return connection.ops.quote_name(name)
+
+
+def fill_birth_date_histogram(data_set_id):
+    """Count citizens of a new data set by town and birth date with a single INSERT ... SELECT."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {qn(TownBirthDates._meta.db_table)} '
+                       f'(data_set_id, town_id, birth_year, birth_month_day, citizens) '
+                       f'SELECT data_set_id, town_id, EXTRACT(YEAR FROM birth_date), '
+                       f'  EXTRACT(MONTH FROM birth_date) * 100 + EXTRACT(DAY FROM birth_date), '
+                       f'  COUNT(*) '
+                       f'FROM {qn(Citizen._meta.db_table)} WHERE data_set_id = %s '
+                       f'GROUP BY data_set_id, town_id, birth_date',
+                       [data_set_id])
+
+
+@transaction.atomic
+def rebuild_birth_date_histogram(data_set_id):
+    TownBirthDates.objects.filter(data_set_id=data_set_id).delete()
+    fill_birth_date_histogram(data_set_id)
+
+
+def histogram_key(citizen):
+    """Key of citizen in histogram: (town_id, birth_year, birth_month_day)."""
+    birth_date = citizen.birth_date
+    return citizen.town_id, birth_date.year, birth_date.month * 100 + birth_date.day
+
+
+def histogram_changes(old, new):
+    """Deltas of histogram of citizens moved from `old` to `new` keys."""
+    changes = Counter(new)
+    changes.subtract(old)
+    return {key: delta for key, delta in changes.items() if delta}
+
+
+def adjust_birth_date_histogram(data_set_id, changes):
+    """Add signed deltas of `{key: delta}` to histogram of data set.
+
+    Called in the transaction of an update with old and new keys of moved
+    citizens; rows are upserted and rows left empty are deleted.
+    """
+    if not changes:
+        return
+
+    table = qn(TownBirthDates._meta.db_table)
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(changes))
+    params = [value for key, delta in sorted(changes.items()) for value in key + (delta,)]
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {table} AS h '
+                       f'(data_set_id, town_id, birth_year, birth_month_day, citizens) '
+                       f'SELECT %s, town_id, birth_year, birth_month_day, citizens '
+                       f'FROM (VALUES {values}) '
+                       f'AS v (town_id, birth_year, birth_month_day, citizens) '
+                       f'ON CONFLICT (data_set_id, town_id, birth_year, birth_month_day) '
+                       f'DO UPDATE SET citizens = h.citizens + EXCLUDED.citizens '
+                       f'RETURNING h.id, h.citizens',
+                       [data_set_id] + params)
+        emptied = [row_id for row_id, citizens in cursor.fetchall() if not citizens]
+    if emptied:
+        TownBirthDates.objects.filter(id__in=emptied).delete()
+
+
+def read_town_ages(data_set_id, current_date):
+    """(town, age, citizens) counts of data set for `current_date`, ages as `calculate_age`.
+
+    Ages are aggregated from the histogram in the database, so at most
+    about 120 rows per town are read whatever the number of citizens.
+    """
+    sql = (f'SELECT t.name, a.age, a.citizens FROM ('
+           f'  SELECT town_id,'
+           f'    %s - birth_year - CASE WHEN birth_month_day < %s THEN 1 ELSE 0 END AS age,'
+           f'    SUM(citizens) AS citizens'
+           f'  FROM {qn(TownBirthDates._meta.db_table)}'
+           f'  WHERE data_set_id = %s'
+           f'  GROUP BY town_id, age'
+           f') a '
+           f'JOIN {qn(Town._meta.db_table)} t ON t.id = a.town_id')
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [current_date.year, current_date.month * 100 + current_date.day,
+                             data_set_id])
+        return cursor.fetchall()
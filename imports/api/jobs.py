@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import JSONParser
+
+from imports.api.models import ImportJob
+from imports.api.operations import (create_dataset, create_dataset_from_stream,
+                                    purge_deleted_data_sets, )
+from imports.api.serializers import CreateDataSetSerializer, CreateDataSetStreamValidator
+from imports.api.streaming import DataSetStreamReader
+from imports.api.validators import CitizenValidator, CreateDataSetValidator
+
+logger = logging.getLogger(__name__)
+
+
+def validate_data_set(data, workers=None):
+    """Validated citizens of POST /imports data, by chunks in `workers` forked processes.
+
+    Forking a pool per payload only pays off in the single-threaded job
+    worker, requests are validated in their own process.
+    """
+    if settings.IMPORTS_FAST_VALIDATION:
+        serializer = CreateDataSetValidator(data=data, workers=workers,
+                                            chunk_size=settings.IMPORTS_VALIDATION_CHUNK_SIZE)
+    else:
+        serializer = CreateDataSetSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data['citizens']
+
+
+def validate_data_set_stream(stream):
+    """Iterator of validated citizens of POST /imports body read from `stream`."""
+    citizen_validator = CitizenValidator() if settings.IMPORTS_FAST_VALIDATION else None
+    validator = CreateDataSetStreamValidator(DataSetStreamReader(stream),
+                                             citizen_validator=citizen_validator)
+    return validator.validated_citizens()
+
+
+def spool_import(stream, content_length=None):
+    """Write POST /imports body to IMPORTS_JOB_SPOOL_PATH and queue job importing it.
+
+    Empty bodies and bodies shorter than `content_length` are rejected right
+    away, with the errors POST /imports answers without jobs.
+    """
+    path = settings.IMPORTS_JOB_SPOOL_PATH
+    os.makedirs(path, exist_ok=True)
+    fd, spool_path = tempfile.mkstemp(dir=path, suffix='.json')
+    try:
+        with os.fdopen(fd, 'wb') as spool:
+            if stream is not None:
+                shutil.copyfileobj(stream, spool)
+            size = spool.tell()
+        if not size:
+            # empty body is parsed as an empty object
+            validate_data_set({})
+        if content_length is not None and size < content_length:
+            raise ParseError('JSON parse error - body is shorter than its Content-Length')
+        return ImportJob.objects.create(spool_name=os.path.basename(spool_path))
+    except BaseException:
+        os.remove(spool_path)
+        raise
+
+
+def claim_import_job():
+    """Take the oldest queued job, skipping jobs being taken by other workers.
+
+    Advisory lock of the job is held by the session of the worker until
+    the job is finished, and is taken before the job stops being queued.
+    """
+    with transaction.atomic():
+        job = (ImportJob.objects.select_for_update(skip_locked=True)
+               .filter(status=ImportJob.STATUS_QUEUED).order_by('id').first())
+        if job is not None:
+            _job_lock('pg_advisory_lock', job.id)
+            _set_status(job, ImportJob.STATUS_VALIDATING)
+    return job
+
+
+def requeue_abandoned_import_jobs():
+    """Queue again jobs left validating or importing by workers which died, return their ids.
+
+    A dead worker lost advisory locks of its job with its connection. Data
+    set of the job was not created, as the job becomes done in the import
+    transaction, and its payload is still spooled.
+    """
+    running = (ImportJob.STATUS_VALIDATING, ImportJob.STATUS_IMPORTING)
+    requeued = []
+    for job_id in ImportJob.objects.filter(status__in=running).values_list('id', flat=True):
+        if not _job_lock('pg_try_advisory_lock', job_id):
+            continue
+        try:
+            # job may have been finished before it was locked
+            if ImportJob.objects.filter(id=job_id, status__in=running).update(
+                    status=ImportJob.STATUS_QUEUED, updated_at=timezone.now()):
+                logger.warning('Import job %s is queued again', job_id)
+                requeued.append(job_id)
+        finally:
+            _job_lock('pg_advisory_unlock', job_id)
+    return requeued
+
+
+def _job_lock(function, job_id):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {function}(%s::regclass::oid::integer, %s)',
+                       [ImportJob._meta.db_table, job_id])
+        return cursor.fetchone()[0]
+
+
+def _set_status(job, status, **fields):
+    job.status = status
+    for field, value in fields.items():
+        setattr(job, field, value)
+    job.save(update_fields=['status', 'updated_at', *fields])
+
+
+def _error_data(exc):
+    """Body of error response as the exception handler of REST framework renders it."""
+    if isinstance(exc.detail, (list, dict)):
+        return exc.detail
+    return {'detail': exc.detail}
+
+
+def run_import_job(job):
+    """Validate and import payload of claimed job as POST /imports does.
+
+    Data set is created in one transaction with the job becoming done, so
+    a job interrupted by a killed worker has imported nothing and is queued
+    again by `requeue_abandoned_import_jobs`.
+    """
+    spool_path = os.path.join(settings.IMPORTS_JOB_SPOOL_PATH, job.spool_name)
+
+    def done(import_id):
+        _set_status(job, ImportJob.STATUS_DONE, import_id=import_id)
+
+    try:
+        with open(spool_path, 'rb') as stream:
+            if settings.IMPORTS_STREAMING_IMPORT:
+                # citizens are validated as they are inserted
+                _set_status(job, ImportJob.STATUS_IMPORTING)
+                create_dataset_from_stream(citizens=validate_data_set_stream(stream),
+                                           batch_size=settings.IMPORTS_STREAMING_BATCH_SIZE,
+                                           on_created=done)
+            else:
+                citizens = validate_data_set(JSONParser().parse(stream),
+                                             workers=settings.IMPORTS_VALIDATION_WORKERS)
+                _set_status(job, ImportJob.STATUS_IMPORTING)
+                create_dataset(citizens=citizens, on_created=done)
+    except APIException as e:
+        _set_status(job, ImportJob.STATUS_FAILED,
+                    errors=json.dumps(_error_data(e), ensure_ascii=False))
+    except Exception:
+        logger.exception('Import job %s failed', job.id)
+        _set_status(job, ImportJob.STATUS_FAILED,
+                    errors=json.dumps({'detail': 'A server error occurred.'}))
+    finally:
+        try:
+            os.remove(spool_path)
+        except FileNotFoundError:
+            pass
+        _job_lock('pg_advisory_unlock', job.id)
+    return job
+
+
+def process_import_jobs(interval=None):
+    """Run queued jobs one by one, return number of jobs run.
+
+    Whenever the queue is empty, jobs abandoned by dead workers are queued
+    again and rows of data sets left deleted by DELETE /imports/{id} are
+    purged. Returns then, or keeps polling the queue every `interval`
+    seconds.
+    """
+    processed = 0
+    while True:
+        job = claim_import_job()
+        if job is not None:
+            run_import_job(job)
+            processed += 1
+            continue
+        if requeue_abandoned_import_jobs():
+            continue
+        for data_set_id in purge_deleted_data_sets():
+            logger.info('Data set %s is purged', data_set_id)
+        if interval is None:
+            return processed
+        time.sleep(interval)
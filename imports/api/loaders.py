@@ -0,0 +1,135 @@
+import io
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from imports.api.models import Citizen, GenderField, Street, Town
+from imports.api.relatives import get_relatives_storage
+
+CITIZEN_FIELDS = ('citizen_id', 'town', 'street', 'building', 'apartment', 'name',
+                  'birth_date', 'gender')
+
+
+def citizen_timestamp():
+    """Value of audit timestamps of citizens, NULL unless IMPORTS_CITIZEN_TIMESTAMPS is set."""
+    return timezone.now() if settings.IMPORTS_CITIZEN_TIMESTAMPS else None
+
+
+def intern_addresses(citizens):
+    """Interned towns and streets of citizens, mapped by name."""
+    return (Town.objects.intern(cit_data['town'] for cit_data in citizens),
+            Street.objects.intern(cit_data['street'] for cit_data in citizens))
+
+
+class OrmDataSetLoader:
+    """Inserts citizens and relatives of a data set with `bulk_create`."""
+
+    def __init__(self, data_set_id):
+        self.data_set_id = data_set_id
+
+    def load_citizens(self, citizens):
+        """Insert citizens and return mapping of their citizen_id to primary key."""
+        now = citizen_timestamp()
+        towns, streets = intern_addresses(citizens)
+        citizen_models = [Citizen(**{**cit_data,
+                                     'town': towns[cit_data['town']],
+                                     'street': streets[cit_data['street']]},
+                                  data_set_id=self.data_set_id,
+                                  created_at=now, updated_at=now)
+                          for cit_data in citizens]
+        Citizen.objects.bulk_create(citizen_models)
+
+        if connection.features.can_return_ids_from_bulk_insert:
+            return {cit.citizen_id: cit.id for cit in citizen_models}
+
+        return dict(Citizen.objects
+                    .filter(data_set_id=self.data_set_id,
+                            citizen_id__in=[cit.citizen_id for cit in citizen_models])
+                    .values_list('citizen_id', 'id'))
+
+    def load_relatives(self, pairs):
+        """Insert (citizen primary key, relative primary key) pairs of both directions."""
+        storage = get_relatives_storage()
+        fields, rows = storage.load_rows(self.data_set_id, pairs)
+        storage.model.objects.bulk_create(storage.model(**dict(zip(fields, row))) for row in rows)
+
+
+def copy_value(value):
+    """Format value for text format of PostgreSQL COPY."""
+    if value is None:
+        return '\\N'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+class CopyDataSetLoader(OrmDataSetLoader):
+    """Inserts citizens and relatives of a data set with PostgreSQL `COPY FROM STDIN`.
+
+    Primary keys of citizens are reserved from the table sequence by a single
+    query before COPY, so they are known without reading citizens back.
+    """
+
+    def copy(self, model, fields, rows):
+        columns = ', '.join(connection.ops.quote_name(model._meta.get_field(f).column)
+                            for f in fields)
+        sql = f'COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN'
+
+        data = io.StringIO()
+        for row in rows:
+            data.write('\t'.join(copy_value(value) for value in row))
+            data.write('\n')
+        data.seek(0)
+
+        with connection.cursor() as cursor:
+            cursor.copy_expert(sql, data)
+
+    def reserve_ids(self, model, count):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                           'FROM generate_series(1, %s)',
+                           [model._meta.db_table, model._meta.pk.column, count])
+            return [pk for pk, in cursor.fetchall()]
+
+    def load_citizens(self, citizens):
+        if not citizens:
+            return {}
+
+        now = citizen_timestamp()
+        ids = self.reserve_ids(Citizen, len(citizens))
+        # COPY does not prepare values: gender is written as code of GenderField,
+        # town and street as keys of interned names
+        towns, streets = intern_addresses(citizens)
+        other_fields = tuple(f for f in CITIZEN_FIELDS if f not in ('gender', 'town', 'street'))
+        fields = ('id', 'created_at', 'updated_at', 'data_set', 'gender', 'town', 'street')
+        codes = GenderField.CODES
+        self.copy(Citizen, fields + other_fields, (
+            (pk, now, now, self.data_set_id, codes[cit_data['gender']],
+             towns[cit_data['town']].id, streets[cit_data['street']].id)
+            + tuple(cit_data[f] for f in other_fields)
+            for pk, cit_data in zip(ids, citizens)
+        ))
+        return {cit_data['citizen_id']: pk for pk, cit_data in zip(ids, citizens)}
+
+    def load_relatives(self, pairs):
+        storage = get_relatives_storage()
+        self.copy(storage.model, *storage.load_rows(self.data_set_id, pairs))
+
+
+DATA_SET_LOADERS = {
+    'orm': OrmDataSetLoader,
+    'copy': CopyDataSetLoader,
+}
+
+
+def get_data_set_loader(data_set_id):
+    """Loader configured by IMPORTS_DATA_SET_LOADER, `auto` uses COPY on PostgreSQL."""
+    name = settings.IMPORTS_DATA_SET_LOADER
+    if name == 'auto':
+        name = 'copy' if connection.vendor == 'postgresql' else 'orm'
+    return DATA_SET_LOADERS[name](data_set_id)
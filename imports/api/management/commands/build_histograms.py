@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from imports.api.histograms import rebuild_birth_date_histogram
+from imports.api.models import DataSet
+
+
+class Command(BaseCommand):
+    help = ('Count citizens of data sets by town and birth date anew. '
+            'Run after enabling IMPORTS_BIRTH_DATE_HISTOGRAM.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('data_set_ids', nargs='*', type=int,
+                            help='Data sets to rebuild, all by default.')
+
+    def handle(self, *args, data_set_ids, **options):
+        if not data_set_ids:
+            data_set_ids = DataSet.objects.order_by('id').values_list('id', flat=True)
+
+        for data_set_id in data_set_ids:
+            rebuild_birth_date_histogram(data_set_id)
+        self.stdout.write(f'Histograms of {len(data_set_ids)} data sets are rebuilt')
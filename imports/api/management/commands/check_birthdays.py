@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from imports.api.birthdays import birthday_presents_differ, rebuild_birthday_presents
+from imports.api.models import DataSet
+
+
+class Command(BaseCommand):
+    help = ('Compare presents kept in BirthdayPresents with presents counted anew. '
+            'Fails when any data set differs, unless --fix rebuilds them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('data_set_ids', nargs='*', type=int,
+                            help='Data sets to check, all by default.')
+        parser.add_argument('--fix', action='store_true',
+                            help='Rebuild presents of data sets which differ.')
+
+    def handle(self, *args, data_set_ids, fix, **options):
+        if not data_set_ids:
+            data_set_ids = DataSet.objects.order_by('id').values_list('id', flat=True)
+
+        differ = [data_set_id for data_set_id in data_set_ids
+                  if birthday_presents_differ(data_set_id)]
+        for data_set_id in differ:
+            if fix:
+                rebuild_birthday_presents(data_set_id)
+                self.stdout.write(f'Presents of data set {data_set_id} are rebuilt')
+            else:
+                self.stdout.write(f'Presents of data set {data_set_id} differ')
+
+        if differ and not fix:
+            raise CommandError(f'{len(differ)} data sets differ')
+        self.stdout.write(f'{len(data_set_ids)} data sets checked')
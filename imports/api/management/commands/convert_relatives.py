@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from imports.api.relatives import RELATIVES_STORAGES, convert_relatives
+
+
+class Command(BaseCommand):
+    help = ('Move relations of citizens into given storage. '
+            'Set IMPORTS_RELATIVES_STORAGE to the same value afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('storage', choices=sorted(RELATIVES_STORAGES))
+
+    def handle(self, *args, storage, **options):
+        convert_relatives(storage)
+        self.stdout.write(f'Relations are stored as {storage}')
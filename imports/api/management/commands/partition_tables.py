@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from imports.api.models import Citizen
+from imports.api.partitions import is_partitioned, partition_tables
+
+
+class Command(BaseCommand):
+    help = ('Rebuild tables of citizens and relations partitioned by data set. '
+            'Set IMPORTS_PARTITION_DATA_SETS to the same state afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--off', action='store_true',
+                            help='Rebuild tables not partitioned.')
+
+    def handle(self, *args, off, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Tables are partitioned on PostgreSQL only')
+
+        if is_partitioned(Citizen) != off:
+            state = 'not partitioned' if off else 'partitioned'
+            raise CommandError(f'Tables are already {state}')
+
+        partition_tables(partitioned=not off)
+        self.stdout.write('Tables are not partitioned' if off else
+                          'Tables are partitioned by data set')
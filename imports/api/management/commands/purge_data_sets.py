@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from imports.api.operations import purge_deleted_data_sets
+
+
+class Command(BaseCommand):
+    help = ('Remove rows of data sets deleted by DELETE /imports/{id}. Dropping partitions '
+            'with IMPORTS_PARTITION_DATA_SETS blocks all data sets while it lasts. '
+            'Run periodically, or keep running with --interval.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help='Keep purging every INTERVAL seconds.')
+
+    def handle(self, *args, interval, **options):
+        while True:
+            for data_set_id in purge_deleted_data_sets():
+                self.stdout.write(f'Data set {data_set_id} is purged')
+            if interval is None:
+                return
+            time.sleep(interval)
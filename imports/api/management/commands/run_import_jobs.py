@@ -0,0 +1,28 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from imports.api.jobs import process_import_jobs
+
+
+class Command(BaseCommand):
+    help = ('Validate and import payloads queued by POST /imports with IMPORTS_ASYNC_IMPORT '
+            'in a pool of processes. Run periodically, or keep running with --interval.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            help='Number of processes, IMPORTS_JOB_WORKERS by default.')
+        parser.add_argument('--interval', type=float,
+                            help='Keep polling the queue every INTERVAL seconds.')
+
+    def handle(self, *args, workers, interval, **options):
+        workers = workers or settings.IMPORTS_JOB_WORKERS
+        # forked processes must open database connections of their own
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            processed = sum(pool.map(process_import_jobs, [interval] * workers))
+        self.stdout.write(f'{processed} import jobs are run')
@@ -0,0 +1,40 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = ('Report rows, table, indexes and total size of tables of api models. '
+            'Run before and after migrations changing the schema to compare.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Table sizes are reported for PostgreSQL only')
+
+        tables = sorted(model._meta.db_table for model in apps.get_app_config('api').get_models())
+        # partitioned tables (IMPORTS_PARTITION_DATA_SETS) have no storage of their own,
+        # sizes and rows of their partitions are summed up into them
+        with connection.cursor() as cursor:
+            cursor.execute('WITH RECURSIVE tree (root, oid) AS ('
+                           '  SELECT oid, oid FROM pg_class '
+                           '  WHERE relname = ANY(%s) AND relkind IN (%s, %s) '
+                           '  UNION ALL '
+                           '  SELECT t.root, i.inhrelid FROM tree t '
+                           '  JOIN pg_inherits i ON i.inhparent = t.oid'
+                           ') '
+                           'SELECT r.relname, '
+                           '  COALESCE(SUM(GREATEST(c.reltuples, 0)) FILTER ('
+                           '    WHERE c.relkind = %s), 0)::bigint, '
+                           '  SUM(pg_relation_size(c.oid)), SUM(pg_indexes_size(c.oid)), '
+                           '  SUM(pg_total_relation_size(c.oid)) '
+                           'FROM tree t '
+                           'JOIN pg_class r ON r.oid = t.root '
+                           'JOIN pg_class c ON c.oid = t.oid '
+                           'GROUP BY r.relname '
+                           'ORDER BY r.relname',
+                           [tables, 'r', 'p', 'r'])
+            rows = cursor.fetchall()
+
+        self.stdout.write(f'{"table":<24}{"rows":>12}{"table":>12}{"indexes":>12}{"total":>12}')
+        for name, count, table, indexes, total in rows:
+            self.stdout.write(f'{name:<24}{count:>12}{table:>12}{indexes:>12}{total:>12}')
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_auto_20190825_2224'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='revision',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+import django.db.models.expressions
+
+
+def rows_to_pairs(apps, schema_editor):
+    """Keep a single row per relation when data set relations are stored as pairs."""
+    if settings.IMPORTS_RELATIVES_STORAGE != 'pairs':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('INSERT INTO api_citizenpair (low_id, high_id) '
+                       'SELECT citizen_id, relative_id FROM api_citizenrelative '
+                       'WHERE citizen_id < relative_id ORDER BY id')
+        cursor.execute('DELETE FROM api_citizenrelative')
+
+
+def pairs_to_rows(apps, schema_editor):
+    if settings.IMPORTS_RELATIVES_STORAGE != 'pairs':
+        return
+
+    now = timezone.now()
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('INSERT INTO api_citizenrelative '
+                       '(created_at, updated_at, citizen_id, relative_id) '
+                       'SELECT %s, %s, citizen_id, relative_id FROM ('
+                       '  SELECT id, low_id AS citizen_id, high_id AS relative_id '
+                       '  FROM api_citizenpair '
+                       '  UNION ALL '
+                       '  SELECT id, high_id, low_id FROM api_citizenpair'
+                       ') edges ORDER BY id, citizen_id',
+                       [now, now])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_data_set_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CitizenPair',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('high', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='high_pairs', to='api.Citizen')),
+                ('low', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='low_pairs', to='api.Citizen')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='citizenpair',
+            constraint=models.CheckConstraint(check=models.Q(low__lt=django.db.models.expressions.F('high')), name='citizen_pair_ordered'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='citizenpair',
+            unique_together={('low', 'high')},
+        ),
+        migrations.RunPython(rows_to_pairs, pairs_to_rows),
+    ]
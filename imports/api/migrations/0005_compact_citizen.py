@@ -0,0 +1,77 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:44
+
+from django.db import migrations, models
+from django.utils import timezone
+import imports.api.models
+
+
+def fill_timestamps(apps, schema_editor):
+    """Timestamps are NOT NULL again when migrating back."""
+    now = timezone.now()
+    # fire foreign key triggers of the UPDATE before the table is altered
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    schema_editor.execute('UPDATE api_citizen SET created_at = COALESCE(created_at, %s), '
+                          'updated_at = COALESCE(updated_at, %s) '
+                          'WHERE created_at IS NULL OR updated_at IS NULL',
+                          [now, now])
+    schema_editor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_citizen_pair'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='citizen',
+            name='apartment',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='citizen',
+            name='building',
+            field=models.CharField(max_length=256),
+        ),
+        migrations.AlterField(
+            model_name='citizen',
+            name='created_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='created_at'),
+        ),
+        # names of genders are converted to codes of GenderField in place
+        migrations.RunSQL(
+            sql="ALTER TABLE api_citizen ALTER COLUMN gender TYPE smallint "
+                "USING CASE gender WHEN 'male' THEN 1 WHEN 'female' THEN 2 END",
+            reverse_sql="ALTER TABLE api_citizen ALTER COLUMN gender TYPE varchar(128) "
+                        "USING CASE gender WHEN 1 THEN 'male' WHEN 2 THEN 'female' END",
+            state_operations=[
+                migrations.AlterField(
+                    model_name='citizen',
+                    name='gender',
+                    field=imports.api.models.GenderField(choices=[('male', 'male'), ('female', 'female')]),
+                ),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='citizen',
+            name='name',
+            field=models.CharField(max_length=256),
+        ),
+        migrations.AlterField(
+            model_name='citizen',
+            name='street',
+            field=models.CharField(max_length=256),
+        ),
+        migrations.AlterField(
+            model_name='citizen',
+            name='town',
+            field=models.CharField(max_length=256),
+        ),
+        migrations.AlterField(
+            model_name='citizen',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='updated_at'),
+        ),
+        migrations.RunPython(migrations.RunPython.noop, fill_timestamps),
+    ]
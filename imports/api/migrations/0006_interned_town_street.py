@@ -0,0 +1,104 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+import imports.api.models
+
+
+# foreign key triggers of UPDATEs are fired before tables are altered
+INTERN_SQL = '''
+SET CONSTRAINTS ALL IMMEDIATE;
+INSERT INTO api_town (name) SELECT DISTINCT town FROM api_citizen;
+INSERT INTO api_street (name) SELECT DISTINCT street FROM api_citizen;
+UPDATE api_citizen c SET town_interned_id = t.id, street_interned_id = s.id
+FROM api_town t, api_street s
+WHERE t.name = c.town AND s.name = c.street;
+SET CONSTRAINTS ALL DEFERRED;
+'''
+
+RESTORE_SQL = '''
+SET CONSTRAINTS ALL IMMEDIATE;
+UPDATE api_citizen c SET town = t.name, street = s.name
+FROM api_town t, api_street s
+WHERE t.id = c.town_interned_id AND s.id = c.street_interned_id;
+SET CONSTRAINTS ALL DEFERRED;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_compact_citizen'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Street',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Town',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='citizen',
+            name='street_interned',
+            field=imports.api.models.InternedForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.Street'),
+        ),
+        migrations.AddField(
+            model_name='citizen',
+            name='town_interned',
+            field=imports.api.models.InternedForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.Town'),
+        ),
+        migrations.AlterField(
+            model_name='citizen',
+            name='street',
+            field=models.CharField(max_length=256, null=True),
+        ),
+        migrations.AlterField(
+            model_name='citizen',
+            name='town',
+            field=models.CharField(max_length=256, null=True),
+        ),
+        migrations.RunSQL(INTERN_SQL, RESTORE_SQL),
+        migrations.RemoveField(
+            model_name='citizen',
+            name='street',
+        ),
+        migrations.RemoveField(
+            model_name='citizen',
+            name='town',
+        ),
+        migrations.RenameField(
+            model_name='citizen',
+            old_name='street_interned',
+            new_name='street',
+        ),
+        migrations.RenameField(
+            model_name='citizen',
+            old_name='town_interned',
+            new_name='town',
+        ),
+        migrations.AlterField(
+            model_name='citizen',
+            name='street',
+            field=imports.api.models.InternedForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.Street'),
+        ),
+        migrations.AlterField(
+            model_name='citizen',
+            name='town',
+            field=imports.api.models.InternedForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.Town'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# foreign key triggers of UPDATEs are fired before tables are altered
+FILL_SQL = '''
+SET CONSTRAINTS ALL IMMEDIATE;
+UPDATE api_citizenrelative r SET data_set_id = c.data_set_id
+FROM api_citizen c WHERE c.id = r.citizen_id;
+UPDATE api_citizenpair p SET data_set_id = c.data_set_id
+FROM api_citizen c WHERE c.id = p.low_id;
+SET CONSTRAINTS ALL DEFERRED;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_interned_town_street'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='citizenpair',
+            name='data_set',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.DataSet'),
+        ),
+        migrations.AddField(
+            model_name='citizenrelative',
+            name='data_set',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.DataSet'),
+        ),
+        migrations.RunSQL(FILL_SQL, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='citizenpair',
+            name='data_set',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.DataSet'),
+        ),
+        migrations.AlterField(
+            model_name='citizenrelative',
+            name='data_set',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.DataSet'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 16:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_relatives_data_set'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='deleted',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_data_set_deleted'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BirthdayPresents',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('citizen_id', models.BigIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('presents', models.PositiveIntegerField()),
+                ('data_set', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.DataSet')),
+            ],
+            options={
+                'unique_together': {('data_set', 'citizen_id', 'month')},
+            },
+        ),
+    ]
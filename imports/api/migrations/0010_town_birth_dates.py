@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_birthday_presents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TownBirthDates',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('birth_year', models.SmallIntegerField()),
+                ('birth_month_day', models.SmallIntegerField()),
+                ('citizens', models.IntegerField()),
+                ('data_set', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.DataSet')),
+                ('town', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='api.Town')),
+            ],
+            options={
+                'unique_together': {('data_set', 'town', 'birth_year', 'birth_month_day')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:30
+
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_town_birth_dates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created_at')),
+                ('updated_at', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='created_at')),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('validating', 'validating'), ('importing', 'importing'), ('done', 'done'), ('failed', 'failed')], default='queued', max_length=16)),
+                ('spool_name', models.CharField(max_length=256)),
+                ('import_id', models.PositiveIntegerField(null=True)),
+                ('errors', models.TextField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='importjob',
+            index=models.Index(condition=models.Q(status='queued'), fields=['id'], name='import_job_queued'),
+        ),
+    ]
@@ -1,10 +1,116 @@
 from django.db import models
-from django.db.models import F
+from django.db.models import F, Q
+from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
 from django.utils.translation import ugettext_lazy as _
 
 from django_extensions.db.fields import CreationDateTimeField, ModificationDateTimeField
 
 
+class GenderField(models.SmallIntegerField):
+    """Gender stored as a smallint code and represented by its name in Python."""
+    CODES = {'male': 1, 'female': 2}
+    NAMES = {code: name for name, code in CODES.items()}
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else self.NAMES[value]
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return self.NAMES[value]
+
+    def get_prep_value(self, value):
+        return None if value is None else self.CODES[value]
+
+    def select_sql(self, column):
+        """SQL expression reading name of gender stored in `column` in raw queries."""
+        whens = ' '.join(f"WHEN {code} THEN '{name}'" for code, name in self.NAMES.items())
+        return f'CASE {column} {whens} END'
+
+
+class InternedStringManager(models.Manager):
+    def intern(self, names):
+        """Return mapping of names to interned rows, adding missing names in bulk.
+
+        Names are inserted in sorted order, so concurrent transactions adding
+        the same names wait for each other instead of deadlocking.
+        """
+        names = set(names)
+        interned = {row.name: row for row in self.filter(name__in=names)}
+        missing = names - interned.keys()
+        if missing:
+            self.bulk_create([self.model(name=name) for name in sorted(missing)],
+                             ignore_conflicts=True)
+            interned.update((row.name, row) for row in self.filter(name__in=missing))
+        return interned
+
+
+class InternedString(models.Model):
+    """Lookup table of strings repeated by many citizens, shared by all data sets."""
+    class Meta:
+        abstract = True
+
+    name = models.CharField(null=False, blank=False, max_length=256, unique=True)
+
+    objects = InternedStringManager()
+
+    def __str__(self):
+        return self.name
+
+
+class Town(InternedString):
+    pass
+
+
+class Street(InternedString):
+    pass
+
+
+class InternedName(str):
+    """Interned string keeping primary key of its row, as Django expects of related objects."""
+
+    def __new__(cls, name, pk=None):
+        interned = super().__new__(cls, name)
+        interned.pk = interned.id = pk
+        return interned
+
+
+class InternedNameDescriptor(ForwardManyToOneDescriptor):
+    """Reads interned string as `str`, accepts row of the lookup table, interned name or its id.
+
+    Plain strings are rejected: names are interned explicitly, in bulk and
+    in sorted order, by `InternedStringManager.intern`.
+    """
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        interned = super().__get__(instance, cls)
+        return None if interned is None else InternedName(interned.name, interned.pk)
+
+    def __set__(self, instance, value):
+        model = self.field.related_model
+        if isinstance(value, InternedName) and value.pk is not None:
+            value = model(id=value.pk, name=str(value))
+        elif isinstance(value, str):
+            raise ValueError(f'{value!r} is not interned, use {model.__name__}.objects.intern()')
+        elif isinstance(value, int):
+            if self.field.is_cached(instance):
+                self.field.delete_cached_value(instance)
+            setattr(instance, self.field.attname, value)
+            return
+        super().__set__(instance, value)
+
+
+class InternedForeignKey(models.ForeignKey):
+    """Integer key of string interned in `InternedString` table, used as the string itself.
+
+    Queries filter and group by the integer column `<name>_id`, strings are
+    joined back only to render them.
+    """
+    forward_related_accessor_class = InternedNameDescriptor
+
+
 class CreatedUpdatedMixin(models.Model):
     class Meta:
         abstract = True
@@ -13,8 +119,20 @@ class CreatedUpdatedMixin(models.Model):
     updated_at = ModificationDateTimeField(_('created_at'))
 
 
+class DataSetManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted=False)
+
+
 class DataSet(CreatedUpdatedMixin, models.Model):
-    objects = models.Manager()
+    # bumped by every change of data set citizens, used as ETag of read views
+    revision = models.PositiveIntegerField(null=False, default=1)
+    # set by deletion, rows of deleted data set wait for `purge_data_set`
+    deleted = models.BooleanField(null=False, default=False)
+
+    # data sets not deleted, `all_objects` includes the ones waiting to be purged
+    objects = DataSetManager()
+    all_objects = models.Manager()
 
 
 class Citizen(CreatedUpdatedMixin, models.Model):
@@ -28,21 +146,36 @@ class Citizen(CreatedUpdatedMixin, models.Model):
         (GENDER_FEMALE, GENDER_FEMALE),
     )
 
+    # set only with IMPORTS_CITIZEN_TIMESTAMPS, NULL takes no space in a row
+    created_at = models.DateTimeField(_('created_at'), null=True, blank=True)
+    updated_at = models.DateTimeField(_('updated_at'), null=True, blank=True)
+
     citizen_id = models.BigIntegerField(null=False)
-    town = models.CharField(null=False, blank=False, max_length=2048)
-    street = models.CharField(null=False, blank=False, max_length=2048)
-    building = models.CharField(null=False, blank=False, max_length=2048)
-    apartment = models.BigIntegerField(null=False)
-    name = models.CharField(null=False, blank=False, max_length=2048)
+    town = InternedForeignKey(to='Town', on_delete=models.PROTECT, related_name='+',
+                              db_index=False)
+    street = InternedForeignKey(to='Street', on_delete=models.PROTECT, related_name='+',
+                                db_index=False)
+    building = models.CharField(null=False, blank=False, max_length=256)
+    apartment = models.IntegerField(null=False)
+    name = models.CharField(null=False, blank=False, max_length=256)
     birth_date = models.DateField(null=False)
-    gender = models.CharField(null=False, choices=GENDER_CHOICES, max_length=128)
+    gender = GenderField(null=False, choices=GENDER_CHOICES)
 
     data_set = models.ForeignKey(to='DataSet', on_delete=models.CASCADE, related_name='citizens')
     relatives = models.ManyToManyField(through='CitizenRelative', to='Citizen')
 
     @property
     def relatives_ids(self):
-        return list(self.relatives.values_list('citizen_id', flat=True))
+        if getattr(self, '_relatives_ids', None) is not None:
+            return self._relatives_ids
+
+        from imports.api.relatives import get_relatives_storage
+        return [rid for _, rid in get_relatives_storage().citizen_edges(self.data_set_id, self.id)]
+
+    @relatives_ids.setter
+    def relatives_ids(self, value):
+        """Set citizen_id of relatives already known, e.g. right after update."""
+        self._relatives_ids = value
 
     def __str__(self):
         return (f"<Citizen dataset: {self.data_set_id}, "
@@ -53,7 +186,7 @@ class Citizen(CreatedUpdatedMixin, models.Model):
 class CitizenRelativeManager(models.Manager):
     def get_birthdays(self, data_set_id):
         data = list(self.filter(
-                citizen__data_set_id=data_set_id).annotate(
+                data_set_id=data_set_id).annotate(
                 relative_birth_date=F('relative__birth_date'),
                 cid=F('citizen__citizen_id'),
                 rid=F('relative__citizen_id')
@@ -73,9 +206,110 @@ class CitizenRelative(CreatedUpdatedMixin, models.Model):
     class Meta:
         unique_together = (('citizen', 'relative'),)
 
+    # data set of both citizens, key of partitions when tables are partitioned by data set
+    data_set = models.ForeignKey('DataSet', null=False, on_delete=models.CASCADE,
+                                 related_name='+', db_index=False)
     citizen = models.ForeignKey('Citizen', null=False, on_delete=models.CASCADE,
                                 related_name='to_citizen_relatives')
     relative = models.ForeignKey('Citizen', null=False, on_delete=models.CASCADE,
                                  related_name='from_citizen_relatives')
 
     objects = CitizenRelativeManager()
+
+    def save(self, *args, **kwargs):
+        if self.data_set_id is None:
+            self.data_set_id = self.citizen.data_set_id
+        super().save(*args, **kwargs)
+
+
+class CitizenPair(models.Model):
+    """Relation of two citizens stored as a single row, `low` has the smaller primary key.
+
+    Used instead of `CitizenRelative` when IMPORTS_RELATIVES_STORAGE is 'pairs'.
+    """
+    class Meta:
+        unique_together = (('low', 'high'),)
+        constraints = [
+            models.CheckConstraint(check=Q(low__lt=F('high')), name='citizen_pair_ordered'),
+        ]
+
+    data_set = models.ForeignKey('DataSet', null=False, on_delete=models.CASCADE,
+                                 related_name='+', db_index=False)
+    low = models.ForeignKey('Citizen', null=False, on_delete=models.CASCADE,
+                            related_name='low_pairs')
+    high = models.ForeignKey('Citizen', null=False, on_delete=models.CASCADE,
+                             related_name='high_pairs')
+
+    def save(self, *args, **kwargs):
+        if self.data_set_id is None:
+            self.data_set_id = self.low.data_set_id
+        super().save(*args, **kwargs)
+
+
+class BirthdayPresents(models.Model):
+    """Presents citizen buys relatives born in a month, kept with IMPORTS_MATERIALIZED_BIRTHDAYS.
+
+    `citizen_id` is citizen_id of the buying citizen in data set, rows are
+    read in order of the unique key without joining citizens.
+    """
+    class Meta:
+        unique_together = (('data_set', 'citizen_id', 'month'),)
+
+    data_set = models.ForeignKey('DataSet', null=False, on_delete=models.CASCADE,
+                                 related_name='+', db_index=False)
+    citizen_id = models.BigIntegerField(null=False)
+    month = models.PositiveSmallIntegerField(null=False)
+    presents = models.PositiveIntegerField(null=False)
+
+
+class TownBirthDates(models.Model):
+    """Number of citizens of a town born on a date, kept with IMPORTS_BIRTH_DATE_HISTOGRAM.
+
+    Dates are split into year and `month * 100 + day`, from which ages are
+    derived by integer arithmetic as `calculate_ages` does.
+    """
+    class Meta:
+        unique_together = (('data_set', 'town', 'birth_year', 'birth_month_day'),)
+
+    data_set = models.ForeignKey('DataSet', null=False, on_delete=models.CASCADE,
+                                 related_name='+', db_index=False)
+    town = models.ForeignKey('Town', null=False, on_delete=models.PROTECT, related_name='+',
+                             db_index=False)
+    birth_year = models.SmallIntegerField(null=False)
+    birth_month_day = models.SmallIntegerField(null=False)
+    # changed by signed deltas, emptied rows are deleted
+    citizens = models.IntegerField(null=False)
+
+
+class ImportJob(CreatedUpdatedMixin, models.Model):
+    """POST /imports payload spooled to a file, imported by `manage.py run_import_jobs`.
+
+    Used with IMPORTS_ASYNC_IMPORT, `status` goes from queued through
+    validating and importing to done or failed.
+    """
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], name='import_job_queued', condition=Q(status='queued')),
+        ]
+
+    STATUS_QUEUED = 'queued'
+    STATUS_VALIDATING = 'validating'
+    STATUS_IMPORTING = 'importing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_QUEUED, STATUS_QUEUED),
+        (STATUS_VALIDATING, STATUS_VALIDATING),
+        (STATUS_IMPORTING, STATUS_IMPORTING),
+        (STATUS_DONE, STATUS_DONE),
+        (STATUS_FAILED, STATUS_FAILED),
+    )
+
+    status = models.CharField(null=False, max_length=16, choices=STATUS_CHOICES,
+                              default=STATUS_QUEUED)
+    # name of the payload file in IMPORTS_JOB_SPOOL_PATH, removed when job is finished
+    spool_name = models.CharField(null=False, max_length=256)
+    # not a foreign key, data set may be deleted and purged afterwards
+    import_id = models.PositiveIntegerField(null=True)
+    # JSON of the 400 response body POST /imports would return
+    errors = models.TextField(null=True)
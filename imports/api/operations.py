@@ -1,22 +1,68 @@
 import logging
+import random
+import time
+from array import array
 from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime
 
 import numpy as np
-from django.db import transaction
-from django.db.models import Q
-
-from imports.api.models import DataSet, Citizen, CitizenRelative
-from imports.utils import calculate_age
+from django.conf import settings
+from django.db import DatabaseError, transaction, connection
+from django.db.models import Count, F
+from django.db.models.functions import ExtractDay, ExtractMonth, ExtractYear
+
+from imports.api.birthdays import (fill_birthday_presents, read_birthday_presents,
+                                   refresh_birthday_presents, )
+from imports.api.cache import invalidate_data_set
+from imports.api.histograms import (adjust_birth_date_histogram, fill_birth_date_histogram,
+                                    histogram_changes, histogram_key, read_town_ages, )
+from imports.api.loaders import citizen_timestamp, get_data_set_loader, intern_addresses
+from imports.api.models import (DataSet, BirthdayPresents, Citizen, CitizenPair, CitizenRelative,
+                                GenderField, InternedForeignKey, Street, Town, TownBirthDates, )
+from imports.api.partitions import drop_partitions, new_data_set_partitions
+from imports.api.relatives import get_relatives_storage
+from imports.api.snapshots import get_snapshot
+from imports.utils import (calculate_age, calculate_ages, chunked, grouped_percentiles,
+                           grouped_weighted_percentiles, )
 
 logger = logging.getLogger(__name__)
 
 
+@contextmanager
+def _new_data_set_id():
+    """Id of a new data set, None for the next one of the sequence.
+
+    With IMPORTS_PARTITION_DATA_SETS its partitions are committed before the
+    import transaction and dropped if the import fails.
+    """
+    if settings.IMPORTS_PARTITION_DATA_SETS:
+        with new_data_set_partitions() as data_set_id:
+            yield data_set_id
+    else:
+        yield None
+
+
+def create_dataset(citizens, on_created=None):
+    """Create data set of validated citizens, return its id.
+
+    Towns and streets are interned before the import transaction, each
+    statement committed on its own when not called in a transaction. The
+    import then only reads their rows, and concurrent imports of the same
+    new names do not wait for each other until commit. `on_created` is
+    called with id of data set in the import transaction.
+    """
+    intern_addresses(citizens)
+    with _new_data_set_id() as data_set_id:
+        return _create_dataset(data_set_id, citizens, on_created)
+
+
 @transaction.atomic
-def create_dataset(citizens):
-    data_set = DataSet.objects.create()
+def _create_dataset(data_set_id, citizens, on_created):
+    data_set = DataSet.objects.create(id=data_set_id)
+    loader = get_data_set_loader(data_set.id)
 
-    citizen_models = []
+    citizen_rows = []
     citizen_pairs = []
     for cit_data in citizens:
 
@@ -25,63 +71,475 @@ def create_dataset(citizens):
             citizen_pairs.append((cid, rid))
 
         cit_data.pop('relatives')
-        cit = Citizen(**cit_data)
-        cit.data_set = data_set
-        citizen_models.append(cit)
+        citizen_rows.append(cit_data)
 
-    Citizen.objects.bulk_create(citizen_models)
+    ids = loader.load_citizens(citizen_rows)
 
     # insert into many-to-many relationship
-    ids = {}
-    citizen_ids = (Citizen.objects
-                   .filter(data_set=data_set).values_list('id', 'citizen_id'))
-    for cid, citizen_id in citizen_ids:
-        ids[citizen_id] = cid
+    loader.load_relatives((ids[citizen_id], ids[relative_id])
+                          for citizen_id, relative_id in citizen_pairs)
+
+    if settings.IMPORTS_MATERIALIZED_BIRTHDAYS:
+        fill_birthday_presents(data_set.id)
+    if settings.IMPORTS_BIRTH_DATE_HISTOGRAM:
+        fill_birth_date_histogram(data_set.id)
+    if on_created is not None:
+        on_created(data_set.id)
+    return data_set.id
+
+
+def create_dataset_from_stream(citizens, batch_size=1000, on_created=None):
+    """Create data set from iterable of validated citizens.
+
+    Citizens are inserted by batches of `batch_size` as they come, only ids
+    of citizens and pairs of relatives are kept until all citizens are
+    inserted and relatives can be linked. `on_created` is called with id of
+    data set in the import transaction.
+    """
+    with _new_data_set_id() as data_set_id:
+        return _create_dataset_from_stream(data_set_id, citizens, batch_size, on_created)
 
-    citizen_relatives = []  # pair to insert into CitizenRelative table
-    for citizen_id, relative_id in citizen_pairs:
-        cid, rid = ids[citizen_id], ids[relative_id]
-        citizen_relatives.append(CitizenRelative(citizen_id=cid, relative_id=rid))
-    CitizenRelative.objects.bulk_create(citizen_relatives)
 
+@transaction.atomic
+def _create_dataset_from_stream(data_set_id, citizens, batch_size, on_created):
+    data_set = DataSet.objects.create(id=data_set_id)
+    loader = get_data_set_loader(data_set.id)
+
+    ids = {}
+    citizen_pairs = array('q')  # flat sequence of (citizen_id, relative_id)
+    for batch in chunked(citizens, batch_size):
+        for cit_data in batch:
+            cid = cit_data['citizen_id']
+            for rid in set(cit_data.pop('relatives')):
+                citizen_pairs.extend((cid, rid))
+
+        ids.update(loader.load_citizens(batch))
+
+    pairs = iter(citizen_pairs)
+    for batch in chunked(zip(pairs, pairs), batch_size):
+        loader.load_relatives((ids[citizen_id], ids[relative_id])
+                              for citizen_id, relative_id in batch)
+
+    if settings.IMPORTS_MATERIALIZED_BIRTHDAYS:
+        fill_birthday_presents(data_set.id)
+    if settings.IMPORTS_BIRTH_DATE_HISTOGRAM:
+        fill_birth_date_histogram(data_set.id)
+    if on_created is not None:
+        on_created(data_set.id)
     return data_set.id
 
 
+def _purge_sql():
+    citizens = Citizen._meta.db_table
+    # relations are found by indexed keys of their citizens, data_set_id prunes partitions
+    return [f'DELETE FROM {CitizenRelative._meta.db_table} WHERE data_set_id = %(data_set_id)s '
+            f'AND citizen_id IN (SELECT id FROM {citizens} WHERE data_set_id = %(data_set_id)s)',
+            f'DELETE FROM {CitizenPair._meta.db_table} WHERE data_set_id = %(data_set_id)s '
+            f'AND low_id IN (SELECT id FROM {citizens} WHERE data_set_id = %(data_set_id)s)',
+            f'DELETE FROM {citizens} WHERE data_set_id = %(data_set_id)s',
+            f'DELETE FROM {BirthdayPresents._meta.db_table} WHERE data_set_id = %(data_set_id)s',
+            f'DELETE FROM {TownBirthDates._meta.db_table} WHERE data_set_id = %(data_set_id)s',
+            f'DELETE FROM {DataSet._meta.db_table} WHERE id = %(data_set_id)s']
+
+
+@transaction.atomic
+def purge_data_set(data_set_id):
+    """Remove rows of data set marked deleted, without loading them as Django's CASCADE does.
+
+    Partitions of data set are dropped, which blocks reads and writes of
+    all data sets until commit, other tables are cleaned by set-based
+    DELETEs.
+    """
+    if settings.IMPORTS_PARTITION_DATA_SETS:
+        drop_partitions(data_set_id)
+    with connection.cursor() as cursor:
+        for sql in _purge_sql():
+            cursor.execute(sql, {'data_set_id': data_set_id})
+
+
+def purge_deleted_data_sets():
+    """Purge all data sets marked deleted, each in its own transaction, return their ids."""
+    data_set_ids = list(DataSet.all_objects.filter(deleted=True).order_by('id')
+                        .values_list('id', flat=True))
+    for data_set_id in data_set_ids:
+        purge_data_set(data_set_id)
+    return data_set_ids
+
+
+def delete_dataset(data_set_id):
+    """Delete data set, return whether its rows are already removed.
+
+    Data set is marked deleted first in a transaction of its own: from then
+    on it is not found and changes of it which are in progress fail on
+    `bump_revision`. Rows are purged right away when data set has less than
+    IMPORTS_DELETE_ASYNC_MIN_CITIZENS citizens, otherwise they are left to
+    `purge_deleted_data_sets`. Partitions are always left to it, as dropping
+    them locks partitioned tables of all data sets exclusively.
+    """
+    with transaction.atomic():
+        if not DataSet.objects.filter(id=data_set_id).update(deleted=True):
+            raise DataSet.DoesNotExist(f'Data set {data_set_id} does not exist')
+        transaction.on_commit(lambda: invalidate_data_set(data_set_id))
+
+    min_citizens = settings.IMPORTS_DELETE_ASYNC_MIN_CITIZENS
+    if settings.IMPORTS_PARTITION_DATA_SETS:
+        return False
+    if min_citizens is not None:
+        citizens = Citizen.objects.filter(data_set_id=data_set_id)
+        if citizens[:min_citizens].count() == min_citizens:
+            return False
+
+    purge_data_set(data_set_id)
+    return True
+
+
+class RevisionConflict(Exception):
+    """Data set revision differs from the one the change was based on."""
+
+
+class ConcurrentUpdate(Exception):
+    """Relations changed while citizens were being locked, transaction can be retried."""
+
+
+RETRYABLE_SQLSTATES = ('40001', '40P01')  # serialization_failure, deadlock_detected
+
+
+def is_retryable(exc):
+    if isinstance(exc, ConcurrentUpdate):
+        return True
+    return getattr(exc.__cause__, 'pgcode', None) in RETRYABLE_SQLSTATES
+
+
+def retry_on_conflict(func, *args, retries=3, delay=0.05, **kwargs):
+    """Call transactional `func`, retrying it on serialization failures and deadlocks.
+
+    Attempts are separated by exponential backoff with jitter. Nothing is
+    retried inside an outer transaction, which is aborted by the failure.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except (DatabaseError, ConcurrentUpdate) as exc:
+            if attempt == retries or connection.in_atomic_block or not is_retryable(exc):
+                raise
+            logger.warning('Retry %s after %r', func.__name__, exc)
+        time.sleep(delay * 2 ** attempt * random.uniform(0.5, 1))
+
+
+def _lock_citizens(data_set_id, ids):
+    """Lock rows of citizens in order of primary keys, so concurrent updates can not deadlock."""
+    return {c.id: c for c in (Citizen.objects
+                              .filter(data_set_id=data_set_id, id__in=ids).order_by('id')
+                              .select_related('town', 'street')
+                              .select_for_update(of=('self',)))}
+
+
+def _intern_addresses(citizens_data):
+    """Replace names of towns and streets in citizens data with interned rows."""
+    towns = Town.objects.intern(data['town'] for data in citizens_data if 'town' in data)
+    streets = Street.objects.intern(data['street'] for data in citizens_data if 'street' in data)
+    for data in citizens_data:
+        if 'town' in data:
+            data['town'] = towns[data['town']]
+        if 'street' in data:
+            data['street'] = streets[data['street']]
+
+
 @transaction.atomic
-def update_citizen(data_set_id, citizen_id, citizen_data):
+def update_citizen(data_set_id, citizen_id, citizen_data, lock=False, revision=None):
+    """Update citizen and return it with `relatives_ids` known without extra queries.
+
+    With `lock` rows of the citizen and of its old and new relatives are
+    locked in order of primary keys before any change. With `revision` the
+    change is applied only to that revision of the data set.
+    """
     data_set = DataSet.objects.get(id=data_set_id)
-    citizen = Citizen.objects.get(data_set=data_set, citizen_id=citizen_id)
+    citizen = (Citizen.objects.select_related('town', 'street')
+               .get(data_set=data_set, citizen_id=citizen_id))
+    citizen_data = dict(citizen_data)
     relatives = citizen_data.pop('relatives', None)
-    Citizen.objects.filter(data_set_id=data_set_id, citizen_id=citizen_id).update(**citizen_data)
+    _intern_addresses([citizen_data])
+
+    storage = get_relatives_storage()
+    current = storage.citizen_edges(data_set_id, citizen.id)
 
     if relatives is not None:
-        # check all specified relatives exist in data set
-        relatives = set(relatives)
-        existing_relatives = (Citizen.objects
-                              .filter(data_set_id=data_set_id, citizen_id__in=relatives)
-                              .values_list('citizen_id', flat=True))
-        non_existing = set(relatives) - set(existing_relatives)
+        # resolve primary keys of specified relatives, checking all of them exist in data set
+        relatives = list(dict.fromkeys(relatives))
+        relative_ids = dict(Citizen.objects
+                            .filter(data_set_id=data_set_id, citizen_id__in=relatives)
+                            .values_list('citizen_id', 'id'))
+        non_existing = set(relatives) - relative_ids.keys()
         if non_existing:
             raise Citizen.DoesNotExist(f'No citizen with citizen_id in {non_existing}')
 
-        # clean all relatives info involving citizen
-        CitizenRelative.objects.filter(Q(citizen=citizen) | Q(relative=citizen)).delete()
+    if lock:
+        ids = {citizen.id} | {pk for pk, _ in current}
+        if relatives is not None:
+            ids |= set(relative_ids.values())
+        citizen = _lock_citizens(data_set_id, ids)[citizen.id]
+        current = storage.citizen_edges(data_set_id, citizen.id)
+        if not {pk for pk, _ in current} <= ids:
+            raise ConcurrentUpdate(f'Relatives of citizen {citizen_id} changed')
+
+    if citizen_data and settings.IMPORTS_CITIZEN_TIMESTAMPS:
+        citizen_data['updated_at'] = citizen_timestamp()
+    Citizen.objects.filter(data_set_id=data_set_id, id=citizen.id).update(**citizen_data)
+    old_key = histogram_key(citizen)
+    for field, value in citizen_data.items():
+        setattr(citizen, field, value)
+    if settings.IMPORTS_BIRTH_DATE_HISTOGRAM:
+        adjust_birth_date_histogram(data_set_id, histogram_changes([old_key],
+                                                                   [histogram_key(citizen)]))
+
+    if relatives is None:
+        citizen.relatives_ids = [rid for _, rid in current]
+    else:
+        new_ids = set(relative_ids.values())
+        current_ids = {pk for pk, _ in current}
+
+        removed_ids = current_ids - new_ids
+        if removed_ids:
+            storage.delete_edges(data_set_id, citizen.id, removed_ids)
+
+        added = [rid for rid in relatives if relative_ids[rid] not in current_ids]
+        if added:
+            storage.insert(data_set_id, [(citizen.id, relative_ids[rid]) for rid in added])
+
+        # same order as listing of citizens: by creation of edges
+        citizen.relatives_ids = [rid for pk, rid in current if pk in new_ids] + added
+
+    if settings.IMPORTS_MATERIALIZED_BIRTHDAYS and ('birth_date' in citizen_data or
+                                                    relatives is not None):
+        # presents of the citizen and of its old and new relatives
+        pks = {citizen.id} | {pk for pk, _ in current}
+        if relatives is not None:
+            pks |= set(relative_ids.values())
+        refresh_birthday_presents(data_set_id, pks)
+
+    bump_revision(data_set_id, revision)
+    return citizen
+
 
-        # new relatives for citizen
-        new_relatives = Citizen.objects.filter(data_set_id=data_set_id, citizen_id__in=relatives)
+def _update_citizen_rows(data_set_id, citizens, fields):
+    """Write `fields` of citizens of data set with `UPDATE ... FROM (VALUES ...)` statements."""
+    if connection.vendor != 'postgresql':
+        Citizen.objects.bulk_update(citizens, fields, batch_size=1000)
+        return
 
-        citizen_relatives = []
-        for c in new_relatives:
-            citizen_relatives.extend([
-                CitizenRelative(citizen=citizen, relative=c),
-                CitizenRelative(citizen=c, relative=citizen),
+    qn = connection.ops.quote_name
+    model_fields = [Citizen._meta.get_field(f) for f in fields]
+    columns = [qn(f.column) for f in model_fields]
+    assignments = ', '.join(f'{c} = v.{c}' for c in columns)
+    placeholders = ', '.join(['%s'] + [f'%s::{f.cast_db_type(connection)}' for f in model_fields])
 
-            ])
+    for batch in chunked(citizens, 1000):
+        values = ', '.join(f'({placeholders})' for _ in batch)
+        params = []
+        for citizen in batch:
+            params.append(citizen.id)
+            params.extend(f.get_db_prep_value(getattr(citizen, f.attname), connection)
+                          for f in model_fields)
 
-        CitizenRelative.objects.bulk_create(citizen_relatives)
+        with connection.cursor() as cursor:
+            cursor.execute(f'UPDATE {qn(Citizen._meta.db_table)} c SET {assignments} '
+                           f'FROM (VALUES {values}) AS v (id, {", ".join(columns)}) '
+                           f'WHERE c.id = v.id AND c.data_set_id = %s',
+                           params + [data_set_id])
 
-    citizen.refresh_from_db()
-    return citizen
+
+@transaction.atomic
+def update_citizens(data_set_id, citizens_data, lock=False, revision=None):
+    """Update many citizens with the same result as consecutive `update_citizen` calls.
+
+    Fields of all citizens are written by set-based UPDATE, relatives of the
+    whole batch are reconciled with a single DELETE and a single INSERT.
+    Returned citizens (in order of `citizens_data`) have `relatives_ids` known
+    and reflect the state after the whole batch. `lock` and `revision` are
+    the same as for `update_citizen`.
+    """
+    data_set = DataSet.objects.get(id=data_set_id)
+
+    citizen_ids = [data['citizen_id'] for data in citizens_data]
+    relatives = {rid for data in citizens_data for rid in data.get('relatives', ())}
+    citizens = {c.citizen_id: c for c in Citizen.objects.select_related('town', 'street').filter(
+            data_set=data_set, citizen_id__in=set(citizen_ids) | relatives)}
+    non_existing = (set(citizen_ids) | relatives) - citizens.keys()
+    if non_existing:
+        raise Citizen.DoesNotExist(f'No citizen with citizen_id in {non_existing}')
+
+    storage = get_relatives_storage()
+    batch_ids = [citizens[cid].id for cid in citizen_ids]
+    rows = storage.batch_edges(data_set_id, batch_ids)
+
+    if lock:
+        ids = {c.id for c in citizens.values()} | {rid for _, _, rid, _ in rows}
+        locked = _lock_citizens(data_set_id, ids)
+        citizens = {c.citizen_id: locked[c.id] for c in citizens.values()}
+        rows = storage.batch_edges(data_set_id, batch_ids)
+        if not {rid for _, _, rid, _ in rows} <= ids:
+            raise ConcurrentUpdate('Relatives of updated citizens changed')
+
+    citizens_data = [dict(data) for data in citizens_data]
+    _intern_addresses(citizens_data)
+    old_keys = {cid: histogram_key(citizens[cid]) for cid in citizen_ids}
+    fields = set()
+    for data in citizens_data:
+        citizen = citizens[data['citizen_id']]
+        for field, value in data.items():
+            if field not in ('citizen_id', 'relatives'):
+                setattr(citizen, field, value)
+                fields.add(field)
+
+    batch = [citizens[cid] for cid in citizen_ids]
+    if fields and settings.IMPORTS_CITIZEN_TIMESTAMPS:
+        now = citizen_timestamp()
+        for citizen in batch:
+            citizen.updated_at = now
+        fields.add('updated_at')
+    if fields:
+        _update_citizen_rows(data_set_id, batch, sorted(fields))
+    if settings.IMPORTS_BIRTH_DATE_HISTOGRAM:
+        adjust_birth_date_histogram(data_set_id, histogram_changes(
+                old_keys.values(), [histogram_key(citizens[cid]) for cid in old_keys]))
+
+    def edge(a, b):
+        return (a, b) if a < b else (b, a)
+
+    pk_to_citizen_id = {c.id: c.citizen_id for c in citizens.values()}
+    neighbours = defaultdict(set)
+    for _, cid, rid, relative_citizen_id in rows:
+        pk_to_citizen_id[rid] = relative_citizen_id
+        neighbours[cid].add(rid)
+
+    # replay relatives updates in order, only edges touching the batch can change; as
+    # consecutive calls do, an edge is created when a citizen lists a new relative, and
+    # edges listed again are kept as they are
+    created = {}  # ordered set of edges created by the batch
+    for data in citizens_data:
+        if 'relatives' not in data:
+            continue
+        pk = citizens[data['citizen_id']].id
+        new_ids = [citizens[cid].id for cid in dict.fromkeys(data['relatives'])]
+        for rid in neighbours[pk] - set(new_ids):
+            neighbours[pk].discard(rid)
+            neighbours[rid].discard(pk)
+            created.pop(edge(pk, rid), None)
+        for rid in new_ids:
+            if rid not in neighbours[pk]:
+                neighbours[pk].add(rid)
+                neighbours[rid].add(pk)
+                created[edge(pk, rid)] = None
+
+    final = {edge(pk, rid) for pk, ids in neighbours.items() for rid in ids}
+    added = list(created)
+
+    # edges removed and created again get new rows, as with consecutive calls
+    removed = {row_id for row_id, cid, rid, _ in rows
+               if edge(cid, rid) not in final or edge(cid, rid) in created}
+    if removed:
+        storage.delete(data_set_id, removed)
+
+    if added:
+        storage.insert(data_set_id, added)
+
+    # same order as listing of citizens: by creation of edges
+    relatives_of = defaultdict(list)
+    for _, cid, rid, _ in rows:
+        if edge(cid, rid) in final and edge(cid, rid) not in created:
+            relatives_of[cid].append(rid)
+    for a, b in added:
+        relatives_of[a].append(b)
+        relatives_of[b].append(a)
+
+    for citizen in batch:
+        citizen.relatives_ids = [pk_to_citizen_id[rid] for rid in relatives_of[citizen.id]]
+
+    changed = [citizens[data['citizen_id']].id for data in citizens_data
+               if 'birth_date' in data or 'relatives' in data]
+    if settings.IMPORTS_MATERIALIZED_BIRTHDAYS and changed:
+        # presents of changed citizens and of ends of edges touching the batch before and after
+        pks = set(changed) | {pk for _, cid, rid, _ in rows for pk in (cid, rid)}
+        pks |= {pk for e in added for pk in e}
+        refresh_birthday_presents(data_set_id, pks)
+
+    bump_revision(data_set.id, revision)
+    return batch
+
+
+def bump_revision(data_set_id, revision=None):
+    """Increment revision of data set, must be called in the transaction changing it.
+
+    Being the last lock taken by a change, the data set row serializes
+    concurrent changes without lock cycles. If `revision` is given and the
+    data set is at another one, `RevisionConflict` is raised. If data set
+    was deleted meanwhile, `DataSet.DoesNotExist` is raised.
+    """
+    data_sets = DataSet.objects.filter(id=data_set_id)
+    if revision is not None:
+        data_sets = data_sets.filter(revision=revision)
+    if not data_sets.update(revision=F('revision') + 1):
+        if revision is None or not DataSet.objects.filter(id=data_set_id).exists():
+            raise DataSet.DoesNotExist(f'Data set {data_set_id} does not exist')
+        raise RevisionConflict(f'Data set {data_set_id} is not at revision {revision}')
+    transaction.on_commit(lambda: invalidate_data_set(data_set_id))
+
+
+CITIZEN_LISTING_FIELDS = ('citizen_id', 'town', 'street', 'building', 'apartment', 'name',
+                          'birth_date', 'gender')
+
+
+def _list_citizens_sql():
+    qn = connection.ops.quote_name
+    citizen_table = qn(Citizen._meta.db_table)
+    columns = []
+    joins = ''
+    for field in (Citizen._meta.get_field(f) for f in CITIZEN_LISTING_FIELDS):
+        column = f'c.{qn(field.column)}'
+        if isinstance(field, GenderField):
+            column = field.select_sql(column)
+        elif isinstance(field, InternedForeignKey):
+            # interned names are joined only to render them
+            alias = qn(field.name)
+            joins += (f'JOIN {qn(field.related_model._meta.db_table)} {alias} '
+                      f'ON {alias}.id = {column} ')
+            column = f'{alias}.name'
+        columns.append(column)
+
+    return (f'SELECT {", ".join(columns)}, ARRAY('
+            f'  SELECT r.citizen_id FROM ({get_relatives_storage().directed_sql()}) cr'
+            f'  JOIN {citizen_table} r'
+            f'    ON r.id = cr.relative_id AND r.data_set_id = %(data_set_id)s'
+            f'  WHERE cr.citizen_id = c.id AND cr.data_set_id = %(data_set_id)s'
+            f'  ORDER BY cr.id'
+            f') '
+            f'FROM {citizen_table} c '
+            f'{joins}'
+            f'WHERE c.data_set_id = %(data_set_id)s '
+            f'ORDER BY c.citizen_id')
+
+
+def list_citizens(data_set_id):
+    """List citizens of data set ordered by citizen_id with a single query.
+
+    Returns tuples of `CITIZEN_LISTING_FIELDS` values followed by a list of
+    relatives citizen_ids, aggregated with `ARRAY` in the same statement and
+    ordered as relations were inserted.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(_list_citizens_sql(), {'data_set_id': data_set_id})
+        return cursor.fetchall()
+
+
+def iter_citizens(data_set_id, batch_size=1000):
+    """Yield rows of `list_citizens` by batches read from a server-side cursor."""
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(_list_citizens_sql(), {'data_set_id': data_set_id})
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
 
 
 def get_birthday_stats(data_set_id):
@@ -116,12 +574,14 @@ def get_birthday_stats2(data_set_id):
         for month in range(1, 12 + 1)
     }
 
-    citizens = Citizen.objects.filter(
-            data_set_id=data_set_id).prefetch_related('relatives').all()
-    for citizen in citizens:
-        for relative in citizen.relatives.all():
-            month = str(citizen.birth_date.month)
-            presents_count[month][relative.citizen_id] += 1
+    storage = get_relatives_storage()
+    for citizen, relative in storage.directions:
+        edges = (storage.model.objects
+                 .filter(data_set_id=data_set_id, **{f'{citizen}__data_set_id': data_set_id,
+                                                     f'{relative}__data_set_id': data_set_id})
+                 .values_list(f'{citizen}__birth_date', f'{relative}__citizen_id'))
+        for birth_date, relative_id in edges:
+            presents_count[str(birth_date.month)][relative_id] += 1
 
     result = {
         str(month): []
@@ -138,10 +598,38 @@ def get_birthday_stats2(data_set_id):
     return result
 
 
+def get_birthday_stats_sql(data_set_id):
+    """Same as `get_birthday_stats2`, presents are counted by GROUP BY query per direction."""
+    storage = get_relatives_storage()
+    presents_count = defaultdict(int)
+    for citizen, relative in storage.directions:
+        counts = (storage.model.objects
+                  .filter(data_set_id=data_set_id, **{f'{citizen}__data_set_id': data_set_id,
+                                                      f'{relative}__data_set_id': data_set_id})
+                  .annotate(month=ExtractMonth(f'{citizen}__birth_date'))
+                  .values_list('month', f'{relative}__citizen_id')
+                  .annotate(presents=Count('id')))
+        for month, citizen_id, presents in counts:
+            presents_count[month, citizen_id] += presents
+
+    result = {
+        str(month): []
+        for month in range(1, 12 + 1)
+    }
+
+    for (month, citizen_id), presents in sorted(presents_count.items()):
+        result[str(month)].append({
+            'citizen_id': citizen_id,
+            'presents': presents,
+        })
+
+    return result
+
+
 def get_age_percentiles_per_town(data_set_id):
     current_date = datetime.utcnow().date()
 
-    citizens = Citizen.objects.filter(data_set_id=data_set_id).all()
+    citizens = Citizen.objects.filter(data_set_id=data_set_id).select_related('town').all()
 
     ages_per_town = defaultdict(lambda: [])
     for citizen in citizens:
@@ -159,3 +647,181 @@ def get_age_percentiles_per_town(data_set_id):
         })
 
     return sorted(result, key=lambda el: el['town'])
+
+
+def get_age_percentiles_per_town_numpy(data_set_id):
+    """Same as `get_age_percentiles_per_town`, computed with vectorized numpy calls."""
+    current_date = datetime.utcnow().date()
+
+    rows = list(Citizen.objects.filter(data_set_id=data_set_id).values_list(
+            'town',
+            ExtractYear('birth_date'),
+            ExtractMonth('birth_date') * 100 + ExtractDay('birth_date')))
+    if not rows:
+        return []
+
+    town_ids, birth_years, birth_month_days = zip(*rows)
+    town_ids, town_codes = np.unique(np.array(town_ids, dtype=np.int64), return_inverse=True)
+    ages = calculate_ages(current_date, birth_years, birth_month_days)
+
+    _, percentiles = grouped_percentiles(town_codes, ages, [50, 75, 99])
+    percentiles = percentiles.round(2)
+
+    names = dict(Town.objects.filter(id__in=town_ids.tolist()).values_list('id', 'name'))
+    result = [
+        {
+            'town': names[town_id],
+            'p50': p50,
+            'p75': p75,
+            'p99': p99,
+        }
+        for town_id, (p50, p75, p99) in zip(town_ids.tolist(), percentiles)
+    ]
+    return sorted(result, key=lambda el: el['town'])
+
+
+def get_birthday_stats_snapshot(data_set_id):
+    """Same as `get_birthday_stats2`, counted over snapshot of data set kept by this process."""
+    snapshot = get_snapshot(data_set_id)
+    presents = snapshot.birthday_presents()
+
+    result = {}
+    for month, counts in enumerate(presents, start=1):
+        buyers = np.flatnonzero(counts)
+        result[str(month)] = [
+            {
+                'citizen_id': citizen_id,
+                'presents': count,
+            }
+            for citizen_id, count in zip(snapshot.citizen_ids[buyers].tolist(),
+                                         counts[buyers].tolist())
+        ]
+    return result
+
+
+def get_birthday_stats_materialized(data_set_id):
+    """Same as `get_birthday_stats2`, read from BirthdayPresents by data set."""
+    result = {
+        str(month): []
+        for month in range(1, 12 + 1)
+    }
+
+    for citizen_id, month, presents in read_birthday_presents(data_set_id):
+        result[str(month)].append({
+            'citizen_id': citizen_id,
+            'presents': presents,
+        })
+
+    return result
+
+
+BIRTHDAY_STATS_ENGINES = {
+    'python': get_birthday_stats2,
+    'sql': get_birthday_stats_sql,
+    'snapshot': get_birthday_stats_snapshot,
+    'materialized': get_birthday_stats_materialized,
+}
+
+
+def get_age_percentiles_per_town_db(data_set_id):
+    """Same as `get_age_percentiles_per_town`, percentiles are computed by PostgreSQL.
+
+    Ages are derived in SQL as `calculate_age` does and `percentile_cont`
+    interpolates linearly as `np.percentile`; only rounding is done here.
+    Citizens are grouped by key of town, names are joined to the groups.
+    """
+    current_date = datetime.utcnow().date()
+
+    qn = connection.ops.quote_name
+    town_column = qn(Citizen._meta.get_field('town').column)
+    sql = (f'SELECT t.name, p.percentiles FROM ('
+           f'  SELECT town_id,'
+           f'    percentile_cont(ARRAY[0.5, 0.75, 0.99]) WITHIN GROUP (ORDER BY age)'
+           f'      AS percentiles'
+           f'  FROM ('
+           f'    SELECT {town_column} AS town_id,'
+           f'      %s - EXTRACT(YEAR FROM {qn("birth_date")})'
+           f'      - CASE WHEN EXTRACT(MONTH FROM {qn("birth_date")}) * 100'
+           f'                  + EXTRACT(DAY FROM {qn("birth_date")}) < %s'
+           f'        THEN 1 ELSE 0 END AS age'
+           f'    FROM {qn(Citizen._meta.db_table)}'
+           f'    WHERE {qn("data_set_id")} = %s'
+           f'  ) ages'
+           f'  GROUP BY town_id'
+           f') p '
+           f'JOIN {qn(Town._meta.db_table)} t ON t.id = p.town_id')
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [current_date.year, current_date.month * 100 + current_date.day,
+                             data_set_id])
+        rows = cursor.fetchall()
+
+    result = []
+    for town, percentiles in rows:
+        p50, p75, p99 = np.array(percentiles).round(2)
+        result.append({
+            'town': town,
+            'p50': p50,
+            'p75': p75,
+            'p99': p99,
+        })
+
+    return sorted(result, key=lambda el: el['town'])
+
+
+def get_age_percentiles_per_town_snapshot(data_set_id):
+    """Same as `get_age_percentiles_per_town`, computed over snapshot of data set."""
+    current_date = datetime.utcnow().date()
+
+    snapshot = get_snapshot(data_set_id)
+    town_codes, percentiles = snapshot.age_percentiles(current_date, [50, 75, 99])
+    percentiles = percentiles.round(2)
+
+    # codes of towns follow sorted names
+    return [
+        {
+            'town': snapshot.town_names[code],
+            'p50': p50,
+            'p75': p75,
+            'p99': p99,
+        }
+        for code, (p50, p75, p99) in zip(town_codes.tolist(), percentiles)
+    ]
+
+
+def get_age_percentiles_per_town_histogram(data_set_id):
+    """Same as `get_age_percentiles_per_town`, computed from counts of citizens by town and age.
+
+    Counts come from TownBirthDates kept with IMPORTS_BIRTH_DATE_HISTOGRAM,
+    citizens are not read.
+    """
+    current_date = datetime.utcnow().date()
+
+    rows = read_town_ages(data_set_id, current_date)
+    if not rows:
+        return []
+
+    towns, ages, counts = zip(*rows)
+    towns, town_codes = np.unique(towns, return_inverse=True)
+    ages = np.array(ages, dtype=np.int64)
+    _, percentiles = grouped_weighted_percentiles(town_codes, ages, counts, [50, 75, 99])
+    percentiles = percentiles.round(2)
+
+    return [
+        {
+            'town': town,
+            'p50': p50,
+            'p75': p75,
+            'p99': p99,
+        }
+        for town, (p50, p75, p99) in zip(towns.tolist(), percentiles)
+    ]
+
+
+AGE_PERCENTILES_ENGINES = {
+    'python': get_age_percentiles_per_town,
+    'numpy': get_age_percentiles_per_town_numpy,
+    'database': get_age_percentiles_per_town_db,
+    'snapshot': get_age_percentiles_per_town_snapshot,
+    'histogram': get_age_percentiles_per_town_histogram,
+}
@@ -0,0 +1,189 @@
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+from django.db.models import ForeignKey
+
+from imports.api.models import Citizen, CitizenPair, CitizenRelative, DataSet
+
+# tables with rows of a single data set, in order of foreign keys between them
+PARTITIONED_MODELS = (Citizen, CitizenRelative, CitizenPair)
+PARTITION_KEY = 'data_set_id'
+
+
+def qn(name):
+    return connection.ops.quote_name(name)
+
+
+def partition_name(model, data_set_id):
+    return f'{model._meta.db_table}_{data_set_id}'
+
+
+@contextmanager
+def immediate_constraints(cursor):
+    """Check deferred constraints now, tables with pending checks can not be altered."""
+    cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    yield
+    cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+
+def is_partitioned(model):
+    """Whether table of model is partitioned by data set."""
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT EXISTS (SELECT 1 FROM pg_partitioned_table '
+                       'WHERE partrelid = %s::regclass)',
+                       [model._meta.db_table])
+        return cursor.fetchone()[0]
+
+
+def create_partitions(data_set_id):
+    """Create partitions of data set in tables partitioned by IMPORTS_PARTITION_DATA_SETS.
+
+    Partitions are created as plain tables and attached. Attaching locks
+    partitioned tables, exclusively before PostgreSQL 12, so run it in a
+    short transaction of its own, as `new_data_set_partitions` does.
+    Foreign keys between partitions only lock the new partitions.
+    """
+    with connection.cursor() as cursor:
+        for model in PARTITIONED_MODELS:
+            table = qn(model._meta.db_table)
+            partition = qn(partition_name(model, data_set_id))
+            cursor.execute(f'CREATE TABLE {partition} '
+                           f'(LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+            cursor.execute(f'ALTER TABLE {table} ATTACH PARTITION {partition} '
+                           f'FOR VALUES IN ({int(data_set_id)})')
+            for sql in _partition_foreign_keys_sql(model, data_set_id):
+                cursor.execute(sql)
+
+
+@contextmanager
+def new_data_set_partitions():
+    """Reserve id of a new data set and commit its partitions, drop them if the block fails.
+
+    The block creates the data set with the yielded id in a transaction of
+    its own, which only writes into the partitions and so does not block
+    changes of other data sets. A killed process leaves empty partitions of
+    an id no data set takes.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, 'id'))",
+                       [DataSet._meta.db_table])
+        data_set_id = cursor.fetchone()[0]
+
+    with transaction.atomic():
+        create_partitions(data_set_id)
+    try:
+        yield data_set_id
+    except BaseException:
+        with transaction.atomic():
+            drop_partitions(data_set_id)
+        raise
+
+
+def drop_partitions(data_set_id):
+    """Drop partitions of data set with all of its citizens and relations.
+
+    Dropping a partition takes ACCESS EXCLUSIVE lock of its partitioned
+    table, which blocks reads and writes of all data sets until commit, so
+    DELETE /imports/{id} leaves it to `purge_deleted_data_sets`.
+    """
+    with connection.cursor() as cursor, immediate_constraints(cursor):
+        for model in reversed(PARTITIONED_MODELS):
+            cursor.execute(f'DROP TABLE {qn(partition_name(model, data_set_id))}')
+
+
+def _partition_foreign_keys_sql(model, data_set_id):
+    """Foreign keys of partition of data set to partitions of the same data set.
+
+    Foreign keys can not refer to partitioned tables before PostgreSQL 12,
+    so keys between partitioned tables are made between their partitions.
+    """
+    partition = qn(partition_name(model, data_set_id))
+    sql = []
+    for field in model._meta.concrete_fields:
+        if not (isinstance(field, ForeignKey) and field.related_model in PARTITIONED_MODELS):
+            continue
+        target = qn(partition_name(field.related_model, data_set_id))
+        sql.append(f'ALTER TABLE {partition} '
+                   f'ADD FOREIGN KEY ({qn(PARTITION_KEY)}, {qn(field.column)}) '
+                   f'REFERENCES {target} ({qn(PARTITION_KEY)}, {qn(field.target_field.column)}) '
+                   f'DEFERRABLE INITIALLY DEFERRED')
+    return sql
+
+
+def _constraints_sql(model, partitioned):
+    """Primary key, unique and foreign key constraints of table of model.
+
+    Partition key has to be a part of primary and unique keys of partitioned
+    tables, so it is added to them, which guarantees the same as keys of not
+    partitioned tables do. Foreign keys between partitioned tables are made
+    by their partitions instead, see `_partition_foreign_keys_sql`.
+    """
+    table = qn(model._meta.db_table)
+
+    def key(columns):
+        if partitioned and PARTITION_KEY not in columns:
+            columns = [PARTITION_KEY] + columns
+        return ', '.join(qn(c) for c in columns)
+
+    sql = [f'ALTER TABLE {table} ADD PRIMARY KEY ({key([model._meta.pk.column])})']
+    for fields in model._meta.unique_together:
+        columns = [model._meta.get_field(f).column for f in fields]
+        sql.append(f'ALTER TABLE {table} ADD UNIQUE ({key(columns)})')
+
+    for field in model._meta.concrete_fields:
+        if not isinstance(field, ForeignKey):
+            continue
+        target = field.related_model
+        if not (partitioned and target in PARTITIONED_MODELS):
+            sql.append(f'ALTER TABLE {table} ADD FOREIGN KEY ({qn(field.column)}) '
+                       f'REFERENCES {qn(target._meta.db_table)} '
+                       f'({qn(field.target_field.column)}) '
+                       f'DEFERRABLE INITIALLY DEFERRED')
+        # partitions have a single value of partition key, it needs no index
+        if field.db_index and not (partitioned and field.column == PARTITION_KEY):
+            sql.append(f'CREATE INDEX ON {table} ({qn(field.column)})')
+    return sql
+
+
+@transaction.atomic
+def partition_tables(partitioned=True):
+    """Rebuild tables of citizens and relations partitioned by data set or not partitioned.
+
+    Rows are copied into new tables, which take over names, sequences and
+    constraints of the old ones; partitioned tables get a partition per data
+    set. Tables are locked until the end of the transaction.
+    """
+    data_set_ids = list(DataSet.all_objects.order_by('id').values_list('id', flat=True))
+
+    with connection.cursor() as cursor, immediate_constraints(cursor):
+        for model in PARTITIONED_MODELS:
+            table = model._meta.db_table
+            cursor.execute(f'ALTER TABLE {qn(table)} RENAME TO {qn(table + "_old")}')
+
+        for model in PARTITIONED_MODELS:
+            table = model._meta.db_table
+            old = qn(table + '_old')
+            partition_by = f' PARTITION BY LIST ({qn(PARTITION_KEY)})' if partitioned else ''
+            cursor.execute(f'CREATE TABLE {qn(table)} '
+                           f'(LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'
+                           f'{partition_by}')
+            cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table + '_old', 'id'])
+            sequence, = cursor.fetchone()
+            cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {qn(table)}.{qn("id")}')
+
+            if partitioned:
+                for data_set_id in data_set_ids:
+                    cursor.execute(f'CREATE TABLE {qn(partition_name(model, data_set_id))} '
+                                   f'PARTITION OF {qn(table)} FOR VALUES IN ({data_set_id})')
+            cursor.execute(f'INSERT INTO {qn(table)} SELECT * FROM {old}')
+
+        for model in reversed(PARTITIONED_MODELS):
+            cursor.execute(f'DROP TABLE {qn(model._meta.db_table + "_old")}')
+
+        for model in PARTITIONED_MODELS:
+            for sql in _constraints_sql(model, partitioned):
+                cursor.execute(sql)
+            if partitioned:
+                for data_set_id in data_set_ids:
+                    for sql in _partition_foreign_keys_sql(model, data_set_id):
+                        cursor.execute(sql)
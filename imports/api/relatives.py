@@ -0,0 +1,169 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from imports.api.models import CitizenPair, CitizenRelative
+
+
+class RowsRelativesStorage:
+    """Relation of two citizens stored as two `CitizenRelative` rows, one per direction.
+
+    Queries filter joined citizens by data set too, so tables partitioned by
+    data set are pruned to partitions of the data set.
+    """
+    model = CitizenRelative
+    # (citizen field, relative field) of every direction relations are read in
+    directions = (('citizen', 'relative'),)
+
+    def column(self, field):
+        return connection.ops.quote_name(self.model._meta.get_field(field).column)
+
+    def directed_sql(self):
+        """SQL selecting directed edges as (id, data_set_id, citizen_id, relative_id) columns."""
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        return (f'SELECT id, data_set_id, {self.column("citizen")} AS citizen_id, '
+                f'{self.column("relative")} AS relative_id FROM {table}')
+
+    def citizen_edges(self, data_set_id, citizen_id):
+        """Primary keys and citizen_id of relatives of citizen, ordered by creation of edges."""
+        return list(self.model.objects
+                    .filter(data_set_id=data_set_id, citizen_id=citizen_id,
+                            relative__data_set_id=data_set_id)
+                    .order_by('id')
+                    .values_list('relative_id', 'relative__citizen_id'))
+
+    def batch_edges(self, data_set_id, citizen_ids):
+        """Directed edges touching citizens as (edge id, citizen, relative, relative citizen_id).
+
+        Both directions of every edge are returned, ordered by edge id.
+        """
+        return list(self.model.objects
+                    .filter(Q(citizen_id__in=citizen_ids) | Q(relative_id__in=citizen_ids),
+                            data_set_id=data_set_id, relative__data_set_id=data_set_id)
+                    .order_by('id')
+                    .values_list('id', 'citizen_id', 'relative_id', 'relative__citizen_id'))
+
+    def prefetch_relatives(self, data_set_id, citizens):
+        """Set `relatives_ids` of citizens of data set with a query per direction."""
+        relatives = defaultdict(list)
+        for citizen, relative in self.directions:
+            edges = (self.model.objects
+                     .filter(data_set_id=data_set_id, **{f'{relative}__data_set_id': data_set_id})
+                     .values_list('id', f'{citizen}_id', f'{relative}__citizen_id'))
+            for edge_id, citizen_id, relative_id in edges:
+                relatives[citizen_id].append((edge_id, relative_id))
+
+        for citizen in citizens:
+            citizen.relatives_ids = [rid for _, rid in sorted(relatives[citizen.id])]
+
+    def delete_edges(self, data_set_id, citizen_id, relative_ids):
+        self.model.objects.filter(Q(citizen_id=citizen_id, relative_id__in=relative_ids) |
+                                  Q(citizen_id__in=relative_ids, relative_id=citizen_id),
+                                  data_set_id=data_set_id).delete()
+
+    def delete(self, data_set_id, edge_ids):
+        self.model.objects.filter(data_set_id=data_set_id, id__in=edge_ids).delete()
+
+    def load_rows(self, data_set_id, pairs):
+        """Fields and rows to insert for directed (citizen, relative) pairs of both directions."""
+        now = timezone.now()
+        return (('created_at', 'updated_at', 'data_set_id', 'citizen_id', 'relative_id'),
+                ((now, now, data_set_id, cid, rid) for cid, rid in pairs))
+
+    def insert(self, data_set_id, edges):
+        """Insert (citizen, relative) edges, each of them in both directions."""
+        fields, rows = self.load_rows(data_set_id,
+                                      (pair for a, b in edges for pair in ((a, b), (b, a))))
+        self.model.objects.bulk_create(self.model(**dict(zip(fields, row))) for row in rows)
+
+
+class PairsRelativesStorage(RowsRelativesStorage):
+    """Relation of two citizens stored as a single `CitizenPair` row."""
+    model = CitizenPair
+    directions = (('low', 'high'), ('high', 'low'))
+
+    def directed_sql(self):
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        low, high = self.column('low'), self.column('high')
+        return (f'SELECT id, data_set_id, {low} AS citizen_id, {high} AS relative_id FROM {table} '
+                f'UNION ALL '
+                f'SELECT id, data_set_id, {high} AS citizen_id, {low} AS relative_id FROM {table}')
+
+    def citizen_edges(self, data_set_id, citizen_id):
+        edges = (self.model.objects
+                 .filter(Q(low_id=citizen_id) | Q(high_id=citizen_id), data_set_id=data_set_id,
+                         low__data_set_id=data_set_id, high__data_set_id=data_set_id)
+                 .order_by('id')
+                 .values_list('low_id', 'low__citizen_id', 'high_id', 'high__citizen_id'))
+        return [(high, high_citizen_id) if low == citizen_id else (low, low_citizen_id)
+                for low, low_citizen_id, high, high_citizen_id in edges]
+
+    def batch_edges(self, data_set_id, citizen_ids):
+        edges = (self.model.objects
+                 .filter(Q(low_id__in=citizen_ids) | Q(high_id__in=citizen_ids),
+                         data_set_id=data_set_id,
+                         low__data_set_id=data_set_id, high__data_set_id=data_set_id)
+                 .order_by('id')
+                 .values_list('id', 'low_id', 'low__citizen_id', 'high_id', 'high__citizen_id'))
+
+        result = []
+        for edge_id, low, low_citizen_id, high, high_citizen_id in edges:
+            result.append((edge_id, low, high, high_citizen_id))
+            result.append((edge_id, high, low, low_citizen_id))
+        return result
+
+    def delete_edges(self, data_set_id, citizen_id, relative_ids):
+        self.model.objects.filter(Q(low_id=citizen_id, high_id__in=relative_ids) |
+                                  Q(low_id__in=relative_ids, high_id=citizen_id),
+                                  data_set_id=data_set_id).delete()
+
+    def load_rows(self, data_set_id, pairs):
+        return (('data_set_id', 'low_id', 'high_id'),
+                ((data_set_id, cid, rid) for cid, rid in pairs if cid < rid))
+
+    def insert(self, data_set_id, edges):
+        self.model.objects.bulk_create(self.model(data_set_id=data_set_id,
+                                                  low_id=min(a, b), high_id=max(a, b))
+                                       for a, b in edges)
+
+
+RELATIVES_STORAGES = {
+    'rows': RowsRelativesStorage(),
+    'pairs': PairsRelativesStorage(),
+}
+
+
+def get_relatives_storage():
+    """Storage of relations configured by IMPORTS_RELATIVES_STORAGE."""
+    return RELATIVES_STORAGES[settings.IMPORTS_RELATIVES_STORAGE]
+
+
+@transaction.atomic
+def convert_relatives(target):
+    """Move relations of all data sets into `target` storage, emptying the other one."""
+    source = RELATIVES_STORAGES['pairs' if target == 'rows' else 'rows']
+    target = RELATIVES_STORAGES[target]
+
+    fields, _ = target.load_rows(None, [])
+    columns = ', '.join(target.column(f) for f in fields)
+    if target.model is CitizenRelative:
+        # both directions of every pair, created now
+        select = 'SELECT %s, %s, data_set_id, citizen_id, relative_id'
+        where = ''
+        params = [timezone.now()] * 2
+    else:
+        select = 'SELECT data_set_id, citizen_id, relative_id'
+        where = 'WHERE citizen_id < relative_id '
+        params = []
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {connection.ops.quote_name(target.model._meta.db_table)} '
+                       f'({columns}) '
+                       f'{select} FROM ({source.directed_sql()}) edges '
+                       f'{where}'
+                       f'ORDER BY id, citizen_id',
+                       params)
+        cursor.execute(f'DELETE FROM {connection.ops.quote_name(source.model._meta.db_table)}')
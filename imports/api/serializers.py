@@ -1,21 +1,26 @@
 import logging
-import re
 from datetime import datetime
 
 from rest_framework import serializers
+from rest_framework.serializers import as_serializer_error
+from rest_framework.settings import api_settings
 
 from imports.utils import latin_russian_digit
 
 
+latin_russian_digit_set = frozenset(latin_russian_digit)
+
+# apartment is stored in a 4-byte integer column
+MAX_APARTMENT = 2 ** 31 - 1
+
+
 def validate_non_negative(value):
     if value < 0:
         raise serializers.ValidationError('Must be non-negative.')
 
-    re.compile(r'a-zA-Z0-9')
-
 
 def validate_has_letter_or_digit(string):
-    if not set(latin_russian_digit) & set(string):
+    if latin_russian_digit_set.isdisjoint(string):
         raise serializers.ValidationError('Must contain digit or latin/russian letter.')
 
 
@@ -41,6 +46,22 @@ class CitizenRelativesField(serializers.ListField):
         return list(c.citizen_id for c in mtm_manager.all())
 
 
+def citizen_row_representation(row):
+    """Representation of `CitizenSerializer` for a row of `list_citizens`."""
+    citizen_id, town, street, building, apartment, name, birth_date, gender, relatives = row
+    return {
+        'citizen_id': citizen_id,
+        'town': town,
+        'street': street,
+        'building': building,
+        'apartment': apartment,
+        'name': name,
+        'birth_date': birth_date.strftime('%d.%m.%Y'),
+        'gender': gender,
+        'relatives': relatives,
+    }
+
+
 class CitizenSerializer(NoUnknownFieldsSerializer):
     citizen_id = serializers.IntegerField(required=True, validators=[validate_non_negative])
 
@@ -59,7 +80,9 @@ class CitizenSerializer(NoUnknownFieldsSerializer):
                                      max_length=256,
                                      validators=[validate_has_letter_or_digit])
 
-    apartment = serializers.IntegerField(required=True, validators=[validate_non_negative])
+    apartment = serializers.IntegerField(required=True,
+                                         max_value=MAX_APARTMENT,
+                                         validators=[validate_non_negative])
 
     name = serializers.CharField(required=True, allow_blank=False, max_length=256)
     birth_date = serializers.DateField(required=True, format='%d.%m.%Y', input_formats=['%d.%m.%Y'])
@@ -89,42 +112,177 @@ class CitizenSerializer(NoUnknownFieldsSerializer):
         return super().validate(data)
 
 
+class CitizensRelationsValidator:
+    """Cross-citizen checks of a data set, fed with validated citizens one by one."""
+
+    def __init__(self):
+        self.citizen_ids = set()
+        self.pairs = set()
+
+    def add(self, citizen):
+        # check uniqueness of citizen_id in dataset
+        cid = citizen['citizen_id']
+        if cid not in self.citizen_ids:
+            self.citizen_ids.add(cid)
+        else:
+            raise serializers.ValidationError(f'Duplicated citizen id {cid}')
+
+        # check relatives relation
+        for rid in citizen['relatives']:
+            pair = (min(cid, rid), max(cid, rid))
+            if pair in self.pairs:
+                self.pairs.remove(pair)
+            else:
+                self.pairs.add(pair)
+
+    def validate(self):
+        if self.pairs:
+            raise serializers.ValidationError(
+                    f'Relatives relation for citizen pairs {self.pairs} in unsymmetric.')
+
+
 class CreateDataSetSerializer(NoUnknownFieldsSerializer):
     citizens = serializers.ListSerializer(child=CitizenSerializer(),
                                           allow_null=False,
                                           allow_empty=False)
 
     def validate(self, data):
-        citizens = data['citizens']
+        relations = CitizensRelationsValidator()
+        for c in data['citizens']:
+            relations.add(c)
+        relations.validate()
 
-        citizen_ids = set()
-        pairs = set()
+        del relations
+        return super().validate(data)
 
-        for c in citizens:
-            # check uniqueness of citizen_id in dataset
-            cid = c['citizen_id']
-            if cid not in citizen_ids:
-                citizen_ids.add(cid)
-            else:
-                raise serializers.ValidationError(f'Duplicated citizen id {cid}')
 
-            # check relatives relation
-            for rid in c['relatives']:
-                pair = (min(cid, rid), max(cid, rid))
-                if pair in pairs:
-                    pairs.remove(pair)
-                else:
-                    pairs.add(pair)
+class CreateDataSetStreamValidator:
+    """Validation of `CreateDataSetSerializer` for a streamed data set.
+
+    Citizens from `DataSetStreamReader` are validated as they arrive and
+    yielded by `validated_citizens`, cross-citizen checks are accumulated
+    over the whole import. Once any citizen is invalid nothing is yielded
+    anymore, and errors are raised after the stream end. Only errors of
+    invalid citizens are kept while reading, they are reported as a list
+    of errors of all citizens as `CreateDataSetSerializer` does.
+    """
+
+    def __init__(self, reader, citizen_validator=None):
+        self.reader = reader
+        self.citizen_validator = citizen_validator or CitizenSerializer()
+        self.relations = CitizensRelationsValidator()
+        self.citizens_errors = {}
+        self.relations_error = None
+
+    def validated_citizens(self):
+        for index, data in enumerate(self.reader.citizens()):
+            try:
+                citizen = self.citizen_validator.run_validation(data)
+            except serializers.ValidationError as exc:
+                self.citizens_errors[index] = exc.detail
+                continue
 
-        if pairs:
+            if self.citizens_errors or self.relations_error:
+                continue
+
+            try:
+                self.relations.add(citizen)
+            except serializers.ValidationError as exc:
+                self.relations_error = exc
+                continue
+
+            yield citizen
+
+        self.validate()
+
+    def validate(self):
+        reader = self.reader
+        field_messages = serializers.Field.default_error_messages
+        list_messages = serializers.ListSerializer.default_error_messages
+
+        if not reader.has_citizens:
             raise serializers.ValidationError(
-                    f'Relatives relation for citizen pairs {pairs} in unsymmetric.')
+                    {'citizens': [field_messages['required']]}, code='required')
 
-        del citizen_ids
-        del pairs
-        return super().validate(data)
+        if not reader.citizens_is_list:
+            if reader.citizens_value is None:
+                raise serializers.ValidationError(
+                        {'citizens': [field_messages['null']]}, code='null')
+
+            message = list_messages['not_a_list'].format(
+                    input_type=type(reader.citizens_value).__name__)
+            raise serializers.ValidationError(
+                    {'citizens': {api_settings.NON_FIELD_ERRORS_KEY: [message]}},
+                    code='not_a_list')
+
+        if not reader.citizens_count:
+            raise serializers.ValidationError(
+                    {'citizens': {api_settings.NON_FIELD_ERRORS_KEY: [list_messages['empty']]}},
+                    code='empty')
+
+        if self.citizens_errors:
+            errors = [self.citizens_errors.get(index, {})
+                      for index in range(reader.citizens_count)]
+            raise serializers.ValidationError({'citizens': errors})
+
+        try:
+            if self.relations_error:
+                raise self.relations_error
+            self.relations.validate()
+
+            if reader.unknown_fields:
+                raise serializers.ValidationError(f'Unknown fields: {reader.unknown_fields}')
+        except serializers.ValidationError as exc:
+            raise serializers.ValidationError(detail=as_serializer_error(exc))
 
 
 class UpdateCitizenSerializer(NoUnknownFieldsSerializer):
     data_set_id = serializers.IntegerField(required=True, allow_null=False)
     citizen_id = serializers.IntegerField(required=True, validators=[validate_non_negative])
+
+
+class CitizenUpdateSerializer(serializers.Serializer):
+    """Item of batch update: citizen_id and fields validated as PATCH of a single citizen."""
+    citizen_id = serializers.IntegerField(required=True, validators=[validate_non_negative])
+
+    def to_internal_value(self, data):
+        if not isinstance(data, dict):
+            return super().to_internal_value(data)
+
+        data = dict(data)
+        errors = {}
+        try:
+            citizen_id = self.fields['citizen_id'].run_validation(
+                    data.pop('citizen_id', serializers.empty))
+        except serializers.ValidationError as exc:
+            errors['citizen_id'] = exc.detail
+
+        serializer = CitizenSerializer(data=data, partial=True)
+        if not serializer.is_valid():
+            errors.update(serializer.errors)
+
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        return {'citizen_id': citizen_id, **serializer.validated_data}
+
+    def validate(self, data):
+        relatives = data.get('relatives')
+        if relatives and data['citizen_id'] in relatives:
+            raise serializers.ValidationError('Citizen can not be relative to itself.')
+        return data
+
+
+class UpdateCitizensSerializer(NoUnknownFieldsSerializer):
+    citizens = serializers.ListSerializer(child=CitizenUpdateSerializer(),
+                                          required=True,
+                                          allow_empty=False)
+
+    def validate(self, data):
+        citizen_ids = set()
+        for citizen in data['citizens']:
+            cid = citizen['citizen_id']
+            if cid in citizen_ids:
+                raise serializers.ValidationError(f'Duplicated citizen id {cid}')
+            citizen_ids.add(cid)
+        return super().validate(data)
@@ -0,0 +1,324 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.db.models.functions import ExtractDay, ExtractMonth, ExtractYear
+from django.dispatch import receiver
+
+from imports.api.models import Citizen, DataSet, Town
+from imports.api.relatives import get_relatives_storage
+from imports.utils import calculate_ages, grouped_percentiles
+
+
+class DataSetSnapshot:
+    """Columns of citizens of a data set revision and CSR adjacency of their relatives.
+
+    Citizens are indexed in order of citizen_id. Indexes of relatives of
+    citizen `i` are `relatives[offsets[i]:offsets[i + 1]]`, a relation is
+    present in both directions. Towns are coded by index in sorted
+    `town_names`.
+    """
+    ARRAYS = ('citizen_ids', 'birth_years', 'birth_month_days', 'town_codes',
+              'offsets', 'relatives')
+
+    def __init__(self, data_set_id, revision, town_names, **arrays):
+        self.data_set_id = data_set_id
+        self.revision = revision
+        self.town_names = town_names
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @property
+    def nbytes(self):
+        return (sum(getattr(self, name).nbytes for name in self.ARRAYS) +
+                sum(len(name.encode()) for name in self.town_names))
+
+    @classmethod
+    def load(cls, data_set_id):
+        """Read the current revision of data set, with a query per table and direction.
+
+        Queries run in a REPEATABLE READ transaction, so they see a single
+        revision even when the data set is changed meanwhile. Nested in a
+        transaction which already ran queries they see what it sees.
+        """
+        outermost = not connection.in_atomic_block
+        with transaction.atomic():
+            if outermost:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            return cls._load(data_set_id)
+
+    @classmethod
+    def _load(cls, data_set_id):
+        revision = (DataSet.objects.filter(id=data_set_id)
+                    .values_list('revision', flat=True).first())
+        if revision is None:
+            raise DataSet.DoesNotExist(f'Data set {data_set_id} does not exist')
+
+        rows = list(Citizen.objects.filter(data_set_id=data_set_id).order_by('citizen_id')
+                    .values_list('id', 'citizen_id', 'town',
+                                 ExtractYear('birth_date'),
+                                 ExtractMonth('birth_date') * 100 + ExtractDay('birth_date')))
+        pks, citizen_ids, town_ids, birth_years, birth_month_days = (
+                np.array(column, dtype=np.int64) for column in (zip(*rows) if rows else [()] * 5))
+
+        town_ids, town_codes = np.unique(town_ids, return_inverse=True)
+        names = dict(Town.objects.filter(id__in=town_ids.tolist()).values_list('id', 'name'))
+        # recode towns by order of names, so groups of towns come out sorted by name
+        town_names = sorted(names.values())
+        positions = {name: code for code, name in enumerate(town_names)}
+        recode = np.array([positions[names[town_id]] for town_id in town_ids.tolist()],
+                          dtype=np.int32)
+        town_codes = recode[town_codes]
+
+        storage = get_relatives_storage()
+        edges = [np.array(storage.model.objects.filter(data_set_id=data_set_id)
+                          .values_list(f'{citizen}_id', f'{relative}_id'),
+                          dtype=np.int64).reshape(-1, 2)
+                 for citizen, relative in storage.directions]
+        edges = np.concatenate(edges)
+
+        # primary keys of edges to indexes of citizens in order of citizen_id
+        by_pk = np.argsort(pks)
+        sources, targets = (by_pk[np.searchsorted(pks, edges[:, column], sorter=by_pk)]
+                            for column in (0, 1))
+        order = np.lexsort((citizen_ids[targets], sources))
+        offsets = np.zeros(len(pks) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(pks)), out=offsets[1:])
+
+        return cls(data_set_id, revision, town_names,
+                   citizen_ids=citizen_ids,
+                   birth_years=birth_years.astype(np.int16),
+                   birth_month_days=birth_month_days.astype(np.int16),
+                   town_codes=town_codes,
+                   offsets=offsets,
+                   relatives=targets[order].astype(np.int32))
+
+    def save(self, directory):
+        """Write arrays to `.npy` files in directory."""
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(directory, 'town_names.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.town_names, f, ensure_ascii=False)
+
+    @classmethod
+    def open(cls, directory, data_set_id, revision):
+        """Snapshot saved to directory with arrays memory-mapped read-only."""
+        with open(os.path.join(directory, 'town_names.json'), encoding='utf-8') as f:
+            town_names = json.load(f)
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+                  for name in cls.ARRAYS}
+        return cls(data_set_id, revision, town_names, **arrays)
+
+    def birthday_presents(self):
+        """Array of presents bought by every citizen (columns) in every month (rows).
+
+        A citizen buys a present to each relative in the month of relative's
+        birth, counted by a `bincount` over (month, citizen) of all edges.
+        """
+        count = len(self.citizen_ids)
+        buyers = self.relatives
+        months = self.birth_month_days // 100 - 1
+        born = np.repeat(months, np.diff(self.offsets))
+        return np.bincount(born.astype(np.int64) * count + buyers,
+                           minlength=12 * count).reshape(12, count)
+
+    def age_percentiles(self, current_date, percentiles):
+        """Sorted codes of towns and linear percentiles of ages of their citizens."""
+        ages = calculate_ages(current_date, self.birth_years, self.birth_month_days)
+        return grouped_percentiles(self.town_codes, ages, percentiles)
+
+
+class SnapshotStore:
+    """In-process LRU of snapshots of data sets bounded by their total size in bytes.
+
+    A single revision of every data set is kept, an older one is replaced
+    when a newer revision is requested.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.snapshots = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, data_set_id):
+        """Snapshot of the current revision of data set, loaded when not kept yet."""
+        revision = (DataSet.objects.filter(id=data_set_id)
+                    .values_list('revision', flat=True).first())
+        if revision is None:
+            raise DataSet.DoesNotExist(f'Data set {data_set_id} does not exist')
+
+        snapshot = self.find(data_set_id, revision)
+        if snapshot is None:
+            # loaded snapshot is of the revision it reads, which may be newer already
+            snapshot = self.add(DataSetSnapshot.load(data_set_id))
+        return snapshot
+
+    def find(self, data_set_id, revision):
+        with self.lock:
+            snapshot = self.snapshots.get(data_set_id)
+            if snapshot is not None and snapshot.revision == revision:
+                self.snapshots.move_to_end(data_set_id)
+                return snapshot
+        return None
+
+    def add(self, snapshot):
+        if snapshot.nbytes > self.max_bytes:
+            return snapshot
+        self.keep(snapshot)
+        return snapshot
+
+    def keep(self, snapshot):
+        """Keep snapshot unless a newer revision is kept, evict the least recently used."""
+        with self.lock:
+            old = self.snapshots.pop(snapshot.data_set_id, None)
+            if old is not None:
+                self.size -= old.nbytes
+            kept = old if old is not None and old.revision > snapshot.revision else snapshot
+            self.snapshots[kept.data_set_id] = kept
+            self.size += kept.nbytes
+
+            while self.size > self.max_bytes:
+                _, evicted = self.snapshots.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def discard(self, data_set_id, revision):
+        """Stop keeping the revision of data set."""
+        with self.lock:
+            snapshot = self.snapshots.get(data_set_id)
+            if snapshot is not None and snapshot.revision == revision:
+                del self.snapshots[data_set_id]
+                self.size -= snapshot.nbytes
+
+
+class MmapSnapshotStore(SnapshotStore):
+    """Snapshots saved to files memory-mapped read-only by every process of a host.
+
+    Files of a revision are written once to `<path>/<data_set_id>.<revision>`
+    and shared through the page cache, processes only keep their mappings.
+    Directories are written under a temporary name and renamed into place,
+    so they are never read half-written. Older revisions and least recently
+    mapped directories over `max_bytes` are removed, as are temporary
+    directories of writers which crashed. Mappings are kept in an LRU
+    bounded by `max_bytes` too and dropped once their directory is removed
+    by any process, so pages of removed files are freed when the last
+    request using them is done.
+    """
+    # age in seconds of temporary directories considered left by a crashed writer
+    TEMPORARY_MAX_AGE = 3600
+
+    def __init__(self, path, max_bytes):
+        super().__init__(max_bytes)
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def directory(self, data_set_id, revision):
+        return os.path.join(self.path, f'{data_set_id}.{revision}')
+
+    def find(self, data_set_id, revision):
+        snapshot = super().find(data_set_id, revision)
+        directory = self.directory(data_set_id, revision)
+        if snapshot is not None:
+            if os.path.isdir(directory):
+                return snapshot
+            # removed by another process, mapping it would keep the files allocated
+            self.discard(data_set_id, revision)
+            return None
+
+        try:
+            snapshot = DataSetSnapshot.open(directory, data_set_id, revision)
+            os.utime(directory)
+        except FileNotFoundError:
+            return None
+        if snapshot.nbytes <= self.max_bytes:
+            self.keep(snapshot)
+        return snapshot
+
+    def add(self, snapshot):
+        if snapshot.nbytes > self.max_bytes:
+            return snapshot
+
+        temporary = tempfile.mkdtemp(dir=self.path, prefix='.')
+        snapshot.save(temporary)
+        try:
+            os.rename(temporary, self.directory(snapshot.data_set_id, snapshot.revision))
+        except OSError:
+            # saved by another process meanwhile
+            shutil.rmtree(temporary, ignore_errors=True)
+        for removed in self.evict(snapshot.data_set_id, snapshot.revision):
+            self.discard(*removed)
+        return self.find(snapshot.data_set_id, snapshot.revision) or snapshot
+
+    def evict(self, data_set_id, revision):
+        """Remove older revisions of data set, stale temporary directories and the least
+        recently mapped snapshots, return (data_set_id, revision) of removed ones."""
+        removed = []
+        entries = []
+        for name in os.listdir(self.path):
+            directory = os.path.join(self.path, name)
+            if name.startswith('.'):
+                try:
+                    if time.time() - os.stat(directory).st_mtime > self.TEMPORARY_MAX_AGE:
+                        shutil.rmtree(directory, ignore_errors=True)
+                except FileNotFoundError:
+                    pass
+                continue
+
+            entry_data_set_id, _, entry_revision = name.partition('.')
+            if not (entry_data_set_id.isdigit() and entry_revision.isdigit()):
+                continue
+            key = (int(entry_data_set_id), int(entry_revision))
+            if key[0] == data_set_id and key[1] < revision:
+                shutil.rmtree(directory, ignore_errors=True)
+                removed.append(key)
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(directory))
+                entries.append((os.stat(directory).st_mtime, size, directory, key))
+            except FileNotFoundError:
+                continue
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, directory, key in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            shutil.rmtree(directory, ignore_errors=True)
+            removed.append(key)
+            size -= entry_size
+        return removed
+
+
+_snapshot_store = None
+
+
+def get_snapshot_store():
+    """Store configured by IMPORTS_SNAPSHOT_STORE."""
+    global _snapshot_store
+    if _snapshot_store is None:
+        if settings.IMPORTS_SNAPSHOT_STORE == 'mmap':
+            _snapshot_store = MmapSnapshotStore(settings.IMPORTS_SNAPSHOT_PATH,
+                                                settings.IMPORTS_SNAPSHOT_MAX_BYTES)
+        else:
+            _snapshot_store = SnapshotStore(settings.IMPORTS_SNAPSHOT_MAX_BYTES)
+    return _snapshot_store
+
+
+@receiver(setting_changed)
+def reset_snapshot_store(setting, **kwargs):
+    global _snapshot_store
+    if setting.startswith('IMPORTS_SNAPSHOT'):
+        _snapshot_store = None
+
+
+def get_snapshot(data_set_id):
+    """Snapshot of the current revision of data set from the store of this process."""
+    return get_snapshot_store().get(data_set_id)
@@ -0,0 +1,136 @@
+import codecs
+import json
+
+from rest_framework.exceptions import ParseError
+
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARS = '0123456789+-.eE'
+
+
+class DataSetStreamReader:
+    """Incremental reader of `{"citizens": [...]}` request bodies.
+
+    Reads the stream chunk by chunk and yields citizens one by one, so only
+    a single citizen and one chunk of raw body are held in memory at once.
+    Values of other top-level keys are parsed and dropped, their names are
+    collected into `unknown_fields`.
+    """
+    list_key = 'citizens'
+
+    def __init__(self, stream, chunk_size=64 * 1024, encoding='utf-8'):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.json_decoder = json.JSONDecoder()
+
+        self.buffer = ''
+        self.pos = 0
+        self.eof = stream is None
+
+        self.unknown_fields = set()
+        self.has_citizens = False
+        self.citizens_is_list = False
+        self.citizens_value = None  # value of `citizens` when it is not a list
+        self.citizens_count = 0
+
+    def _read(self):
+        """Append next chunk of the stream to the buffer."""
+        if self.eof:
+            return False
+
+        chunk = self.stream.read(self.chunk_size)
+        try:
+            text = self.decoder.decode(chunk, final=not chunk)
+        except UnicodeDecodeError as e:
+            raise ParseError(f'JSON parse error - {e}')
+
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        if not chunk:
+            self.eof = True
+            return False
+        return True
+
+    def _peek(self):
+        """Skip whitespaces and return next significant char ('' at the end)."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ''
+
+    def _expect(self, chars):
+        char = self._peek()
+        if not char or char not in chars:
+            raise ParseError(f'JSON parse error - expected {" or ".join(chars)} '
+                             f'at position {self.pos}')
+        self.pos += 1
+        return char
+
+    def _value(self):
+        """Decode next JSON value, reading more data while it is incomplete."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self._read():
+                    continue
+                raise ParseError(f'JSON parse error - {e}')
+
+            # number at the end of buffer can be a prefix of a longer one
+            rest = end
+            while rest < len(self.buffer) and self.buffer[rest] in NUMBER_CHARS:
+                rest += 1
+            if not self.eof and rest == len(self.buffer) and self._read():
+                continue
+
+            self.pos = end
+            return value
+
+    def citizens(self):
+        """Yield items of the `citizens` list."""
+        if not self._peek():
+            return  # empty body is parsed as an empty object
+
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+        else:
+            while True:
+                key = self._value()
+                if not isinstance(key, str):
+                    raise ParseError('JSON parse error - object keys must be strings')
+                self._expect(':')
+
+                if key != self.list_key:
+                    self._value()
+                    self.unknown_fields.add(key)
+                elif self._peek() == '[':
+                    self.has_citizens = True
+                    self.citizens_is_list = True
+                    yield from self._items()
+                else:
+                    self.has_citizens = True
+                    self.citizens_value = self._value()
+
+                if self._expect(',}') == '}':
+                    break
+
+        if self._peek():
+            raise ParseError('JSON parse error - extra data after the end of document')
+
+    def _items(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            item = self._value()
+            self.citizens_count += 1
+            yield item
+            if self._expect(',]') == ']':
+                return
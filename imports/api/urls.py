@@ -1,15 +1,25 @@
 from django.urls import re_path
 
-from imports.api.views import (CreateDataSetView, UpdateCitizenView, ListDataSetCitizensView,
-                               DataSetBirthdaysView, DataSetAgePercentiles, )
+from imports.api.views import (CreateDataSetView, ImportJobView, DeleteDataSetView,
+                               UpdateCitizenView, UpdateCitizensView, ListDataSetCitizensView,
+                               DataSetBirthdaysView, DataSetAgePercentiles, ResultCacheStatsView, )
 
 urlpatterns = [
     re_path(r'^imports/?$',
             CreateDataSetView.as_view(),
             name='create_dataset'),
+    re_path(r'^imports/jobs/(?P<job_id>\d+)/?$',
+            ImportJobView.as_view(),
+            name='get_import_job'),
+    re_path(r'^imports/(?P<data_set_id>\d+)/?$',
+            DeleteDataSetView.as_view(),
+            name='delete_dataset'),
     re_path(r'^imports/(?P<data_set_id>\d+)/citizens/?$',
             ListDataSetCitizensView.as_view(),
             name='list_citizens'),
+    re_path(r'^imports/(?P<data_set_id>\d+)/citizens/batch/?$',
+            UpdateCitizensView.as_view(),
+            name='update_citizens'),
     re_path(r'^imports/(?P<data_set_id>\d+)/citizens/(?P<citizen_id>\d+)/?$',
             UpdateCitizenView.as_view(),
             name='update_citizen'),
@@ -19,4 +29,7 @@ urlpatterns = [
     re_path(r'^imports/(?P<data_set_id>\d+)/towns/stat/percentile/age/?$',
             DataSetAgePercentiles.as_view(),
             name='get_age_percentiles'),
+    re_path(r'^imports/cache/stats/?$',
+            ResultCacheStatsView.as_view(),
+            name='result_cache_stats'),
 ]
@@ -0,0 +1,265 @@
+import multiprocessing
+import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+from rest_framework import serializers
+from rest_framework.serializers import as_serializer_error
+
+from imports.api.serializers import (MAX_APARTMENT, CitizenSerializer, CitizensRelationsValidator,
+                                     CreateDataSetSerializer, )
+
+CITIZEN_FIELDS = ('citizen_id', 'town', 'street', 'building', 'apartment', 'name',
+                  'birth_date', 'gender', 'relatives')
+CITIZEN_FIELDS_SET = frozenset(CITIZEN_FIELDS)
+STRING_FIELDS = ('town', 'street', 'building', 'name')
+GENDERS = frozenset(('male', 'female'))
+MAX_LENGTH = 256
+
+has_letter_or_digit = re.compile('[a-zA-Zа-яА-Я0-9]').search
+birth_date_match = re.compile(r'([0-9]{2})\.([0-9]{2})\.([0-9]{4})').fullmatch
+
+
+class CitizenValidator:
+    """Fast path of `CitizenSerializer` validation for new citizens.
+
+    Citizens of the common shape (exact set of fields, JSON types matching
+    fields, values passing validation) are validated with plain type checks
+    and precompiled regexps. Anything else is delegated to
+    `CitizenSerializer`, which remains the reference implementation and
+    produces errors, so results are the same as with the serializer.
+    """
+
+    def __init__(self):
+        self.serializer = CitizenSerializer()
+        self.today = datetime.utcnow().date()
+
+    @staticmethod
+    def _non_negative_int(value):
+        return type(value) is int and value >= 0
+
+    @staticmethod
+    def _string(value, letter_or_digit=True):
+        if type(value) is not str:
+            return None
+        value = value.strip()
+        if not value or len(value) > MAX_LENGTH or '\x00' in value:
+            return None
+        if letter_or_digit and not has_letter_or_digit(value):
+            return None
+        return value
+
+    def _birth_date(self, value):
+        if type(value) is not str:
+            return None
+        match = birth_date_match(value)
+        if match is None:
+            return None
+        day, month, year = match.groups()
+        try:
+            value = date(int(year), int(month), int(day))
+        except ValueError:
+            return None
+        return value if value < self.today else None
+
+    def fast_validation(self, data):
+        """Return validated citizen or None if fast path is not applicable."""
+        if type(data) is not dict or data.keys() != CITIZEN_FIELDS_SET:
+            return None
+
+        citizen_id = data['citizen_id']
+        apartment = data['apartment']
+        gender = data['gender']
+        relatives = data['relatives']
+        if not (self._non_negative_int(citizen_id)
+                and self._non_negative_int(apartment) and apartment <= MAX_APARTMENT
+                and type(gender) is str and gender in GENDERS
+                and type(relatives) is list and all(type(r) is int for r in relatives)):
+            return None
+
+        town = self._string(data['town'])
+        street = self._string(data['street'])
+        building = self._string(data['building'])
+        name = self._string(data['name'], letter_or_digit=False)
+        birth_date = self._birth_date(data['birth_date'])
+        if None in (town, street, building, name, birth_date):
+            return None
+
+        if citizen_id and citizen_id in relatives:
+            return None
+
+        return {
+            'citizen_id': citizen_id,
+            'town': town,
+            'street': street,
+            'building': building,
+            'apartment': apartment,
+            'name': name,
+            'birth_date': birth_date,
+            'gender': gender,
+            'relatives': list(relatives),
+        }
+
+    def run_validation(self, data):
+        validated = self.fast_validation(data)
+        if validated is None:
+            return self.serializer.run_validation(data)
+        return validated
+
+
+def validate_citizens(citizens):
+    """Validate citizens with `CitizenValidator`, return (validated, errors, has_errors).
+
+    `errors` has errors of every citizen in order, `{}` for valid ones.
+    """
+    citizen_validator = CitizenValidator()
+    validated = []
+    errors = []
+    has_errors = False
+    for citizen in citizens:
+        try:
+            validated.append(citizen_validator.run_validation(citizen))
+        except serializers.ValidationError as exc:
+            errors.append(exc.detail)
+            has_errors = True
+        else:
+            errors.append({})
+    return validated, errors, has_errors
+
+
+# citizens being validated by chunks, inherited by forked processes instead of being pickled
+_chunked_citizens = None
+
+
+def _validate_chunk(start, stop):
+    """Validate `_chunked_citizens[start:stop]` in a forked process.
+
+    Returns (errors, birth_dates, validated) sent back cheaply: errors of
+    all citizens of the chunk or None if all are valid, ordinals of birth
+    dates of citizens validated as they are, and citizens changed by
+    validation (stripped strings, serializer fallback) by index.
+    """
+    citizen_validator = CitizenValidator()
+    errors = []
+    has_errors = False
+    birth_dates = array('i')
+    validated = {}
+    for index in range(start, stop):
+        data = _chunked_citizens[index]
+        citizen = citizen_validator.fast_validation(data)
+        if citizen is None:
+            try:
+                validated[index] = citizen_validator.serializer.run_validation(data)
+            except serializers.ValidationError as exc:
+                errors.append(exc.detail)
+                has_errors = True
+                continue
+        elif any(citizen[field] is not data[field] for field in STRING_FIELDS):
+            validated[index] = citizen
+        errors.append({})
+        birth_dates.append(citizen['birth_date'].toordinal() if index not in validated else 0)
+    return errors if has_errors else None, birth_dates, validated
+
+
+def validate_citizens_parallel(citizens, workers, chunk_size):
+    """Validate citizens by chunks in `workers` forked processes as `validate_citizens` does.
+
+    Citizens valid as they are parsed are copied with birth dates parsed
+    from ordinals, only citizens changed otherwise are sent back whole.
+    """
+    global _chunked_citizens
+    bounds = [(start, min(start + chunk_size, len(citizens)))
+              for start in range(0, len(citizens), chunk_size)]
+    _chunked_citizens = citizens
+    try:
+        # forked processes only validate, they do not use connections of the parent
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('fork')) as pool:
+            results = list(pool.map(_validate_chunk, *zip(*bounds)))
+    finally:
+        _chunked_citizens = None
+
+    if any(errors is not None for errors, _, _ in results):
+        errors = []
+        for (start, stop), (chunk_errors, _, _) in zip(bounds, results):
+            errors.extend([{}] * (stop - start) if chunk_errors is None else chunk_errors)
+        return [], errors, True
+
+    validated = []
+    fromordinal = date.fromordinal
+    for (start, stop), (_, birth_dates, chunk_validated) in zip(bounds, results):
+        for index, birth_date in zip(range(start, stop), birth_dates):
+            citizen = chunk_validated.get(index)
+            if citizen is None:
+                citizen = {**citizens[index], 'birth_date': fromordinal(birth_date)}
+            validated.append(citizen)
+    return validated, [], False
+
+
+class CreateDataSetValidator:
+    """Drop-in replacement of `CreateDataSetSerializer` for validation only.
+
+    Citizens are validated in a batch with `CitizenValidator`; payloads not
+    shaped as `{"citizens": [...]}` with a non-empty list are validated by
+    `CreateDataSetSerializer` itself.
+
+    With `workers`, citizens are validated by chunks of `chunk_size` in
+    parallel processes and cross-citizen checks run over the merged chunks,
+    so results and errors are the same as of the serial validation.
+    """
+
+    def __init__(self, data, workers=None, chunk_size=10000):
+        self.initial_data = data
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    def is_valid(self, raise_exception=False):
+        if not hasattr(self, '_validated_data'):
+            try:
+                self._validated_data = self.run_validation(self.initial_data)
+            except serializers.ValidationError as exc:
+                self._validated_data = {}
+                self._errors = exc.detail
+            else:
+                self._errors = {}
+
+        if self._errors and raise_exception:
+            raise serializers.ValidationError(self.errors)
+
+        return not bool(self._errors)
+
+    @property
+    def errors(self):
+        return self._errors
+
+    @property
+    def validated_data(self):
+        return self._validated_data
+
+    def run_validation(self, data):
+        if (type(data) is not dict or data.keys() != {'citizens'}
+                or type(data['citizens']) is not list or not data['citizens']):
+            serializer = CreateDataSetSerializer(data=data)
+            serializer.is_valid(raise_exception=True)
+            return serializer.validated_data
+
+        citizens = data['citizens']
+        if self.workers and self.workers > 1 and len(citizens) > self.chunk_size:
+            validated, errors, has_errors = validate_citizens_parallel(
+                    citizens, self.workers, self.chunk_size)
+        else:
+            validated, errors, has_errors = validate_citizens(citizens)
+
+        if has_errors:
+            raise serializers.ValidationError({'citizens': errors})
+
+        try:
+            relations = CitizensRelationsValidator()
+            for citizen in validated:
+                relations.add(citizen)
+            relations.validate()
+        except serializers.ValidationError as exc:
+            raise serializers.ValidationError(detail=as_serializer_error(exc))
+
+        return {'citizens': validated}
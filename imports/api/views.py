@@ -1,25 +1,145 @@
-from django.db import transaction, models
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection, transaction, models
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags
+from django.views.decorators.http import etag
 from rest_framework.exceptions import APIException, NotFound
 from rest_framework.generics import CreateAPIView, GenericAPIView
 from rest_framework.response import Response
 from rest_framework import status, serializers
 from rest_framework.views import APIView
 
-from imports.api.models import Citizen, DataSet
-from imports.api.operations import (create_dataset, update_citizen, get_birthday_stats2,
-                                    get_age_percentiles_per_town, )
-from imports.api.serializers import (CreateDataSetSerializer, CitizenSerializer,
-                                     UpdateCitizenSerializer, )
+from imports.api.cache import cached_result, get_result_cache
+from imports.api.jobs import spool_import, validate_data_set, validate_data_set_stream
+from imports.api.models import Citizen, DataSet, ImportJob
+from imports.api.operations import (create_dataset, create_dataset_from_stream, delete_dataset,
+                                    update_citizen, update_citizens, list_citizens, iter_citizens,
+                                    retry_on_conflict, RevisionConflict, ConcurrentUpdate,
+                                    BIRTHDAY_STATS_ENGINES, AGE_PERCENTILES_ENGINES,
+                                    CITIZEN_LISTING_FIELDS, )
+from imports.api.relatives import get_relatives_storage
+from imports.api.serializers import (CitizenSerializer, UpdateCitizenSerializer,
+                                     UpdateCitizensSerializer, citizen_row_representation, )
+
+
+def dumps(data):
+    """Serialize data to JSON as compact `JSONRenderer` does."""
+    ret = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return ret.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029')
+
+
+def data_set_etag(request, data_set_id, **kwargs):
+    """ETag of data set read views, changes with data set revision.
+
+    Revision is read before the data, so a response built concurrently with
+    an update can only be tagged with an older revision and will be
+    refetched on the next request.
+    """
+    revision = DataSet.objects.filter(id=data_set_id).values_list('revision', flat=True).first()
+    if revision is None:
+        return None
+    return f'{data_set_id}.{revision}'
+
+
+def age_percentiles_etag(request, data_set_id, **kwargs):
+    """ETag of age percentiles, changes with data set revision and with the current UTC date."""
+    tag = data_set_etag(request, data_set_id)
+    if tag is None:
+        return None
+    return f'{tag}.{datetime.utcnow().date():%Y%m%d}'
+
+
+def citizen_representation(citizen):
+    """Representation of updated citizen with `relatives_ids` already known."""
+    row = tuple(getattr(citizen, field) for field in CITIZEN_LISTING_FIELDS)
+    return citizen_row_representation(row + (citizen.relatives_ids,))
+
+
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'Data set was changed.'
+    default_code = 'precondition_failed'
+
+
+class Conflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Citizens are being updated concurrently, try again.'
+    default_code = 'conflict'
+
+
+def if_match_revision(request, data_set_id):
+    """Data set revision required by If-Match header, None when any revision is allowed."""
+    header = request.META.get('HTTP_IF_MATCH')
+    if header is None:
+        return None
+
+    etags = parse_etags(header)
+    if etags == ['*']:
+        return None
+
+    for tag in etags:
+        # only strong tags of data_set_etag and age_percentiles_etag formats can match
+        tag_data_set_id, _, revision = tag.strip('"').partition('.')
+        revision = revision.partition('.')[0]
+        if tag.startswith('"') and tag_data_set_id == str(data_set_id) and revision.isdigit():
+            return int(revision)
+    raise PreconditionFailed()
+
+
+def run_update(request, func, data_set_id, **kwargs):
+    """Run update operation with locking and retries of settings and If-Match of request."""
+    try:
+        return retry_on_conflict(func,
+                                 data_set_id=data_set_id,
+                                 lock=settings.IMPORTS_ORDERED_LOCKING,
+                                 revision=if_match_revision(request, data_set_id),
+                                 retries=settings.IMPORTS_UPDATE_RETRIES,
+                                 delay=settings.IMPORTS_UPDATE_RETRY_DELAY,
+                                 **kwargs)
+    except models.ObjectDoesNotExist as e:
+        raise NotFound(detail=e)
+    except RevisionConflict as e:
+        raise PreconditionFailed(detail=e)
+    except ConcurrentUpdate as e:
+        raise Conflict(detail=e)
 
 
 class CreateDataSetView(APIView):
     def create_dataset(self, data):
-        serializer = CreateDataSetSerializer(data=data)
-        serializer.is_valid(raise_exception=True)
-        return create_dataset(citizens=serializer.validated_data['citizens'])
+        return create_dataset(citizens=validate_data_set(data))
+
+    def create_dataset_from_stream(self, stream):
+        return create_dataset_from_stream(citizens=validate_data_set_stream(stream),
+                                          batch_size=settings.IMPORTS_STREAMING_BATCH_SIZE)
+
+    def spool_import(self, request):
+        content_length = request.META.get('CONTENT_LENGTH')
+        job = spool_import(request.stream,
+                           content_length=int(content_length) if content_length else None)
+        data = {
+            'data': {
+                'job_id': job.id,
+            }
+        }
+        headers = {
+            'Location': reverse('get_import_job', kwargs={'job_id': job.id}),
+        }
+        return Response(data=data, status=status.HTTP_202_ACCEPTED, headers=headers)
 
     def post(self, request):
-        dataset_id = self.create_dataset(data=request.data)
+        is_json = request.content_type.startswith('application/json')
+        if settings.IMPORTS_ASYNC_IMPORT and is_json:
+            # validated and imported by `manage.py run_import_jobs`
+            return self.spool_import(request)
+        if settings.IMPORTS_STREAMING_IMPORT and is_json:
+            dataset_id = self.create_dataset_from_stream(stream=request.stream)
+        else:
+            dataset_id = self.create_dataset(data=request.data)
         data = {
             'data': {
                 'import_id': dataset_id,
@@ -28,8 +148,40 @@ class CreateDataSetView(APIView):
         return Response(data=data, status=status.HTTP_201_CREATED)
 
 
+class ImportJobView(APIView):
+    def get(self, request, job_id):
+        try:
+            job = ImportJob.objects.get(id=job_id)
+        except ImportJob.DoesNotExist as e:
+            raise NotFound(detail=e)
+
+        response_data = {
+            'data': {
+                'job_id': job.id,
+                'status': job.status,
+                'import_id': job.import_id,
+                'errors': None if job.errors is None else json.loads(job.errors),
+                # changed with every status, tells how long a job is validating or importing
+                'created_at': job.created_at,
+                'updated_at': job.updated_at,
+            }
+        }
+        return Response(data=response_data, status=status.HTTP_200_OK)
+
+
+class DeleteDataSetView(APIView):
+    def delete(self, request, data_set_id):
+        try:
+            purged = delete_dataset(int(data_set_id))
+        except DataSet.DoesNotExist as e:
+            raise NotFound(detail=e)
+        # rows of large data sets are removed later by `manage.py run_import_jobs` or
+        # `manage.py purge_data_sets`
+        return Response(status=status.HTTP_204_NO_CONTENT if purged else status.HTTP_202_ACCEPTED)
+
+
 class UpdateCitizenView(APIView):
-    def update_citizen(self, data_set_id, citizen_id, citizen_data):
+    def update_citizen(self, request, data_set_id, citizen_id, citizen_data):
         key_serializer = UpdateCitizenSerializer(data={
             'data_set_id': data_set_id,
             'citizen_id': citizen_id,
@@ -46,65 +198,129 @@ class UpdateCitizenView(APIView):
             raise serializers.ValidationError('Citizen can not be relative to itself.')
 
         citizen_validated_data = serializer.validated_data
-        try:
-            updated_citizen = update_citizen(data_set_id=data_set_id,
-                                             citizen_id=citizen_id,
-                                             citizen_data=citizen_validated_data)
-        except models.ObjectDoesNotExist as e:
-            raise NotFound(detail=e)
+        updated_citizen = run_update(request, update_citizen,
+                                     data_set_id=data_set_id,
+                                     citizen_id=citizen_id,
+                                     citizen_data=citizen_validated_data)
 
-        return CitizenSerializer(instance=updated_citizen).data
+        return citizen_representation(updated_citizen)
 
     def patch(self, request, data_set_id, citizen_id):
         updated_citizen_data = self.update_citizen(
-                data_set_id, citizen_id, citizen_data=request.data)
+                request, data_set_id, citizen_id, citizen_data=request.data)
         data = {
             'data': updated_citizen_data,
         }
         return Response(data=data, status=status.HTTP_200_OK)
 
 
+class UpdateCitizensView(APIView):
+    def patch(self, request, data_set_id):
+        serializer = UpdateCitizensSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        updated_citizens = run_update(request, update_citizens,
+                                      data_set_id=int(data_set_id),
+                                      citizens_data=serializer.validated_data['citizens'])
+
+        data = {
+            'data': [citizen_representation(citizen) for citizen in updated_citizens],
+        }
+        return Response(data=data, status=status.HTTP_200_OK)
+
+
 class ListDataSetCitizensView(APIView):
-    def get(self, request, data_set_id):
-        try:
-            data_set = DataSet.objects.get(id=data_set_id)
-        except DataSet.DoesNotExist as e:
-            raise NotFound(e)
+    def list_citizens(self, data_set):
+        engine = settings.IMPORTS_CITIZENS_LISTING
+        if engine == 'auto':
+            engine = 'array_agg' if connection.vendor == 'postgresql' else 'prefetch'
+
+        if engine == 'array_agg':
+            return [citizen_row_representation(row) for row in list_citizens(data_set.id)]
+
+        if settings.IMPORTS_RELATIVES_STORAGE == 'pairs':
+            citizens = list(Citizen.objects
+                            .filter(data_set=data_set).order_by('citizen_id')
+                            .select_related('town', 'street'))
+            get_relatives_storage().prefetch_relatives(data_set.id, citizens)
+            return [citizen_representation(citizen) for citizen in citizens]
 
         citizens = (Citizen.objects
                     .filter(data_set=data_set).order_by('citizen_id')
+                    .select_related('town', 'street')
                     # .prefetch_related('to_citizen_relatives')
                     # .prefetch_related('from_citizen_relatives')
                     .prefetch_related('relatives').all())
+        return CitizenSerializer(citizens, many=True).data
+
+    def stream_citizens(self, data_set):
+        """Render `{"data": [...]}` envelope by batches of citizens."""
+        yield '{"data":['
+        separator = ''
+        batches = iter_citizens(data_set.id,
+                                batch_size=settings.IMPORTS_STREAM_CITIZENS_BATCH_SIZE)
+        for rows in batches:
+            yield separator + ','.join(dumps(citizen_row_representation(row)) for row in rows)
+            separator = ','
+        yield ']}'
+
+    @method_decorator(etag(data_set_etag))
+    def get(self, request, data_set_id):
+        try:
+            data_set = DataSet.objects.get(id=data_set_id)
+        except DataSet.DoesNotExist as e:
+            raise NotFound(e)
+
+        if settings.IMPORTS_STREAM_CITIZENS:
+            return StreamingHttpResponse(self.stream_citizens(data_set),
+                                         content_type='application/json')
+
         response_data = {
-            'data': CitizenSerializer(citizens, many=True).data
+            'data': cached_result(data_set, 'citizens', lambda: self.list_citizens(data_set)),
         }
 
         return Response(data=response_data, status=status.HTTP_200_OK)
 
 
 class DataSetBirthdaysView(APIView):
+    @method_decorator(etag(data_set_etag))
     def get(self, request, data_set_id):
         try:
-            DataSet.objects.get(id=data_set_id)
+            data_set = DataSet.objects.get(id=data_set_id)
         except DataSet.DoesNotExist as e:
             raise NotFound(detail=e)
 
+        get_birthday_stats = BIRTHDAY_STATS_ENGINES[settings.IMPORTS_BIRTHDAYS_ENGINE]
         response_data = {
-            'data': get_birthday_stats2(data_set_id=data_set_id)
+            'data': cached_result(data_set, 'birthdays',
+                                  lambda: get_birthday_stats(data_set_id=data_set.id))
         }
         return Response(data=response_data, status=status.HTTP_200_OK)
 
 
 class DataSetAgePercentiles(APIView):
+    @method_decorator(etag(age_percentiles_etag))
     def get(self, request, data_set_id):
         try:
-            DataSet.objects.get(id=data_set_id)
+            data_set = DataSet.objects.get(id=data_set_id)
         except DataSet.DoesNotExist as e:
             raise NotFound(detail=e)
 
-        percentiles = get_age_percentiles_per_town(data_set_id=data_set_id)
+        get_age_percentiles = AGE_PERCENTILES_ENGINES[settings.IMPORTS_PERCENTILES_ENGINE]
+        # ages change with the date, results of a revision are cached for the current day only
+        endpoint = f'percentiles.{datetime.utcnow().date():%Y%m%d}'
+        percentiles = cached_result(data_set, endpoint,
+                                    lambda: get_age_percentiles(data_set_id=data_set.id))
         response_data = {
             'data': percentiles,
         }
         return Response(data=response_data, status=status.HTTP_200_OK)
+
+
+class ResultCacheStatsView(APIView):
+    def get(self, request):
+        cache = get_result_cache()
+        response_data = {
+            'data': cache.get_stats() if cache is not None else None,
+        }
+        return Response(data=response_data, status=status.HTTP_200_OK)
@@ -108,6 +108,93 @@ def settings():
 
     STATIC_URL = '/static/'
 
+    # Imports API
+
+    # loader of new data sets: 'copy' (PostgreSQL COPY), 'orm' (bulk_create) or 'auto'
+    IMPORTS_DATA_SET_LOADER = 'auto'
+
+    # validate common citizens with CitizenValidator, falling back to CitizenSerializer
+    IMPORTS_FAST_VALIDATION = True
+
+    # validate citizens of payloads longer than IMPORTS_VALIDATION_CHUNK_SIZE by chunks in
+    # IMPORTS_VALIDATION_WORKERS processes forked by jobs of `manage.py run_import_jobs`, needs
+    # IMPORTS_ASYNC_IMPORT, IMPORTS_FAST_VALIDATION and not IMPORTS_STREAMING_IMPORT; None
+    # validates in the job process, requests are always validated in their own process
+    IMPORTS_VALIDATION_WORKERS = None
+    IMPORTS_VALIDATION_CHUNK_SIZE = 10000
+
+    # fill created_at/updated_at of citizens, NULL (no space in rows) when disabled
+    IMPORTS_CITIZEN_TIMESTAMPS = True
+
+    # storage of relations: 'rows' (CitizenRelative row per direction) or 'pairs' (single
+    # CitizenPair row per relation), switch with `manage.py convert_relatives`
+    IMPORTS_RELATIVES_STORAGE = 'rows'
+
+    # tables of citizens and relations are partitioned by data set, a partition is created
+    # for every new data set; switch with `manage.py partition_tables`. Partitions of deleted
+    # data sets are dropped later, as IMPORTS_DELETE_ASYNC_MIN_CITIZENS data sets are purged
+    IMPORTS_PARTITION_DATA_SETS = False
+
+    # data sets with at least this many citizens are only marked deleted by DELETE /imports/{id},
+    # their rows are removed by `manage.py run_import_jobs` when its queue is empty, so without
+    # IMPORTS_ASYNC_IMPORT schedule `manage.py purge_data_sets` (e.g. by cron) instead;
+    # None removes rows of all right away
+    IMPORTS_DELETE_ASYNC_MIN_CITIZENS = 10000
+
+    # GET /imports/{id}/citizens engine: 'array_agg' (single query), 'prefetch' or 'auto'
+    IMPORTS_CITIZENS_LISTING = 'auto'
+
+    # stream GET /imports/{id}/citizens response read by batches from a server-side cursor
+    IMPORTS_STREAM_CITIZENS = False
+    IMPORTS_STREAM_CITIZENS_BATCH_SIZE = 1000
+
+    # GET /imports/{id}/citizens/birthdays engine: 'sql' (GROUP BY query), 'snapshot',
+    # 'materialized' (needs IMPORTS_MATERIALIZED_BIRTHDAYS) or 'python'
+    IMPORTS_BIRTHDAYS_ENGINE = 'sql'
+
+    # keep presents of citizens in BirthdayPresents on import and updates, fill data sets
+    # imported before enabling with `manage.py check_birthdays --fix`
+    IMPORTS_MATERIALIZED_BIRTHDAYS = False
+
+    # GET /imports/{id}/towns/stat/percentile/age engine: 'numpy' (vectorized),
+    # 'database' (percentile_cont in PostgreSQL), 'snapshot', 'histogram' (needs
+    # IMPORTS_BIRTH_DATE_HISTOGRAM) or 'python'
+    IMPORTS_PERCENTILES_ENGINE = 'numpy'
+
+    # keep numbers of citizens by town and birth date in TownBirthDates on import and updates,
+    # fill data sets imported before enabling with `manage.py build_histograms`
+    IMPORTS_BIRTH_DATE_HISTOGRAM = False
+
+    # 'snapshot' engines compute over NumPy arrays of data sets, reloaded on change of data set
+    # revision: 'locmem' (LRU of this process) or 'mmap' (files mapped by all workers of a host),
+    # evicted when over IMPORTS_SNAPSHOT_MAX_BYTES
+    IMPORTS_SNAPSHOT_STORE = 'locmem'
+    IMPORTS_SNAPSHOT_MAX_BYTES = 256 * 1024 * 1024
+    IMPORTS_SNAPSHOT_PATH = os.path.join(BASE_DIR, 'var', 'snapshots')
+
+    # lock citizens rows in order of primary keys on PATCH, retry serialization failures
+    # and deadlocks up to IMPORTS_UPDATE_RETRIES times with exponential backoff
+    IMPORTS_ORDERED_LOCKING = True
+    IMPORTS_UPDATE_RETRIES = 3
+    IMPORTS_UPDATE_RETRY_DELAY = 0.05
+
+    # cache of citizens, birthdays and percentiles results by data set revision:
+    # 'locmem' (LRU of this process), 'sqlite' (file shared by workers) or None
+    IMPORTS_RESULT_CACHE = 'locmem'
+    IMPORTS_RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    IMPORTS_RESULT_CACHE_PATH = os.path.join(BASE_DIR, 'var', 'result_cache.sqlite3')
+
+    # parse and insert POST /imports body incrementally by batches of citizens
+    IMPORTS_STREAMING_IMPORT = False
+    IMPORTS_STREAMING_BATCH_SIZE = 1000
+
+    # POST /imports spools body to IMPORTS_JOB_SPOOL_PATH and answers 202 with a job id, jobs
+    # are run by `manage.py run_import_jobs` in IMPORTS_JOB_WORKERS processes and reported by
+    # GET /imports/jobs/{id}
+    IMPORTS_ASYNC_IMPORT = False
+    IMPORTS_JOB_WORKERS = 2
+    IMPORTS_JOB_SPOOL_PATH = os.path.join(BASE_DIR, 'var', 'spool')
+
     return locals()
 
 
@@ -1,5 +1,7 @@
 from itertools import chain
 
+import numpy as np
+
 
 def get_latin_russian_digit():
     ranges = [
@@ -21,4 +23,81 @@ def calculate_age(current_date, birth_date):
     years = current_date.year - birth_date.year
     if (birth_date.month, birth_date.day) < (current_date.month, current_date.day):
         years -= 1
-    return years
\ No newline at end of file
+    return years
+
+
+def chunked(iterable, size):
+    """Split iterable into lists of at most `size` elements."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def calculate_ages(current_date, birth_years, birth_month_days):
+    """Vectorized `calculate_age` for arrays of birth years and birth `month * 100 + day`."""
+    ages = current_date.year - np.asarray(birth_years, dtype=np.int64)
+    before = np.asarray(birth_month_days) < current_date.month * 100 + current_date.day
+    return ages - before.astype(np.int64)
+
+
+def grouped_percentiles(groups, values, percentiles):
+    """Linear percentiles of values per group, same as `np.percentile` for each group.
+
+    Returns sorted unique groups and array of shape (len(groups), len(percentiles)).
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values)
+    order = np.lexsort((values, groups))
+    values = values[order]
+    groups, starts, counts = np.unique(groups[order], return_index=True, return_counts=True)
+
+    last = (counts - 1)[:, np.newaxis]
+    virtual_indexes = last * np.true_divide(percentiles, 100)[np.newaxis, :]
+    previous_indexes = np.floor(virtual_indexes)
+    gamma = virtual_indexes - previous_indexes
+
+    previous_indexes = np.minimum(previous_indexes.astype(np.intp), last)
+    next_indexes = np.minimum(previous_indexes + 1, last)
+    previous = values[starts[:, np.newaxis] + previous_indexes]
+    next = values[starts[:, np.newaxis] + next_indexes]
+
+    # interpolate as numpy does to get the same rounding
+    diff = next - previous
+    return groups, np.where(gamma >= 0.5, next - diff * (1 - gamma), previous + diff * gamma)
+
+
+def grouped_weighted_percentiles(groups, values, counts, percentiles):
+    """`grouped_percentiles` of values repeated `counts` times, without repeating them.
+
+    Positions of percentiles in each group are found in cumulative counts,
+    so the work depends on the number of distinct values only.
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values)
+    counts = np.asarray(counts, dtype=np.int64)
+    order = np.lexsort((values, groups))
+    groups, values, counts = groups[order], values[order], counts[order]
+    ends = np.cumsum(counts)
+    groups, starts = np.unique(groups, return_index=True)
+    firsts = (ends - counts)[starts]
+    totals = np.add.reduceat(counts, starts) if len(starts) else counts[:0]
+
+    last = (totals - 1)[:, np.newaxis]
+    virtual_indexes = last * np.true_divide(percentiles, 100)[np.newaxis, :]
+    previous_indexes = np.floor(virtual_indexes)
+    gamma = virtual_indexes - previous_indexes
+
+    previous_indexes = np.minimum(previous_indexes.astype(np.int64), last)
+    next_indexes = np.minimum(previous_indexes + 1, last)
+    first = firsts[:, np.newaxis]
+    previous = values[np.searchsorted(ends, first + previous_indexes, side='right')]
+    next = values[np.searchsorted(ends, first + next_indexes, side='right')]
+
+    # interpolate as numpy does to get the same rounding
+    diff = next - previous
+    return groups, np.where(gamma >= 0.5, next - diff * (1 - gamma), previous + diff * gamma)
@@ -3,7 +3,13 @@ from datetime import date
 import pytest
 from rest_framework.test import APIRequestFactory, APIClient
 
-from imports.api.models import Citizen, DataSet, CitizenRelative
+from imports.api.models import Citizen, DataSet, CitizenRelative, Street, Town
+
+
+@pytest.fixture(autouse=True)
+def no_result_cache(settings):
+    """Compute results on every request, tests of the cache enable it explicitly."""
+    settings.IMPORTS_RESULT_CACHE = None
 
 
 @pytest.fixture(scope='session')
@@ -104,6 +110,8 @@ def data_set(create_citizens_data):
     for data in create_citizens_data:
         data = data.copy()
         data.pop('relatives')
+        data['town'] = Town.objects.intern([data['town']])[data['town']]
+        data['street'] = Street.objects.intern([data['street']])[data['street']]
         created.append(Citizen.objects.create(**data, data_set=ds))
 
     pairs = {}
@@ -0,0 +1,110 @@
+import io
+import random
+from datetime import date
+
+import pytest
+from django.core.management import CommandError, call_command
+
+from imports.api.birthdays import birthday_presents_differ
+from imports.api.models import BirthdayPresents
+from imports.api.operations import (create_dataset, create_dataset_from_stream, delete_dataset,
+                                    update_citizen, update_citizens, get_birthday_stats_sql,
+                                    get_birthday_stats_materialized, )
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True, params=['rows', 'pairs'])
+def storage(request, settings):
+    settings.IMPORTS_MATERIALIZED_BIRTHDAYS = True
+    settings.IMPORTS_RELATIVES_STORAGE = request.param
+    return request.param
+
+
+@pytest.fixture()
+def citizens_data(create_citizens_data):
+    rnd = random.Random(20190907)
+    base = create_citizens_data[0]
+    data = [{**base, 'citizen_id': cid, 'relatives': [],
+             'birth_date': base['birth_date'].replace(month=rnd.randint(1, 12))}
+            for cid in range(1, 16)]
+    for _ in range(25):
+        a, b = rnd.sample(data, 2)
+        if b['citizen_id'] not in a['relatives']:
+            a['relatives'].append(b['citizen_id'])
+            b['relatives'].append(a['citizen_id'])
+    return data
+
+
+@pytest.fixture()
+def data_set_id(citizens_data):
+    return create_dataset([{**c, 'relatives': list(c['relatives'])} for c in citizens_data])
+
+
+def assert_consistent(data_set_id):
+    assert not birthday_presents_differ(data_set_id)
+    assert get_birthday_stats_materialized(data_set_id) == get_birthday_stats_sql(data_set_id)
+
+
+def test_fill(data_set_id, citizens_data):
+    assert BirthdayPresents.objects.filter(data_set_id=data_set_id).exists()
+    assert_consistent(data_set_id)
+
+    stream_data_set_id = create_dataset_from_stream(
+            iter([{**c, 'relatives': list(c['relatives'])} for c in citizens_data]), batch_size=4)
+    assert (get_birthday_stats_materialized(stream_data_set_id) ==
+            get_birthday_stats_materialized(data_set_id))
+
+
+def test_empty_data_set():
+    data_set_id = create_dataset([])
+    assert_consistent(data_set_id)
+
+
+@pytest.mark.parametrize('citizen_data', [
+    {'birth_date': date(1990, 2, 28)},
+    {'relatives': [2, 3, 4]},
+    {'relatives': []},
+    {'birth_date': date(1990, 5, 1), 'relatives': [5, 6]},
+])
+def test_update_citizen(data_set_id, citizen_data):
+    update_citizen(data_set_id, 1, citizen_data)
+    assert_consistent(data_set_id)
+
+
+def test_update_touches_affected_rows_only(data_set_id, citizens_data):
+    unrelated = {c['citizen_id'] for c in citizens_data} - {1} - set(citizens_data[0]['relatives'])
+    kept = set(BirthdayPresents.objects.filter(data_set_id=data_set_id, citizen_id__in=unrelated)
+               .values_list('id', flat=True))
+
+    update_citizen(data_set_id, 1, {'birth_date': citizens_data[0]['birth_date'].replace(day=1)})
+    assert kept <= set(BirthdayPresents.objects.values_list('id', flat=True))
+
+    update_citizen(data_set_id, 1, {'name': 'Петя'})
+    assert_consistent(data_set_id)
+
+
+def test_update_citizens(data_set_id, citizens_data):
+    birth_date = citizens_data[0]['birth_date']
+    update_citizens(data_set_id, [{'citizen_id': 4, 'relatives': [1, 6, 7]},
+                                  {'citizen_id': 6, 'relatives': [],
+                                   'birth_date': birth_date.replace(month=3)},
+                                  {'citizen_id': 7, 'birth_date': birth_date.replace(month=4)},
+                                  {'citizen_id': 8, 'name': 'Вася'}])
+    assert_consistent(data_set_id)
+
+
+def test_delete(data_set_id):
+    delete_dataset(data_set_id)
+    assert not BirthdayPresents.objects.filter(data_set_id=data_set_id).exists()
+
+
+def test_check_birthdays(data_set_id):
+    call_command('check_birthdays', stdout=io.StringIO())
+
+    BirthdayPresents.objects.filter(data_set_id=data_set_id).first().delete()
+    with pytest.raises(CommandError):
+        call_command('check_birthdays', data_set_id, stdout=io.StringIO())
+
+    call_command('check_birthdays', '--fix', stdout=io.StringIO())
+    assert_consistent(data_set_id)
@@ -0,0 +1,163 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+from django.urls import reverse
+from hamcrest import assert_that, has_entries
+from rest_framework import status
+
+from imports.api.cache import (LocMemResultCache, SqliteResultCache, cached_result,
+                               get_result_cache, )
+from imports.api.models import DataSet
+
+
+@pytest.fixture(params=['locmem', 'sqlite'])
+def make_cache(request, tmp_path):
+    def func(max_bytes):
+        if request.param == 'sqlite':
+            return SqliteResultCache(str(tmp_path / 'cache.sqlite3'), max_bytes)
+        return LocMemResultCache(max_bytes)
+
+    return func
+
+
+def test_get_set(make_cache):
+    cache = make_cache(1024)
+    assert cache.get((1, 1, 'birthdays')) is None
+
+    cache.set((1, 1, 'birthdays'), {'1': []})
+    assert cache.get((1, 1, 'birthdays')) == {'1': []}
+    assert cache.get((1, 2, 'birthdays')) is None
+    assert cache.get((1, 1, 'percentiles')) is None
+    assert_that(cache.get_stats(), has_entries({
+        'hits': 1,
+        'misses': 3,
+        'evictions': 0,
+        'entries': 1,
+    }))
+
+
+def test_lru_eviction(make_cache):
+    value = 'x' * 100
+    cache = make_cache(350)
+    for revision in range(3):
+        cache.set((1, revision, 'citizens'), value)
+    assert cache.get((1, 0, 'citizens')) == value
+
+    cache.set((1, 3, 'citizens'), value)
+    assert cache.get((1, 0, 'citizens')) == value
+    assert cache.get((1, 1, 'citizens')) is None
+    assert_that(cache.get_stats(), has_entries({
+        'evictions': 1,
+        'entries': 3,
+    }))
+    assert cache.get_stats()['bytes'] <= 350
+
+
+def test_too_large_value(make_cache):
+    cache = make_cache(10)
+    cache.set((1, 1, 'citizens'), 'x' * 100)
+    assert cache.get((1, 1, 'citizens')) is None
+
+
+def test_delete_data_set(make_cache):
+    cache = make_cache(1024)
+    cache.set((1, 1, 'citizens'), [])
+    cache.set((1, 2, 'birthdays'), {})
+    cache.set((2, 1, 'citizens'), [1])
+
+    cache.delete_data_set(1)
+    assert cache.get((1, 1, 'citizens')) is None
+    assert cache.get((1, 2, 'birthdays')) is None
+    assert cache.get((2, 1, 'citizens')) == [1]
+    assert cache.get_stats()['entries'] == 1
+
+
+def test_sqlite_reads_not_blocked_by_writer(tmp_path, mocker):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = SqliteResultCache(path, 1024)
+    cache.set((1, 1, 'citizens'), [1])
+    assert cache.connect() is cache.connect()
+
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        mocker.patch.object(cache, 'FLUSH_INTERVAL', -1)
+        assert cache.get((1, 1, 'citizens')) == [1]
+        assert cache.get((1, 2, 'citizens')) is None
+    finally:
+        writer.execute('ROLLBACK')
+        writer.close()
+
+    # access times and stats written later
+    assert_that(cache.get_stats(), has_entries({'hits': 1, 'misses': 1}))
+
+
+@pytest.mark.django_db
+class TestCachedResult:
+    @pytest.fixture(autouse=True, params=['locmem', 'sqlite'])
+    def result_cache(self, request, settings, tmp_path):
+        settings.IMPORTS_RESULT_CACHE = request.param
+        settings.IMPORTS_RESULT_CACHE_PATH = str(tmp_path / 'cache.sqlite3')
+
+    def test_computed_once(self, mocker):
+        data_set = DataSet.objects.create()
+        func = mocker.Mock(return_value=[1, 2])
+
+        assert cached_result(data_set, 'citizens', func) == [1, 2]
+        assert cached_result(data_set, 'citizens', func) == [1, 2]
+        assert func.call_count == 1
+
+        data_set.revision += 1
+        assert cached_result(data_set, 'citizens', func) == [1, 2]
+        assert func.call_count == 2
+
+    @pytest.mark.django_db(transaction=True)
+    def test_invalidated_on_update(self, api_client, citizen1):
+        list_url = reverse('list_citizens', kwargs={'data_set_id': citizen1.data_set_id})
+        api_client.get(list_url)
+        api_client.get(list_url)
+        assert_that(get_result_cache().get_stats(), has_entries({
+            'hits': 1,
+            'misses': 1,
+            'entries': 1,
+        }))
+
+        response = api_client.patch(reverse('update_citizen', kwargs={
+            'data_set_id': citizen1.data_set_id,
+            'citizen_id': citizen1.citizen_id,
+        }), data={'name': 'Дима'})
+        assert response.status_code == status.HTTP_200_OK
+        assert get_result_cache().get_stats()['entries'] == 0
+
+        response = api_client.get(list_url)
+        assert response.data['data'][0]['name'] == 'Дима'
+
+    def test_age_percentiles_recomputed_next_day(self, api_client, data_set, mocker):
+        url = reverse('get_age_percentiles', kwargs={'data_set_id': data_set.id})
+        engine = mocker.patch.dict('imports.api.views.AGE_PERCENTILES_ENGINES', {
+            'numpy': mocker.Mock(return_value=[])})['numpy']
+        api_client.get(url)
+        api_client.get(url)
+        assert engine.call_count == 1
+
+        tomorrow = datetime.utcnow() + timedelta(days=1)
+        mocker.patch('imports.api.views.datetime', mocker.Mock(utcnow=lambda: tomorrow))
+        api_client.get(url)
+        assert engine.call_count == 2
+
+    def test_stats_view(self, api_client):
+        response = api_client.get(reverse('result_cache_stats'))
+        assert_that(response.data, has_entries({
+            'data': has_entries({
+                'hits': 0,
+                'misses': 0,
+                'evictions': 0,
+            }),
+        }))
+
+
+@pytest.mark.django_db
+def test_stats_view_disabled(api_client):
+    response = api_client.get(reverse('result_cache_stats'))
+    assert response.data == {'data': None}
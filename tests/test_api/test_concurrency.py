@@ -0,0 +1,60 @@
+import random
+import threading
+
+import pytest
+from django.db import connection
+
+from imports.api import operations
+from imports.api.models import CitizenRelative, DataSet
+from imports.api.operations import create_dataset, retry_on_conflict, update_citizen
+
+WRITERS = 8
+UPDATES_PER_WRITER = 25
+CITIZENS = 12
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_updates(create_citizens_data, mocker):
+    """Many writers PATCH overlapping relatives of one data set with ordered locking."""
+    base = create_citizens_data[0]
+    data_set_id = create_dataset([{**base, 'citizen_id': cid, 'relatives': []}
+                                  for cid in range(1, CITIZENS + 1)])
+    is_retryable = mocker.patch('imports.api.operations.is_retryable',
+                                wraps=operations.is_retryable)
+    errors = []
+
+    def writer(seed):
+        rnd = random.Random(seed)
+        try:
+            for _ in range(UPDATES_PER_WRITER):
+                citizen_id = rnd.randint(1, CITIZENS)
+                others = [cid for cid in range(1, CITIZENS + 1) if cid != citizen_id]
+                relatives = rnd.sample(others, rnd.randint(0, 4))
+                retry_on_conflict(update_citizen,
+                                  data_set_id=data_set_id,
+                                  citizen_id=citizen_id,
+                                  citizen_data={'relatives': relatives},
+                                  lock=True,
+                                  retries=10,
+                                  delay=0.001)
+        except Exception as exc:
+            errors.append(exc)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    # every update is applied once, bumping revision of the data set
+    assert DataSet.objects.get(id=data_set_id).revision == 1 + WRITERS * UPDATES_PER_WRITER
+
+    deadlocks = [exc for (exc, ), _ in is_retryable.call_args_list
+                 if getattr(exc.__cause__, 'pgcode', None) == '40P01']
+    assert deadlocks == []
+
+    edges = set(CitizenRelative.objects.values_list('citizen_id', 'relative_id'))
+    assert edges == {(rid, cid) for cid, rid in edges}
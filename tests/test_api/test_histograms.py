@@ -0,0 +1,117 @@
+import io
+import random
+from datetime import date, timedelta
+
+import pytest
+from django.core.management import call_command
+
+from imports.api.models import TownBirthDates
+from imports.api.operations import (create_dataset, create_dataset_from_stream, delete_dataset,
+                                    update_citizen, update_citizens,
+                                    get_age_percentiles_per_town,
+                                    get_age_percentiles_per_town_histogram, )
+from imports.utils import grouped_percentiles, grouped_weighted_percentiles
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def histogram(settings):
+    settings.IMPORTS_BIRTH_DATE_HISTOGRAM = True
+
+
+@pytest.fixture()
+def citizens_data(create_citizens_data):
+    rnd = random.Random(20190908)
+    base = create_citizens_data[0]
+    today = date.today()
+    return [
+        {
+            **base,
+            'citizen_id': citizen_id,
+            'town': rnd.choice(['Москва', 'Керчь', 'Abakan', 'Я']),
+            # few distinct dates, so that rows of the histogram count several citizens
+            'birth_date': today - timedelta(days=rnd.choice([0, 1, 365, 366, 9000, 30000])),
+            'relatives': [],
+        }
+        for citizen_id in range(1, 200)
+    ]
+
+
+@pytest.fixture()
+def data_set_id(citizens_data):
+    return create_dataset([dict(c) for c in citizens_data])
+
+
+def histogram_of(data_set_id):
+    return set(TownBirthDates.objects.filter(data_set_id=data_set_id)
+               .values_list('town__name', 'birth_year', 'birth_month_day', 'citizens'))
+
+
+def test_grouped_weighted_percentiles():
+    rnd = random.Random(20190908)
+    groups = [rnd.randint(0, 3) for _ in range(500)]
+    values = [rnd.randint(0, 120) for _ in range(500)]
+    counts = {}
+    for key in zip(groups, values):
+        counts[key] = counts.get(key, 0) + 1
+
+    (weighted_groups, weighted_values), weights = zip(*counts.keys()), list(counts.values())
+    expected_groups, expected = grouped_percentiles(groups, values, [0, 50, 75, 99, 100])
+    result_groups, result = grouped_weighted_percentiles(weighted_groups, weighted_values, weights,
+                                                         [0, 50, 75, 99, 100])
+    assert result_groups.tolist() == expected_groups.tolist()
+    assert result.tolist() == expected.tolist()
+
+
+def test_fill(data_set_id, citizens_data):
+    stream_data_set_id = create_dataset_from_stream(iter([dict(c) for c in citizens_data]),
+                                                    batch_size=7)
+    assert histogram_of(stream_data_set_id) == histogram_of(data_set_id)
+    assert sum(citizens for *_, citizens in histogram_of(data_set_id)) == len(citizens_data)
+    assert len(histogram_of(data_set_id)) < len(citizens_data)
+
+
+def test_same_as_python(data_set_id):
+    assert (get_age_percentiles_per_town_histogram(data_set_id) ==
+            get_age_percentiles_per_town(data_set_id))
+
+
+def test_empty_data_set():
+    assert get_age_percentiles_per_town_histogram(create_dataset([])) == []
+
+
+def test_update_citizen(data_set_id):
+    update_citizen(data_set_id, 1, {'town': 'Новый', 'birth_date': date(2000, 2, 29)})
+    update_citizen(data_set_id, 2, {'name': 'Петя'})
+    update_citizen(data_set_id, 3, {'birth_date': date(1950, 1, 1)})
+
+    expected = histogram_of(data_set_id)
+    call_command('build_histograms', data_set_id, stdout=io.StringIO())
+    assert histogram_of(data_set_id) == expected
+    assert ('Новый', 2000, 229, 1) in expected
+    assert (get_age_percentiles_per_town_histogram(data_set_id) ==
+            get_age_percentiles_per_town(data_set_id))
+
+
+def test_update_citizens(data_set_id, citizens_data):
+    update_citizens(data_set_id, [{'citizen_id': 1, 'town': 'Керчь'},
+                                  {'citizen_id': 2, 'birth_date': date(1990, 1, 1)},
+                                  {'citizen_id': 1, 'town': 'Я'},
+                                  {'citizen_id': 3, 'town': citizens_data[2]['town']}])
+
+    expected = histogram_of(data_set_id)
+    call_command('build_histograms', stdout=io.StringIO())
+    assert histogram_of(data_set_id) == expected
+
+
+def test_emptied_rows_deleted(data_set_id):
+    update_citizen(data_set_id, 1, {'birth_date': date(1900, 1, 1)})
+    update_citizen(data_set_id, 1, {'birth_date': date(1900, 1, 2)})
+    assert not TownBirthDates.objects.filter(data_set_id=data_set_id, birth_year=1900,
+                                             birth_month_day=101).exists()
+
+
+def test_delete(data_set_id):
+    delete_dataset(data_set_id)
+    assert not TownBirthDates.objects.filter(data_set_id=data_set_id).exists()
@@ -0,0 +1,204 @@
+import io
+import json
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.urls import reverse
+from hamcrest import assert_that, contains_inanyorder, has_entries
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+
+from imports.api import validators
+from imports.api.jobs import process_import_jobs, requeue_abandoned_import_jobs, spool_import
+from imports.api.models import Citizen, DataSet, ImportJob
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def spool_path(settings, tmp_path):
+    settings.IMPORTS_ASYNC_IMPORT = True
+    settings.IMPORTS_JOB_SPOOL_PATH = str(tmp_path)
+    return tmp_path
+
+
+def post_import(api_client, data):
+    response = api_client.post(reverse('create_dataset'), data=data, format='json')
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert response['Location'] == f'/imports/jobs/{response.data["data"]["job_id"]}'
+    return response.data['data']['job_id']
+
+
+def get_job(api_client, job_id):
+    response = api_client.get(reverse('get_import_job', kwargs={'job_id': job_id}))
+    assert response.status_code == status.HTTP_200_OK
+    return response.data['data']
+
+
+def test_url():
+    assert reverse('get_import_job', kwargs={'job_id': 1}) == '/imports/jobs/1'
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_import(api_client, citizens, settings, spool_path, streaming):
+    settings.IMPORTS_STREAMING_IMPORT = streaming
+    job_id = post_import(api_client, {'citizens': citizens})
+    assert len(list(spool_path.iterdir())) == 1
+    queued = get_job(api_client, job_id)
+    assert_that(queued, has_entries({
+        'job_id': job_id, 'status': 'queued', 'import_id': None, 'errors': None}))
+    assert not Citizen.objects.exists()
+
+    assert process_import_jobs() == 1
+
+    job = get_job(api_client, job_id)
+    assert_that(job, has_entries({'status': 'done', 'errors': None}))
+    assert job['updated_at'] > queued['updated_at']
+    assert_that(Citizen.objects.filter(data_set_id=job['import_id']).values_list(
+            'citizen_id', flat=True), contains_inanyorder(1, 2, 3))
+    assert not list(spool_path.iterdir())
+    assert process_import_jobs() == 0
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_errors_same_as_response(api_client, citizens, settings, spool_path, streaming):
+    settings.IMPORTS_STREAMING_IMPORT = streaming
+    citizens[0]['relatives'] = []
+    citizens[1]['birth_date'] = '31.02.1990'
+
+    settings.IMPORTS_ASYNC_IMPORT = False
+    response = api_client.post(reverse('create_dataset'), data={'citizens': citizens},
+                               format='json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    settings.IMPORTS_ASYNC_IMPORT = True
+    job_id = post_import(api_client, {'citizens': citizens})
+    process_import_jobs()
+
+    assert_that(get_job(api_client, job_id), has_entries({
+        'job_id': job_id, 'status': 'failed', 'import_id': None, 'errors': response.json()}))
+    assert not Citizen.objects.exists()
+    assert not list(spool_path.iterdir())
+
+
+def test_parse_error(api_client):
+    response = api_client.post(reverse('create_dataset'), data='{"citizens": [',
+                               content_type='application/json')
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    process_import_jobs()
+
+    job = get_job(api_client, response.data['data']['job_id'])
+    assert job['status'] == 'failed'
+    assert job['errors']['detail'].startswith('JSON parse error')
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_empty_body_rejected(api_client, settings, spool_path, streaming):
+    settings.IMPORTS_STREAMING_IMPORT = streaming
+    settings.IMPORTS_ASYNC_IMPORT = False
+    expected = api_client.post(reverse('create_dataset'), data='',
+                               content_type='application/json')
+    assert expected.status_code == status.HTTP_400_BAD_REQUEST
+
+    settings.IMPORTS_ASYNC_IMPORT = True
+    response = api_client.post(reverse('create_dataset'), data='',
+                               content_type='application/json')
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json() == expected.json()
+    assert not ImportJob.objects.exists()
+    assert not list(spool_path.iterdir())
+
+
+def test_truncated_body_rejected(citizens, spool_path):
+    body = json.dumps({'citizens': citizens}).encode()
+    with pytest.raises(ParseError):
+        spool_import(io.BytesIO(body[:-10]), content_length=len(body))
+    assert not ImportJob.objects.exists()
+    assert not list(spool_path.iterdir())
+
+
+def test_server_error(api_client, citizens, mocker):
+    mocker.patch('imports.api.jobs.create_dataset', side_effect=RuntimeError)
+    job_id = post_import(api_client, {'citizens': citizens})
+    process_import_jobs()
+
+    assert_that(get_job(api_client, job_id), has_entries({
+        'status': 'failed', 'errors': {'detail': 'A server error occurred.'}}))
+
+
+def test_parallel_validation_in_jobs_only(api_client, citizens, settings, mocker):
+    settings.IMPORTS_VALIDATION_WORKERS = 2
+    settings.IMPORTS_VALIDATION_CHUNK_SIZE = 1
+    parallel = mocker.spy(validators, 'validate_citizens_parallel')
+
+    settings.IMPORTS_ASYNC_IMPORT = False
+    response = api_client.post(reverse('create_dataset'), data={'citizens': citizens},
+                               format='json')
+    assert response.status_code == status.HTTP_201_CREATED
+    assert not parallel.called
+
+    settings.IMPORTS_ASYNC_IMPORT = True
+    job_id = post_import(api_client, {'citizens': citizens})
+    process_import_jobs()
+    assert parallel.call_count == 1
+    assert get_job(api_client, job_id)['status'] == 'done'
+
+
+def test_jobs_run_in_order(api_client, citizens):
+    job_ids = [post_import(api_client, {'citizens': citizens}) for _ in range(3)]
+    assert process_import_jobs() == 3
+    import_ids = [ImportJob.objects.get(id=job_id).import_id for job_id in job_ids]
+    assert import_ids == sorted(import_ids)
+
+
+def test_abandoned_jobs_requeued(api_client, citizens):
+    job_ids = [post_import(api_client, {'citizens': citizens}) for _ in range(2)]
+    # claimed by workers which died, and by one still running
+    ImportJob.objects.filter(id__in=job_ids).update(status=ImportJob.STATUS_IMPORTING)
+    running = connection.copy()
+    try:
+        with running.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s::regclass::oid::integer, %s)',
+                           [ImportJob._meta.db_table, job_ids[1]])
+        assert requeue_abandoned_import_jobs() == [job_ids[0]]
+    finally:
+        running.close()
+
+    assert process_import_jobs() == 2
+    assert_that(get_job(api_client, job_ids[0]), has_entries({'status': 'done', 'errors': None}))
+    assert get_job(api_client, job_ids[1])['status'] == 'done'
+
+
+def test_deleted_data_sets_purged(api_client, citizens, settings):
+    settings.IMPORTS_DELETE_ASYNC_MIN_CITIZENS = 1
+    job_id = post_import(api_client, {'citizens': citizens})
+    process_import_jobs()
+    data_set_id = ImportJob.objects.get(id=job_id).import_id
+    response = api_client.delete(reverse('delete_dataset', kwargs={'data_set_id': data_set_id}))
+    assert response.status_code == status.HTTP_202_ACCEPTED
+    assert Citizen.objects.filter(data_set_id=data_set_id).exists()
+
+    assert process_import_jobs() == 0
+
+    assert not Citizen.objects.filter(data_set_id=data_set_id).exists()
+    assert not DataSet.all_objects.filter(id=data_set_id).exists()
+
+
+def test_not_found(api_client):
+    response = api_client.get(reverse('get_import_job', kwargs={'job_id': 0}))
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_import_jobs(api_client, citizens, spool_path):
+    job_ids = [post_import(api_client, {'citizens': citizens}) for _ in range(4)]
+
+    out = io.StringIO()
+    call_command('run_import_jobs', '--workers', '2', stdout=out)
+
+    assert out.getvalue() == '4 import jobs are run\n'
+    jobs = ImportJob.objects.filter(id__in=job_ids)
+    assert [job.status for job in jobs] == ['done'] * 4
+    assert len({job.import_id for job in jobs}) == 4
+    assert not list(spool_path.iterdir())
@@ -0,0 +1,58 @@
+from datetime import date
+
+import pytest
+from hamcrest import assert_that, contains_inanyorder, has_entries
+
+from imports.api.loaders import (CopyDataSetLoader, OrmDataSetLoader, copy_value,
+                                 get_data_set_loader, )
+from imports.api.models import Citizen, CitizenRelative, DataSet
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.mark.parametrize(['value', 'result'], [
+    [None, '\\N'],
+    [1, '1'],
+    [date(year=1990, month=1, day=2), '1990-01-02'],
+    ['Москва', 'Москва'],
+    ['a\tb\nc\rd\\e', 'a\\tb\\nc\\rd\\\\e'],
+])
+def test_copy_value(value, result):
+    assert copy_value(value) == result
+
+
+@pytest.mark.parametrize(['name', 'vendor', 'loader_class'], [
+    ['auto', 'postgresql', CopyDataSetLoader],
+    ['auto', 'sqlite', OrmDataSetLoader],
+    ['orm', 'postgresql', OrmDataSetLoader],
+    ['copy', 'postgresql', CopyDataSetLoader],
+])
+def test_get_data_set_loader(settings, mocker, name, vendor, loader_class):
+    settings.IMPORTS_DATA_SET_LOADER = name
+    mocker.patch('imports.api.loaders.connection.vendor', vendor)
+    assert type(get_data_set_loader(1)) is loader_class
+
+
+@pytest.mark.parametrize('loader_class', [OrmDataSetLoader, CopyDataSetLoader])
+def test_load(loader_class, create_citizens_data):
+    data_set = DataSet.objects.create()
+    rows = [{k: v for k, v in c.items() if k != 'relatives'} for c in create_citizens_data]
+    rows[0]['name'] = 'Tab\tNew\nline \\ back'
+
+    loader = loader_class(data_set.id)
+    ids = loader.load_citizens(rows)
+    loader.load_relatives([(ids[101], ids[102]), (ids[102], ids[101])])
+
+    assert_that(ids, has_entries({
+        row['citizen_id']: Citizen.objects.get(data_set=data_set, citizen_id=row['citizen_id']).id
+        for row in rows
+    }))
+    citizens = Citizen.objects.filter(data_set=data_set).select_related('town', 'street')
+    assert_that([{field: getattr(c, field) for field in rows[0]} for c in citizens],
+                contains_inanyorder(*rows))
+    assert_that(list(CitizenRelative.objects.values_list('citizen_id', 'relative_id')),
+                contains_inanyorder((ids[101], ids[102]), (ids[102], ids[101])))
+
+
+def test_copy_load_no_citizens():
+    assert CopyDataSetLoader(DataSet.objects.create().id).load_citizens([]) == {}
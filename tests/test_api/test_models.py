@@ -1,7 +1,11 @@
+import json
+import pickle
+
 import pytest
+from django.db import connection
 from hamcrest import assert_that, contains_inanyorder
 
-from imports.api.models import CitizenRelative
+from imports.api.models import Citizen, CitizenRelative, DataSet, Town
 
 pytestmark = pytest.mark.django_db
 
@@ -26,3 +30,66 @@ def test_birthdays_manager_method(data_set):
     assert_that(data, contains_inanyorder(
             *expected_data,
     ))
+
+
+def test_intern():
+    moscow = Town.objects.create(name='Москва')
+    towns = Town.objects.intern(['Москва', 'Керчь', 'Керчь'])
+
+    assert towns['Москва'] == moscow
+    assert towns['Керчь'].pk is not None
+    assert Town.objects.intern(['Керчь']) == {'Керчь': towns['Керчь']}
+    assert Town.objects.count() == 2
+
+
+def test_intern_in_sorted_order():
+    names = [f'Город {i}' for i in range(50)]
+    towns = Town.objects.intern(reversed(names))
+    assert sorted(names, key=lambda name: towns[name].id) == sorted(names)
+
+
+def test_names_interned_before_import(create_citizens_data):
+    from imports.api.operations import create_dataset
+    citizens = [{**c, 'town': 'Керчь', 'relatives': [0]} for c in create_citizens_data]
+
+    with pytest.raises(KeyError):
+        create_dataset(citizens)
+
+    assert not DataSet.objects.exists()
+    assert Town.objects.filter(name='Керчь').exists()
+
+
+def test_interned_town(data_set):
+    citizen = Citizen.objects.get(data_set=data_set, citizen_id=101)
+    citizen.town = Town.objects.intern(['Керчь'])['Керчь']
+    citizen.save()
+    citizen.refresh_from_db()
+
+    assert citizen.town == 'Керчь'
+    assert citizen.town_id == Town.objects.get(name='Керчь').id
+    assert json.dumps(citizen.town) == json.dumps('Керчь')
+    assert pickle.loads(pickle.dumps(citizen.town)) == 'Керчь'
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT town_id FROM api_citizen WHERE id = %s', [citizen.id])
+        assert cursor.fetchone() == (citizen.town_id,)
+
+
+def test_names_not_interned_on_assignment(data_set):
+    citizen = Citizen.objects.get(data_set=data_set, citizen_id=101)
+    with pytest.raises(ValueError):
+        citizen.town = 'Керчь'
+    assert not Town.objects.filter(name='Керчь').exists()
+
+    town = Town.objects.intern(['Керчь'])['Керчь']
+    citizen.town = town.id
+    assert citizen.town == 'Керчь'
+    other = Citizen.objects.get(data_set=data_set, citizen_id=102)
+    other.town = citizen.town
+    assert other.town_id == town.id
+
+
+def test_citizens_share_interned_names(data_set):
+    citizens = Citizen.objects.filter(data_set=data_set)
+    assert len({c.town for c in citizens}) == len({c.town_id for c in citizens})
+    assert Town.objects.count() == len({c.town for c in citizens})
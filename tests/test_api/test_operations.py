@@ -1,21 +1,34 @@
-from datetime import date
+import random
+from datetime import date, timedelta
 from pprint import pprint
 
 import pytest
+from django.db import OperationalError, connection
 from django.db.models import F
 from hamcrest import assert_that, has_entries, contains, empty, contains_inanyorder, has_properties
 
-from imports.api.models import DataSet, Citizen, CitizenRelative
-from imports.api.operations import (create_dataset, update_citizen, get_birthday_stats,
-                                    get_birthday_stats2, )
-from imports.api.serializers import CitizenSerializer
+from imports.api.models import (DataSet, Citizen, CitizenPair, CitizenRelative, GenderField,
+                                Town, )
+from imports.api.operations import (create_dataset, create_dataset_from_stream, delete_dataset,
+                                    purge_deleted_data_sets, update_citizen,
+                                    update_citizens, retry_on_conflict, RevisionConflict,
+                                    ConcurrentUpdate,
+                                    list_citizens, iter_citizens, get_birthday_stats,
+                                    get_birthday_stats2, get_birthday_stats_sql,
+                                    get_age_percentiles_per_town,
+                                    get_age_percentiles_per_town_numpy,
+                                    get_age_percentiles_per_town_db,
+                                    get_age_percentiles_per_town_snapshot,
+                                    get_birthday_stats_snapshot, )
+from imports.api.serializers import CitizenSerializer, citizen_row_representation
 
 pytestmark = pytest.mark.django_db
 
 
 class TestCreateDataSetOperation:
-    @pytest.fixture
-    def created_data_set_id(self, create_citizens_data):
+    @pytest.fixture(params=['orm', 'copy'])
+    def created_data_set_id(self, request, settings, create_citizens_data):
+        settings.IMPORTS_DATA_SET_LOADER = request.param
         return create_dataset(citizens=create_citizens_data)
 
     @pytest.fixture()
@@ -52,6 +65,102 @@ class TestCreateDataSetOperation:
             )
         }))
 
+    def test_gender_stored_as_code(self, created_data_set_id, create_citizens_data):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT citizen_id, gender FROM api_citizen ORDER BY citizen_id')
+            rows = cursor.fetchall()
+
+        assert rows == [(c['citizen_id'], GenderField.CODES[c['gender']])
+                        for c in sorted(create_citizens_data, key=lambda c: c['citizen_id'])]
+        assert [c.gender for c in Citizen.objects.order_by('citizen_id')] == [
+            c['gender'] for c in sorted(create_citizens_data, key=lambda c: c['citizen_id'])]
+
+    @pytest.mark.parametrize('loader', ['orm', 'copy'])
+    @pytest.mark.parametrize('timestamps', [True, False])
+    def test_timestamps(self, settings, create_citizens_data, loader, timestamps):
+        settings.IMPORTS_DATA_SET_LOADER = loader
+        settings.IMPORTS_CITIZEN_TIMESTAMPS = timestamps
+        create_dataset(citizens=create_citizens_data)
+
+        for created_at, updated_at in Citizen.objects.values_list('created_at', 'updated_at'):
+            assert (created_at is not None) is timestamps
+            assert updated_at == created_at
+
+
+class TestCreateDataSetFromStreamOperation:
+    def test_batches(self, create_citizens_data):
+        expected = [{**c, 'relatives': sorted(c['relatives'])} for c in create_citizens_data]
+
+        data_set_id = create_dataset_from_stream(citizens=iter(create_citizens_data),
+                                                 batch_size=2)
+
+        citizens = Citizen.objects.filter(data_set_id=data_set_id).order_by('citizen_id')
+        created = [
+            {**{field: getattr(c, field) for field in expected[0] if field != 'relatives'},
+             'relatives': sorted(c.relatives_ids)}
+            for c in citizens
+        ]
+        assert created == expected
+
+    def test_rollback_on_error(self, create_citizens_data):
+        def citizens():
+            yield from create_citizens_data
+            raise ValueError()
+
+        with pytest.raises(ValueError):
+            create_dataset_from_stream(citizens=citizens(), batch_size=1)
+
+        assert not Citizen.objects.exists()
+        assert not DataSet.objects.exists()
+
+
+class TestDeleteDataSetOperation:
+    @pytest.fixture()
+    def data_set_ids(self, create_citizens_data):
+        return [create_dataset([{**c, 'relatives': list(c['relatives'])}
+                                for c in create_citizens_data]) for _ in range(2)]
+
+    def test_delete(self, data_set_ids):
+        deleted, kept = data_set_ids
+        relations = CitizenRelative.objects.filter(data_set_id=kept).count()
+
+        assert delete_dataset(deleted)
+        assert not DataSet.all_objects.filter(id=deleted).exists()
+        assert not Citizen.objects.filter(data_set_id=deleted).exists()
+        assert not CitizenRelative.objects.filter(data_set_id=deleted).exists()
+        assert Citizen.objects.filter(data_set_id=kept).count() == 3
+        assert CitizenRelative.objects.filter(data_set_id=kept).count() == relations
+
+    def test_delete_not_existing(self):
+        with pytest.raises(DataSet.DoesNotExist):
+            delete_dataset(0)
+
+    def test_delete_large_later(self, data_set_ids, settings):
+        deleted, kept = data_set_ids
+        settings.IMPORTS_DELETE_ASYNC_MIN_CITIZENS = 3
+
+        assert not delete_dataset(deleted)
+        assert not DataSet.objects.filter(id=deleted).exists()
+        assert Citizen.objects.filter(data_set_id=deleted).exists()
+        with pytest.raises(DataSet.DoesNotExist):
+            update_citizen(deleted, 1, {'name': 'Петя'})
+        with pytest.raises(DataSet.DoesNotExist):
+            delete_dataset(deleted)
+
+        assert purge_deleted_data_sets() == [deleted]
+        assert not DataSet.all_objects.filter(id=deleted).exists()
+        assert not Citizen.objects.filter(data_set_id=deleted).exists()
+        assert DataSet.objects.filter(id=kept).exists()
+
+    def test_delete_pairs(self, create_citizens_data, settings):
+        settings.IMPORTS_RELATIVES_STORAGE = 'pairs'
+        data_set_id = create_dataset([{**c, 'relatives': list(c['relatives'])}
+                                      for c in create_citizens_data])
+
+        assert delete_dataset(data_set_id)
+        assert not CitizenPair.objects.exists()
+        assert not Citizen.objects.exists()
+
 
 class TestUpdateCitizenOperation:
     @pytest.fixture()
@@ -67,13 +176,48 @@ class TestUpdateCitizenOperation:
             'apartment': 100,
             'name': 'Дима',
             'birth_date': date(year=1986, month=6, day=14),
-            'gender': 'make',
+            'gender': 'female',
         }
         updated = update_citizen(data_set_id=citizen1.data_set_id,
                                  citizen_id=citizen1.citizen_id,
                                  citizen_data=data)
         assert_that(updated, has_properties(data))
 
+    @pytest.mark.parametrize('timestamps', [True, False])
+    def test_update_timestamp(self, settings, citizen1, timestamps):
+        settings.IMPORTS_CITIZEN_TIMESTAMPS = timestamps
+        Citizen.objects.filter(id=citizen1.id).update(updated_at=None)
+        update_citizen(data_set_id=citizen1.data_set_id,
+                       citizen_id=citizen1.citizen_id,
+                       citizen_data={'name': 'Дима'})
+        update_citizens(citizen1.data_set_id,
+                        [{'citizen_id': citizen1.citizen_id, 'name': 'Петя'}])
+        citizen1.refresh_from_db()
+        assert (citizen1.updated_at is not None) is timestamps
+
+    def test_update_interns_town(self, citizens):
+        citizen1, citizen2, _ = citizens
+        update_citizen(data_set_id=citizen1.data_set_id,
+                       citizen_id=citizen1.citizen_id,
+                       citizen_data={'town': 'Керчь'})
+        update_citizens(citizen1.data_set_id, [{'citizen_id': citizen2.citizen_id,
+                                                'town': 'Керчь', 'street': 'Новая'}])
+        citizen1.refresh_from_db()
+        citizen2.refresh_from_db()
+
+        assert citizen1.town == citizen2.town == 'Керчь'
+        assert citizen1.town_id == citizen2.town_id == Town.objects.get(name='Керчь').id
+        assert [row[1:3] for row in list_citizens(citizen1.data_set_id)][:2] == [
+            ('Керчь', citizen1.street), ('Керчь', 'Новая')]
+
+    def test_update_bumps_revision(self, citizen1):
+        revision = citizen1.data_set.revision
+        update_citizen(data_set_id=citizen1.data_set_id,
+                       citizen_id=citizen1.citizen_id,
+                       citizen_data={'name': 'Дима'})
+        citizen1.data_set.refresh_from_db()
+        assert citizen1.data_set.revision == revision + 1
+
     def test_update_relatives(self, citizens):
         citizen1, citizen2, citizen3 = citizens
 
@@ -95,10 +239,321 @@ class TestUpdateCitizenOperation:
             'citizen3': has_properties({'relatives_ids': contains_inanyorder(citizen1.citizen_id)}),
         }))
 
+    def test_update_relatives_diff(self, citizens):
+        citizen1, citizen2, citizen3 = citizens
+        update_citizen(data_set_id=citizen1.data_set_id,
+                       citizen_id=citizen1.citizen_id,
+                       citizen_data={'relatives': [citizen2.citizen_id]})
+        kept = set(CitizenRelative.objects.values_list('id', flat=True))
+
+        update_citizen(data_set_id=citizen1.data_set_id,
+                       citizen_id=citizen1.citizen_id,
+                       citizen_data={'relatives': [citizen2.citizen_id, citizen3.citizen_id]})
+        assert kept < set(CitizenRelative.objects.values_list('id', flat=True))
+
+        update_citizen(data_set_id=citizen1.data_set_id,
+                       citizen_id=citizen1.citizen_id,
+                       citizen_data={'relatives': [citizen3.citizen_id]})
+        assert_that(CitizenRelative.objects.values_list('citizen_id', 'relative_id'),
+                    contains_inanyorder((citizen1.id, citizen3.id), (citizen3.id, citizen1.id)))
+
+    def test_update_relatives_queries(self, citizens, django_assert_num_queries):
+        citizen1, citizen2, citizen3 = citizens
+        update_citizen(data_set_id=citizen1.data_set_id,
+                       citizen_id=citizen1.citizen_id,
+                       citizen_data={'relatives': [citizen2.citizen_id]})
+
+        # savepoint, select data set and citizen, read edges, resolve relatives,
+        # delete, insert, bump revision and release savepoint
+        with django_assert_num_queries(9):
+            updated = update_citizen(data_set_id=citizen1.data_set_id,
+                                     citizen_id=citizen1.citizen_id,
+                                     citizen_data={'relatives': [citizen3.citizen_id]})
+            assert updated.relatives_ids == [citizen3.citizen_id]
+
+    def test_update_known_relatives_ids(self, citizens):
+        citizen1, citizen2, citizen3 = citizens
+        update_citizen(data_set_id=citizen1.data_set_id,
+                       citizen_id=citizen1.citizen_id,
+                       citizen_data={'relatives': [citizen3.citizen_id, citizen2.citizen_id]})
+
+        updated = update_citizen(data_set_id=citizen1.data_set_id,
+                                 citizen_id=citizen1.citizen_id,
+                                 citizen_data={'name': 'Дима'})
+        assert updated.relatives_ids == [citizen3.citizen_id, citizen2.citizen_id]
+
+        updated = update_citizen(data_set_id=citizen1.data_set_id,
+                                 citizen_id=citizen1.citizen_id,
+                                 citizen_data={
+                                     'relatives': [citizen2.citizen_id, citizen3.citizen_id]
+                                 })
+        assert updated.relatives_ids == [citizen3.citizen_id, citizen2.citizen_id]
+        assert list_citizens(citizen1.data_set_id)[0][-1] == updated.relatives_ids
+
+    @pytest.mark.parametrize('revision', [None, 1])
+    def test_update_deleted_meanwhile(self, citizen1, mocker, revision):
+        from imports.api.operations import bump_revision
+
+        def delete_and_bump(data_set_id, revision=None):
+            DataSet.objects.filter(id=data_set_id).update(deleted=True)
+            bump_revision(data_set_id, revision)
+
+        mocker.patch('imports.api.operations.bump_revision', side_effect=delete_and_bump)
+        with pytest.raises(DataSet.DoesNotExist):
+            update_citizen(data_set_id=citizen1.data_set_id,
+                           citizen_id=citizen1.citizen_id,
+                           citizen_data={'name': 'Дима'},
+                           revision=revision)
+
+    def test_update_revision(self, citizen1):
+        with pytest.raises(RevisionConflict):
+            update_citizen(data_set_id=citizen1.data_set_id,
+                           citizen_id=citizen1.citizen_id,
+                           citizen_data={'name': 'Дима'},
+                           revision=citizen1.data_set.revision + 1)
+        citizen1.refresh_from_db()
+        assert citizen1.name != 'Дима'
+
+        update_citizen(data_set_id=citizen1.data_set_id,
+                       citizen_id=citizen1.citizen_id,
+                       citizen_data={'name': 'Дима'},
+                       revision=citizen1.data_set.revision)
+        citizen1.refresh_from_db()
+        assert citizen1.name == 'Дима'
+
+    def test_update_locked(self, citizens):
+        citizen1, citizen2, citizen3 = citizens
+        update_citizen(data_set_id=citizen1.data_set_id,
+                       citizen_id=citizen1.citizen_id,
+                       citizen_data={'relatives': [citizen2.citizen_id]})
+        citizen1.name = 'Петя'
+        citizen1.save()
+
+        updated = update_citizen(data_set_id=citizen1.data_set_id,
+                                 citizen_id=citizen1.citizen_id,
+                                 citizen_data={'relatives': [citizen3.citizen_id]},
+                                 lock=True)
+        assert_that(updated, has_properties({
+            'name': 'Петя',
+            'relatives_ids': [citizen3.citizen_id],
+        }))
+        assert citizen2.relatives_ids == []
+
+    def test_update_non_existing_relative(self, citizens):
+        citizen1, citizen2, citizen3 = citizens
+        edges = list(CitizenRelative.objects.values_list('citizen_id', 'relative_id'))
+
+        with pytest.raises(Citizen.DoesNotExist):
+            update_citizen(data_set_id=citizen1.data_set_id,
+                           citizen_id=citizen1.citizen_id,
+                           citizen_data={'relatives': [citizen2.citizen_id, 100500]})
+        assert_that(CitizenRelative.objects.values_list('citizen_id', 'relative_id'),
+                    contains_inanyorder(*edges))
+
+
+class TestUpdateCitizensOperation:
+    @pytest.fixture()
+    def citizens_data(self, create_citizens_data):
+        rnd = random.Random(20190901)
+        base = create_citizens_data[0]
+        data = [{**base, 'citizen_id': cid, 'relatives': []} for cid in range(1, 11)]
+        for _ in range(12):
+            a, b = rnd.sample(data, 2)
+            if b['citizen_id'] not in a['relatives']:
+                a['relatives'].append(b['citizen_id'])
+                b['relatives'].append(a['citizen_id'])
+        return data
+
+    def create_data_set(self, citizens_data):
+        return create_dataset([{**c, 'relatives': list(c['relatives'])} for c in citizens_data])
+
+    def listing(self, data_set_id):
+        return [row[:-1] + (sorted(row[-1]),) for row in list_citizens(data_set_id)]
+
+    @pytest.mark.parametrize('vendor', ['postgresql', 'sqlite'])
+    @pytest.mark.parametrize('lock', [False, True])
+    def test_same_as_update_citizen(self, citizens_data, mocker, vendor, lock):
+        mocker.patch('imports.api.operations.connection.vendor', vendor)
+        rnd = random.Random(20190902)
+        for _ in range(20):
+            batch = []
+            for cid in rnd.sample(range(1, 11), rnd.randint(1, 6)):
+                data = {'citizen_id': cid}
+                if rnd.random() < 0.5:
+                    data['name'] = f'Имя {rnd.randint(1, 100)}'
+                if rnd.random() < 0.3:
+                    data['birth_date'] = date(year=1990, month=rnd.randint(1, 12), day=1)
+                if rnd.random() < 0.7 or len(data) == 1:
+                    data['relatives'] = rnd.sample([r for r in range(1, 11) if r != cid],
+                                                   rnd.randint(0, 4))
+                batch.append(data)
+
+            expected_id = self.create_data_set(citizens_data)
+            for data in batch:
+                data = dict(data)
+                update_citizen(data_set_id=expected_id, citizen_id=data.pop('citizen_id'),
+                               citizen_data=data, lock=lock)
+
+            data_set_id = self.create_data_set(citizens_data)
+            updated = update_citizens(data_set_id, [dict(data) for data in batch], lock=lock)
+
+            listing = self.listing(data_set_id)
+            assert listing == self.listing(expected_id), batch
+            assert [(c.citizen_id, c.name, c.birth_date, sorted(c.relatives_ids))
+                    for c in updated] == \
+                   [(row[0], row[5], row[6], row[-1])
+                    for data in batch for row in listing if row[0] == data['citizen_id']]
+
+    @pytest.mark.parametrize('storage', ['rows', 'pairs'])
+    def test_same_relatives_order_as_update_citizen(self, citizens_data, settings, storage):
+        settings.IMPORTS_RELATIVES_STORAGE = storage
+        rnd = random.Random(20191018)
+        for _ in range(20):
+            batch = [{'citizen_id': cid,
+                      'relatives': rnd.sample([r for r in range(1, 11) if r != cid],
+                                              rnd.randint(0, 4))}
+                     for cid in rnd.choices(range(1, 11), k=rnd.randint(1, 6))]
+
+            expected_id = self.create_data_set(citizens_data)
+            expected = {}
+            for data in batch:
+                citizen = update_citizen(expected_id, data['citizen_id'],
+                                         {'relatives': data['relatives']})
+                expected[citizen.citizen_id] = citizen.relatives_ids
+
+            data_set_id = self.create_data_set(citizens_data)
+            updated = update_citizens(data_set_id, batch)
+
+            listing = list_citizens(data_set_id)
+            assert [row[-1] for row in listing] == \
+                   [row[-1] for row in list_citizens(expected_id)], batch
+            assert {c.citizen_id: c.relatives_ids for c in updated} == \
+                   {row[0]: row[-1] for row in listing if row[0] in expected}
+
+    def test_relisted_edge_keeps_its_place(self, citizens_data):
+        data_set_id = self.create_data_set(citizens_data)
+        update_citizens(data_set_id, [{'citizen_id': 1, 'relatives': [2, 3]}])
+        update_citizens(data_set_id, [{'citizen_id': 4, 'relatives': [1]},
+                                      {'citizen_id': 2, 'relatives': [1]}])
+        rows = {row[0]: row[-1] for row in list_citizens(data_set_id)}
+        assert rows[1] == [2, 3, 4]
+
+    def test_relatives_ids_order(self, citizens_data):
+        data_set_id = self.create_data_set(citizens_data)
+        update_citizens(data_set_id, [{'citizen_id': 1, 'relatives': [2]}])
+        updated = update_citizens(data_set_id, [{'citizen_id': 1, 'relatives': [3, 2, 4]},
+                                                {'citizen_id': 5, 'name': 'Петя'}])
+        rows = {row[0]: row[-1] for row in list_citizens(data_set_id)}
+        assert updated[0].relatives_ids == rows[1] == [2, 3, 4]
+        assert updated[1].relatives_ids == rows[5]
+
+    def test_non_existing(self, citizens_data):
+        data_set_id = self.create_data_set(citizens_data)
+        listing = self.listing(data_set_id)
+        for batch in [
+            [{'citizen_id': 1, 'name': 'Петя'}, {'citizen_id': 100, 'name': 'Петя'}],
+            [{'citizen_id': 1, 'name': 'Петя', 'relatives': [2, 100]}],
+        ]:
+            with pytest.raises(Citizen.DoesNotExist):
+                update_citizens(data_set_id, batch)
+            assert self.listing(data_set_id) == listing
+
+    def test_revision(self, citizens_data):
+        data_set_id = self.create_data_set(citizens_data)
+        listing = self.listing(data_set_id)
+        with pytest.raises(RevisionConflict):
+            update_citizens(data_set_id, [{'citizen_id': 1, 'relatives': []}], revision=2)
+        assert self.listing(data_set_id) == listing
+
+        update_citizens(data_set_id, [{'citizen_id': 1, 'relatives': []}], revision=1)
+        assert DataSet.objects.get(id=data_set_id).revision == 2
+
+    def test_queries(self, citizens_data, django_assert_num_queries):
+        data_set_id = self.create_data_set(citizens_data)
+        batch = [{'citizen_id': cid, 'name': 'Петя', 'relatives': [cid % 10 + 1]}
+                 for cid in range(1, 11)]
+        # savepoint, select data set, citizens and edges, update, delete, insert,
+        # bump revision and release savepoint
+        with django_assert_num_queries(9):
+            update_citizens(data_set_id, batch)
+
+
+class TestRetryOnConflict:
+    @pytest.fixture(autouse=True)
+    def connection(self, mocker):
+        """Retries are disabled inside of the test transaction."""
+        return mocker.patch('imports.api.operations.connection', in_atomic_block=False)
+
+    def serialization_failure(self):
+        exc = OperationalError('could not serialize access')
+        exc.__cause__ = Exception()
+        exc.__cause__.pgcode = '40001'
+        return exc
+
+    def test_retried(self, mocker):
+        sleep = mocker.patch('imports.api.operations.time.sleep')
+        func = mocker.Mock(side_effect=[self.serialization_failure(), ConcurrentUpdate(), 1],
+                           __name__='func')
+        assert retry_on_conflict(func, 2, retries=3, delay=0.1) == 1
+        assert func.call_count == 3
+        func.assert_called_with(2)
+        (first, ), _ = sleep.call_args_list[0]
+        (second, ), _ = sleep.call_args_list[1]
+        assert 0.05 <= first <= 0.1
+        assert 0.1 <= second <= 0.2
+
+    def test_retries_exhausted(self, mocker):
+        mocker.patch('imports.api.operations.time.sleep')
+        func = mocker.Mock(side_effect=ConcurrentUpdate(), __name__='func')
+        with pytest.raises(ConcurrentUpdate):
+            retry_on_conflict(func, retries=2)
+        assert func.call_count == 3
+
+    def test_not_retried_in_transaction(self, mocker, connection):
+        connection.in_atomic_block = True
+        func = mocker.Mock(side_effect=ConcurrentUpdate())
+        with pytest.raises(ConcurrentUpdate):
+            retry_on_conflict(func)
+        assert func.call_count == 1
+
+    def test_other_errors_not_retried(self, mocker):
+        func = mocker.Mock(side_effect=OperationalError('connection lost'))
+        with pytest.raises(OperationalError):
+            retry_on_conflict(func)
+        assert func.call_count == 1
+
+
+class TestListCitizensOperation:
+    @pytest.fixture()
+    def create_citizens_data(self, create_citizens_data):
+        create_citizens_data[2]['relatives'] = [102, 101]
+        create_citizens_data[1]['relatives'].append(103)
+        create_citizens_data[0]['relatives'].append(103)
+        return create_citizens_data
+
+    def test_same_as_serializer(self, data_set):
+        citizens = (Citizen.objects.filter(data_set=data_set).order_by('citizen_id')
+                    .prefetch_related('relatives'))
+
+        rows = list_citizens(data_set.id)
+
+        assert [citizen_row_representation(row) for row in rows] == \
+               CitizenSerializer(citizens, many=True).data
+
+    def test_other_data_set(self, data_set):
+        assert list_citizens(data_set.id + 1) == []
+
+    def test_iter_citizens(self, data_set):
+        batches = list(iter_citizens(data_set.id, batch_size=2))
+        assert [len(rows) for rows in batches] == [2, 1]
+        assert [row for rows in batches for row in rows] == list_citizens(data_set.id)
+
 
 @pytest.mark.parametrize('create_citizens_data', [[]])
-def test_birthday_stats_for_empty_data_set(data_set, create_citizens_data):
-    stats = get_birthday_stats2(data_set.id)
+@pytest.mark.parametrize('get_stats', [get_birthday_stats2, get_birthday_stats_sql,
+                                       get_birthday_stats_snapshot])
+def test_birthday_stats_for_empty_data_set(data_set, create_citizens_data, get_stats):
+    stats = get_stats(data_set.id)
     assert_that(stats, has_entries({
         str(month): [] for month in range(1, 12 + 1)
     }))
@@ -267,3 +722,50 @@ class TestBirthdaysOperationCase2:
     def test_stats(self, data_set, expected_stats, create_citizens_data):
         stats = get_birthday_stats2(data_set.id)
         assert_that(stats, has_entries(expected_stats))
+
+    def test_sql_stats(self, data_set, expected_stats):
+        stats = get_birthday_stats_sql(data_set.id)
+        assert_that(stats, has_entries(expected_stats))
+
+    def test_sql_stats_same_as_python(self, data_set):
+        stats = get_birthday_stats_sql(data_set.id)
+        expected = get_birthday_stats2(data_set.id)
+        assert stats == {month: sorted(presents, key=lambda el: el['citizen_id'])
+                         for month, presents in expected.items()}
+
+    @pytest.mark.parametrize('storage', ['rows', 'pairs'])
+    def test_snapshot_stats_same_as_sql(self, create_citizens_data, settings, storage):
+        settings.IMPORTS_RELATIVES_STORAGE = storage
+        data_set_id = create_dataset(create_citizens_data)
+        assert get_birthday_stats_snapshot(data_set_id) == get_birthday_stats_sql(data_set_id)
+
+
+class TestAgePercentilesOperation:
+    @pytest.fixture()
+    def create_citizens_data(self, create_citizens_data):
+        rnd = random.Random(20190825)
+        base = create_citizens_data[0]
+        today = date.today()
+        return [
+            {
+                **base,
+                'citizen_id': citizen_id,
+                'town': rnd.choice(['Москва', 'Керчь', 'Abakan', 'Я', 'a b']),
+                'birth_date': today - timedelta(days=rnd.randint(0, 120 * 365)),
+                'relatives': [],
+            }
+            for citizen_id in range(300)
+        ]
+
+    @pytest.mark.parametrize('get_percentiles', [get_age_percentiles_per_town_numpy,
+                                                 get_age_percentiles_per_town_db,
+                                                 get_age_percentiles_per_town_snapshot])
+    def test_same_as_python(self, data_set, get_percentiles):
+        assert get_percentiles(data_set.id) == get_age_percentiles_per_town(data_set.id)
+
+    @pytest.mark.parametrize('create_citizens_data', [[]])
+    @pytest.mark.parametrize('get_percentiles', [get_age_percentiles_per_town_numpy,
+                                                 get_age_percentiles_per_town_db,
+                                                 get_age_percentiles_per_town_snapshot])
+    def test_empty_data_set(self, data_set, get_percentiles):
+        assert get_percentiles(data_set.id) == []
@@ -0,0 +1,186 @@
+import io
+
+import pytest
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+
+from imports.api.models import Citizen, CitizenRelative, DataSet
+from imports.api.operations import (create_dataset, delete_dataset, list_citizens,
+                                    purge_deleted_data_sets, update_citizen, )
+from imports.api.partitions import (PARTITIONED_MODELS, is_partitioned, partition_name,
+                                    partition_tables, )
+
+pytestmark = pytest.mark.django_db
+
+
+def create_data_set(citizens_data):
+    return create_dataset([{**c, 'relatives': list(c['relatives'])} for c in citizens_data])
+
+
+def explain(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN {sql}', params)
+        return '\n'.join(line for line, in cursor.fetchall())
+
+
+def test_partition_tables(create_citizens_data, settings):
+    data_set_id = create_data_set(create_citizens_data)
+    expected = list_citizens(data_set_id)
+
+    call_command('partition_tables', stdout=io.StringIO())
+    settings.IMPORTS_PARTITION_DATA_SETS = True
+    assert all(is_partitioned(model) for model in PARTITIONED_MODELS)
+    assert list_citizens(data_set_id) == expected
+
+    other_id = create_data_set(create_citizens_data)
+    update_citizen(other_id, 101, {'relatives': []})
+    assert list_citizens(data_set_id) == expected
+    assert not CitizenRelative.objects.filter(data_set_id=other_id).exists()
+
+    call_command('partition_tables', '--off', stdout=io.StringIO())
+    settings.IMPORTS_PARTITION_DATA_SETS = False
+    assert not any(is_partitioned(model) for model in PARTITIONED_MODELS)
+    assert list_citizens(data_set_id) == expected
+    assert Citizen.objects.filter(data_set_id=other_id).count() == len(create_citizens_data)
+
+
+def test_queries_of_data_set_touch_its_partitions(create_citizens_data, settings):
+    partition_tables()
+    settings.IMPORTS_PARTITION_DATA_SETS = True
+    data_set_id = create_data_set(create_citizens_data)
+    other_id = create_data_set(create_citizens_data)
+
+    plans = [
+        explain(*Citizen.objects.filter(data_set_id=data_set_id).query.sql_with_params()),
+        explain(*CitizenRelative.objects.filter(data_set_id=data_set_id,
+                                                relative__data_set_id=data_set_id)
+                .values_list('relative__citizen_id').query.sql_with_params()),
+    ]
+    for plan in plans:
+        assert f'_{data_set_id} ' in plan
+        assert f'_{other_id} ' not in plan
+
+
+def test_unique_citizen_id_in_partition(create_citizens_data, settings):
+    partition_tables()
+    settings.IMPORTS_PARTITION_DATA_SETS = True
+    data_set_id = create_data_set(create_citizens_data)
+    citizen = Citizen.objects.get(data_set_id=data_set_id, citizen_id=101)
+
+    with pytest.raises(IntegrityError), transaction.atomic():
+        citizen.pk = None
+        citizen.save()
+
+
+def test_delete_drops_partitions(create_citizens_data, settings):
+    partition_tables()
+    settings.IMPORTS_PARTITION_DATA_SETS = True
+    settings.IMPORTS_DELETE_ASYNC_MIN_CITIZENS = 1
+    data_set_id = create_data_set(create_citizens_data)
+    other_id = create_data_set(create_citizens_data)
+    expected = list_citizens(other_id)
+
+    # dropping partitions locks tables of all data sets, it is left to the purge
+    assert not delete_dataset(data_set_id)
+    assert not DataSet.objects.filter(id=data_set_id).exists()
+    assert purge_deleted_data_sets() == [data_set_id]
+
+    tables = connection.introspection.table_names()
+    assert not any(partition_name(model, data_set_id) in tables for model in PARTITIONED_MODELS)
+    assert not DataSet.all_objects.filter(id=data_set_id).exists()
+    assert not Citizen.objects.filter(data_set_id=data_set_id).exists()
+    assert list_citizens(other_id) == expected
+
+
+def test_table_sizes(create_citizens_data, settings):
+    partition_tables()
+    settings.IMPORTS_PARTITION_DATA_SETS = True
+    create_data_set(create_citizens_data)
+    with connection.cursor() as cursor:
+        cursor.execute(f'ANALYZE {Citizen._meta.db_table}')
+
+    out = io.StringIO()
+    call_command('table_sizes', stdout=out)
+
+    rows = {line.split()[0]: [int(value) for value in line.split()[1:]]
+            for line in out.getvalue().splitlines()[1:]}
+    count, table, indexes, total = rows[Citizen._meta.db_table]
+    assert count == len(create_citizens_data)
+    assert table > 0 and indexes > 0 and total >= table + indexes
+    assert CitizenRelative._meta.db_table in rows
+
+
+def test_no_foreign_keys_to_partitioned_tables(create_citizens_data, settings):
+    # not supported before PostgreSQL 12, partitions refer to partitions instead
+    partition_tables()
+    settings.IMPORTS_PARTITION_DATA_SETS = True
+    data_set_id = create_data_set(create_citizens_data)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT conrelid::regclass::text, confrelid::regclass::text "
+                       "FROM pg_constraint c JOIN pg_class t ON t.oid = c.confrelid "
+                       "WHERE c.contype = 'f' AND t.relkind = 'p'")
+        assert cursor.fetchall() == []
+        cursor.execute("SELECT confrelid::regclass::text FROM pg_constraint "
+                       "WHERE contype = 'f' AND conrelid = %s::regclass",
+                       [partition_name(CitizenRelative, data_set_id)])
+        targets = [target for target, in cursor.fetchall()]
+    assert targets.count(partition_name(Citizen, data_set_id)) == 2
+
+    # relations can not refer to citizens of another data set
+    other = Citizen.objects.filter(data_set_id=create_data_set(create_citizens_data)).first()
+    with pytest.raises(IntegrityError), transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {CitizenRelative._meta.db_table} '
+                       f'(data_set_id, citizen_id, relative_id) VALUES (%s, %s, %s)',
+                       [data_set_id, other.id, other.id])
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+def test_failed_import_drops_partitions(create_citizens_data, settings):
+    partition_tables()
+    settings.IMPORTS_PARTITION_DATA_SETS = True
+    create_citizens_data[0]['relatives'].append(999)
+
+    with pytest.raises(Exception):
+        create_data_set(create_citizens_data)
+
+    partitions = {table for table in connection.introspection.table_names()
+                  if table.startswith(tuple(f'{model._meta.db_table}_'
+                                            for model in PARTITIONED_MODELS))}
+    assert not partitions
+
+
+@pytest.fixture
+def committed_partitions(settings):
+    with transaction.atomic():
+        partition_tables()
+    settings.IMPORTS_PARTITION_DATA_SETS = True
+    yield
+    with transaction.atomic():
+        partition_tables(partitioned=False)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures('committed_partitions')
+def test_import_does_not_block_other_data_sets(create_citizens_data):
+    other_id = create_data_set(create_citizens_data)
+    citizen_id = create_citizens_data[0]['citizen_id']
+
+    def update_other(data_set_id):
+        # partitions are attached before the import transaction, so its locks
+        # do not keep other connections from changing their data sets
+        other = connection.copy()
+        try:
+            with other.cursor() as cursor:
+                cursor.execute("SET lock_timeout = '1s'")
+                cursor.execute(
+                    f'UPDATE {Citizen._meta.db_table} SET name = %s '
+                    f'WHERE data_set_id = %s AND citizen_id = %s',
+                    ['Другое Имя', other_id, citizen_id])
+        finally:
+            other.close()
+
+    create_dataset([{**c, 'relatives': list(c['relatives'])} for c in create_citizens_data],
+                   on_created=update_other)
+
+    citizen = Citizen.objects.get(data_set_id=other_id, citizen_id=citizen_id)
+    assert citizen.name == 'Другое Имя'
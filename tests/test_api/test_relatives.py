@@ -0,0 +1,100 @@
+import io
+import random
+
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+
+from imports.api.models import CitizenPair, CitizenRelative
+from imports.api.operations import (create_dataset, update_citizen, update_citizens,
+                                    list_citizens, get_birthday_stats2, get_birthday_stats_sql, )
+from imports.api.relatives import convert_relatives
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture()
+def citizens_data(create_citizens_data):
+    rnd = random.Random(20190905)
+    base = create_citizens_data[0]
+    data = [{**base, 'citizen_id': cid, 'relatives': [],
+             'birth_date': base['birth_date'].replace(month=rnd.randint(1, 12))}
+            for cid in range(1, 16)]
+    for _ in range(25):
+        a, b = rnd.sample(data, 2)
+        if b['citizen_id'] not in a['relatives']:
+            a['relatives'].append(b['citizen_id'])
+            b['relatives'].append(a['citizen_id'])
+    return data
+
+
+def create_data_set(citizens_data):
+    return create_dataset([{**c, 'relatives': list(c['relatives'])} for c in citizens_data])
+
+
+def listing(data_set_id):
+    return [row[:-1] + (sorted(row[-1]),) for row in list_citizens(data_set_id)]
+
+
+def run_scenario(citizens_data):
+    """Create and update data set, return everything read back."""
+    data_set_id = create_data_set(citizens_data)
+    results = [listing(data_set_id)]
+
+    citizen = update_citizen(data_set_id, 1, {'relatives': [2, 3, 4]}, lock=True)
+    results.append(sorted(citizen.relatives_ids))
+    citizen = update_citizen(data_set_id, 3, {'name': 'Петя', 'relatives': [5]})
+    results.append(sorted(citizen.relatives_ids))
+
+    batch = update_citizens(data_set_id, [{'citizen_id': 4, 'relatives': [1, 6, 7]},
+                                          {'citizen_id': 6, 'relatives': []},
+                                          {'citizen_id': 8, 'name': 'Вася'}], lock=True)
+    results.append([sorted(c.relatives_ids) for c in batch])
+
+    results.append(listing(data_set_id))
+    results.append({month: sorted(presents, key=lambda p: p['citizen_id'])
+                    for month, presents in get_birthday_stats2(data_set_id).items()})
+    results.append(get_birthday_stats_sql(data_set_id))
+    return results
+
+
+@pytest.mark.parametrize('loader', ['orm', 'copy'])
+def test_pairs_same_as_rows(citizens_data, settings, loader):
+    settings.IMPORTS_DATA_SET_LOADER = loader
+    expected = run_scenario(citizens_data)
+    relations_rows = CitizenRelative.objects.count()
+
+    settings.IMPORTS_RELATIVES_STORAGE = 'pairs'
+    assert run_scenario(citizens_data) == expected
+    assert CitizenPair.objects.count() * 2 == relations_rows
+
+
+@pytest.mark.parametrize('engine', ['array_agg', 'prefetch'])
+def test_pairs_listing_view(api_client, citizens_data, settings, engine):
+    settings.IMPORTS_CITIZENS_LISTING = engine
+    url = reverse('list_citizens', kwargs={'data_set_id': create_data_set(citizens_data)})
+    data = api_client.get(url).data['data']
+    expected = [{**c, 'relatives': sorted(c['relatives'])} for c in data]
+
+    settings.IMPORTS_RELATIVES_STORAGE = 'pairs'
+    url = reverse('list_citizens', kwargs={'data_set_id': create_data_set(citizens_data)})
+    data = api_client.get(url).data['data']
+    assert [{**c, 'relatives': sorted(c['relatives'])} for c in data] == expected
+
+
+def test_convert_relatives(citizens_data, settings):
+    data_set_id = create_data_set(citizens_data)
+    expected = listing(data_set_id)
+    relations_rows = CitizenRelative.objects.count()
+
+    convert_relatives('pairs')
+    settings.IMPORTS_RELATIVES_STORAGE = 'pairs'
+    assert not CitizenRelative.objects.exists()
+    assert CitizenPair.objects.count() * 2 == relations_rows
+    assert listing(data_set_id) == expected
+
+    call_command('convert_relatives', 'rows', stdout=io.StringIO())
+    settings.IMPORTS_RELATIVES_STORAGE = 'rows'
+    assert not CitizenPair.objects.exists()
+    assert CitizenRelative.objects.count() == relations_rows
+    assert listing(data_set_id) == expected
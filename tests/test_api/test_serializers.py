@@ -1,9 +1,14 @@
+import io
+import json
 from datetime import date, datetime, timedelta
 
 import pytest
 from hamcrest import assert_that, has_entries
+from rest_framework.exceptions import ValidationError
 
-from imports.api.serializers import CitizenSerializer, CreateDataSetSerializer
+from imports.api.serializers import (CitizenSerializer, CreateDataSetSerializer,
+                                     CreateDataSetStreamValidator, UpdateCitizensSerializer, )
+from imports.api.streaming import DataSetStreamReader
 from imports.utils import latin_russian_digit
 
 
@@ -79,6 +84,8 @@ class TestCitizenSerializer:
         ['delete', 'apartment', None, False],  # required
         ['set', 'apartment', None, False],  # non-null
         ['set', 'apartment', -1, False],  # non-negative
+        ['set', 'apartment', 2 ** 31 - 1, True],
+        ['set', 'apartment', 2 ** 31, False],  # fits integer column
 
         # name values
         ['delete', 'name', None, False],  # required
@@ -180,3 +187,101 @@ class TestDataSetSerializer:
         data = {'citizens': citizens}
         s = CreateDataSetSerializer(data=data)
         assert not s.is_valid(raise_exception=False)
+
+
+class TestUpdateCitizensSerializer:
+    def test_valid(self):
+        s = UpdateCitizensSerializer(data={'citizens': [
+            {'citizen_id': 1, 'name': ' Дима ', 'relatives': [2]},
+            {'citizen_id': 2, 'birth_date': '14.06.1986'},
+        ]})
+        assert s.is_valid(raise_exception=False)
+        assert s.validated_data == {'citizens': [
+            {'citizen_id': 1, 'name': 'Дима', 'relatives': [2]},
+            {'citizen_id': 2, 'birth_date': date(year=1986, month=6, day=14)},
+        ]}
+
+    def test_same_errors_as_partial_citizen(self):
+        data = {'town': '', 'gender': 'x', 'unknown': 1}
+        s = UpdateCitizensSerializer(data={'citizens': [{'citizen_id': 1, **data}]})
+        citizen_serializer = CitizenSerializer(data=data, partial=True)
+
+        assert not s.is_valid(raise_exception=False)
+        assert not citizen_serializer.is_valid(raise_exception=False)
+        assert s.errors == {'citizens': [citizen_serializer.errors]}
+
+    @pytest.mark.parametrize('citizen', [
+        {'name': 'Дима'},
+        {'citizen_id': -1, 'name': 'Дима'},
+        {'citizen_id': 1},
+        {'citizen_id': 1, 'relatives': [1]},
+        None,
+    ])
+    def test_invalid_citizen(self, citizen):
+        data = {'citizens': [{'citizen_id': 2, 'name': 'Дима'}, citizen]}
+        s = UpdateCitizensSerializer(data=data)
+        assert not s.is_valid(raise_exception=False)
+        assert s.errors['citizens'][0] == {}
+
+    @pytest.mark.parametrize('data', [
+        {},
+        {'citizens': []},
+        {'citizens': [{'citizen_id': 1, 'name': 'Дима'}], 'unknown': 1},
+        {'citizens': [{'citizen_id': 1, 'name': 'Дима'},
+                      {'citizen_id': 1, 'name': 'Петя'}]},
+    ])
+    def test_invalid_batch(self, data):
+        s = UpdateCitizensSerializer(data=data)
+        assert not s.is_valid(raise_exception=False)
+
+
+class TestCreateDataSetStreamValidator:
+    def validate(self, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        reader = DataSetStreamReader(io.BytesIO(body), chunk_size=16)
+        validator = CreateDataSetStreamValidator(reader)
+        return list(validator.validated_citizens())
+
+    def test_valid(self, citizens):
+        s = CreateDataSetSerializer(data={'citizens': citizens})
+        s.is_valid(raise_exception=True)
+        assert self.validate({'citizens': citizens}) == s.validated_data['citizens']
+
+    @pytest.mark.parametrize('data', [
+        {},
+        {'citizens': None},
+        {'citizens': {}},
+        {'citizens': []},
+        {'citizens': [], 'unknown': 1},
+    ])
+    def test_citizens_errors_as_serializer(self, data):
+        s = CreateDataSetSerializer(data=data)
+        assert not s.is_valid(raise_exception=False)
+
+        with pytest.raises(ValidationError) as exc_info:
+            self.validate(data)
+        assert exc_info.value.detail == s.errors
+
+    @pytest.mark.parametrize('modify', [
+        lambda citizens: citizens[1].update(citizen_id=1, relatives=[]),
+        lambda citizens: citizens[1].update(relatives=[]),
+        lambda citizens: citizens[0].update(unknown=1),
+        lambda citizens: citizens.append({}),
+    ], ids=['duplicated', 'unsymmetric', 'unknown_citizen_field', 'empty_citizen'])
+    def test_invalid_citizens(self, citizens, modify):
+        modify(citizens)
+        s = CreateDataSetSerializer(data={'citizens': citizens})
+        assert not s.is_valid(raise_exception=False)
+
+        with pytest.raises(ValidationError) as exc_info:
+            self.validate({'citizens': citizens})
+
+        assert exc_info.value.detail == s.errors
+
+    def test_unknown_fields(self, citizens):
+        s = CreateDataSetSerializer(data={'citizens': citizens, 'unknown': 1})
+        assert not s.is_valid(raise_exception=False)
+
+        with pytest.raises(ValidationError) as exc_info:
+            self.validate({'citizens': citizens, 'unknown': 1})
+        assert exc_info.value.detail == s.errors
@@ -0,0 +1,186 @@
+import os
+import shutil
+import time
+from datetime import date
+
+import numpy as np
+import pytest
+from django.db import connection
+
+from imports.api.models import DataSet
+from imports.api.operations import (create_dataset, update_citizen, get_birthday_stats_sql,
+                                    get_birthday_stats_snapshot, get_age_percentiles_per_town,
+                                    get_age_percentiles_per_town_snapshot, )
+from imports.api.relatives import get_relatives_storage
+from imports.api.snapshots import DataSetSnapshot, MmapSnapshotStore, SnapshotStore, get_snapshot
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture()
+def data_set_id(create_citizens_data):
+    return create_dataset([{**c, 'relatives': list(c['relatives'])} for c in create_citizens_data])
+
+
+def relatives_of(snapshot, citizen_id):
+    i = np.searchsorted(snapshot.citizen_ids, citizen_id)
+    indexes = snapshot.relatives[snapshot.offsets[i]:snapshot.offsets[i + 1]]
+    return snapshot.citizen_ids[indexes].tolist()
+
+
+@pytest.mark.parametrize('storage', ['rows', 'pairs'])
+def test_load(create_citizens_data, settings, storage):
+    settings.IMPORTS_RELATIVES_STORAGE = storage
+    data_set_id = create_dataset([{**c, 'relatives': list(c['relatives'])}
+                                  for c in create_citizens_data])
+
+    snapshot = DataSetSnapshot.load(data_set_id)
+
+    citizens = sorted(create_citizens_data, key=lambda c: c['citizen_id'])
+    assert snapshot.citizen_ids.tolist() == [c['citizen_id'] for c in citizens]
+    assert [snapshot.town_names[code] for code in snapshot.town_codes] == [
+        c['town'] for c in citizens]
+    assert snapshot.town_names == sorted(snapshot.town_names)
+    assert snapshot.birth_years.tolist() == [c['birth_date'].year for c in citizens]
+    assert snapshot.birth_month_days.tolist() == [
+        c['birth_date'].month * 100 + c['birth_date'].day for c in citizens]
+    for citizen in citizens:
+        assert relatives_of(snapshot, citizen['citizen_id']) == sorted(citizen['relatives'])
+
+
+@pytest.mark.django_db(transaction=True)
+def test_load_single_revision(data_set_id, mocker):
+    storage = get_relatives_storage()
+
+    def change_meanwhile():
+        # relations are removed by another connection after citizens are read
+        other = connection.copy()
+        try:
+            with other.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {storage.model._meta.db_table} '
+                               f'WHERE data_set_id = %s', [data_set_id])
+                cursor.execute(f'UPDATE {DataSet._meta.db_table} SET revision = revision + 1 '
+                               f'WHERE id = %s', [data_set_id])
+        finally:
+            other.close()
+        return storage
+
+    mocker.patch('imports.api.snapshots.get_relatives_storage', side_effect=change_meanwhile)
+    snapshot = DataSetSnapshot.load(data_set_id)
+
+    assert snapshot.revision == 1
+    assert relatives_of(snapshot, 101) == [102]
+    assert DataSet.objects.get(id=data_set_id).revision == 2
+
+
+def test_load_empty_data_set():
+    snapshot = DataSetSnapshot.load(create_dataset([]))
+    assert len(snapshot.citizen_ids) == 0
+    assert snapshot.birthday_presents().shape == (12, 0)
+    groups, _ = snapshot.age_percentiles(date.today(), [50])
+    assert len(groups) == 0
+
+
+def test_reload_on_new_revision(data_set_id, django_assert_num_queries):
+    snapshot = get_snapshot(data_set_id)
+    with django_assert_num_queries(1):
+        assert get_snapshot(data_set_id) is snapshot
+
+    update_citizen(data_set_id, 101, {'relatives': []})
+    updated = get_snapshot(data_set_id)
+    assert updated.revision == snapshot.revision + 1
+    assert relatives_of(snapshot, 102) == [101]
+    assert relatives_of(updated, 102) == []
+
+
+def test_not_found():
+    with pytest.raises(DataSet.DoesNotExist):
+        get_snapshot(0)
+
+
+def test_lru_eviction(create_citizens_data):
+    data_set_ids = [create_dataset([{**c, 'relatives': list(c['relatives'])}
+                                    for c in create_citizens_data]) for _ in range(3)]
+    nbytes = DataSetSnapshot.load(data_set_ids[0]).nbytes
+    store = SnapshotStore(max_bytes=2 * nbytes)
+
+    first = store.get(data_set_ids[0])
+    store.get(data_set_ids[1])
+    assert store.get(data_set_ids[0]) is first
+    store.get(data_set_ids[2])
+
+    assert list(store.snapshots) == [data_set_ids[0], data_set_ids[2]]
+    assert store.size == 2 * nbytes
+
+
+def test_mmap_shared_by_processes(data_set_id, tmp_path, django_assert_num_queries):
+    snapshot = MmapSnapshotStore(str(tmp_path), max_bytes=1024 * 1024).get(data_set_id)
+    assert isinstance(snapshot.citizen_ids, np.memmap)
+
+    # another process maps the same files without loading data set
+    with django_assert_num_queries(1):
+        mapped = MmapSnapshotStore(str(tmp_path), max_bytes=1024 * 1024).get(data_set_id)
+    assert isinstance(mapped.relatives, np.memmap)
+    assert mapped.town_names == snapshot.town_names
+    for name in DataSetSnapshot.ARRAYS:
+        assert getattr(mapped, name).tolist() == getattr(snapshot, name).tolist()
+
+
+def test_mmap_new_revision(data_set_id, tmp_path):
+    store = MmapSnapshotStore(str(tmp_path), max_bytes=1024 * 1024)
+    snapshot = store.get(data_set_id)
+
+    update_citizen(data_set_id, 101, {'relatives': []})
+    updated = store.get(data_set_id)
+    assert [p.name for p in tmp_path.iterdir()] == [f'{data_set_id}.{updated.revision}']
+    assert relatives_of(snapshot, 102) == [101]
+    assert relatives_of(updated, 102) == []
+
+
+def test_mmap_eviction(create_citizens_data, tmp_path):
+    data_set_ids = [create_dataset([{**c, 'relatives': list(c['relatives'])}
+                                    for c in create_citizens_data]) for _ in range(3)]
+    store = MmapSnapshotStore(str(tmp_path), max_bytes=1024 * 1024)
+    store.get(data_set_ids[0])
+    nbytes = sum(p.stat().st_size for p in tmp_path.joinpath(f'{data_set_ids[0]}.1').iterdir())
+
+    store = MmapSnapshotStore(str(tmp_path), max_bytes=2 * nbytes)
+    for data_set_id in data_set_ids[1:]:
+        store.get(data_set_id)
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        f'{data_set_id}.1' for data_set_id in data_set_ids[1:])
+    assert sorted(store.snapshots) == data_set_ids[1:]
+
+
+def test_mmap_removed_by_other_process(data_set_id, tmp_path):
+    store = MmapSnapshotStore(str(tmp_path), max_bytes=1024 * 1024)
+    snapshot = store.get(data_set_id)
+    shutil.rmtree(tmp_path / f'{data_set_id}.1')
+
+    remapped = store.get(data_set_id)
+    assert remapped is not snapshot
+    assert store.snapshots[data_set_id] is remapped
+    assert tmp_path.joinpath(f'{data_set_id}.1').is_dir()
+
+
+def test_mmap_stale_temporary_removed(data_set_id, tmp_path):
+    stale, fresh = tmp_path / '.stale', tmp_path / '.fresh'
+    stale.mkdir()
+    fresh.mkdir()
+    age = MmapSnapshotStore.TEMPORARY_MAX_AGE + 1
+    os.utime(stale, (time.time() - age, time.time() - age))
+
+    MmapSnapshotStore(str(tmp_path), max_bytes=1024 * 1024).get(data_set_id)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['.fresh', f'{data_set_id}.1']
+
+
+def test_engines_off_mapped_files(create_citizens_data, settings, tmp_path):
+    data_set_id = create_dataset([{**c, 'relatives': list(c['relatives'])}
+                                  for c in create_citizens_data])
+    settings.IMPORTS_SNAPSHOT_STORE = 'mmap'
+    settings.IMPORTS_SNAPSHOT_PATH = str(tmp_path)
+
+    assert get_birthday_stats_snapshot(data_set_id) == get_birthday_stats_sql(data_set_id)
+    assert (get_age_percentiles_per_town_snapshot(data_set_id) ==
+            get_age_percentiles_per_town(data_set_id))
+    assert isinstance(get_snapshot(data_set_id).birth_years, np.memmap)
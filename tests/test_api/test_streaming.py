@@ -0,0 +1,73 @@
+import io
+import json
+
+import pytest
+from hamcrest import assert_that, contains, empty, has_properties
+from rest_framework.exceptions import ParseError
+
+from imports.api.streaming import DataSetStreamReader
+
+
+def make_reader(data, chunk_size=7):
+    if not isinstance(data, str):
+        data = json.dumps(data, ensure_ascii=False)
+    return DataSetStreamReader(io.BytesIO(data.encode('utf-8')), chunk_size=chunk_size)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 64 * 1024])
+def test_citizens(citizens, chunk_size):
+    reader = make_reader({'citizens': citizens}, chunk_size=chunk_size)
+    assert_that(list(reader.citizens()), contains(*citizens))
+    assert_that(reader, has_properties({
+        'has_citizens': True,
+        'citizens_is_list': True,
+        'citizens_count': len(citizens),
+        'unknown_fields': empty(),
+    }))
+
+
+def test_numbers_split_between_chunks():
+    reader = make_reader('{"citizens": [12345678, 1.5e10]}', chunk_size=2)
+    assert list(reader.citizens()) == [12345678, 1.5e10]
+
+
+def test_unknown_fields(citizens):
+    reader = make_reader({'a': [1, {'b': 2}], 'citizens': citizens, 'c': None})
+    assert len(list(reader.citizens())) == len(citizens)
+    assert reader.unknown_fields == {'a', 'c'}
+
+
+@pytest.mark.parametrize(['data', 'has_citizens', 'value'], [
+    ['', False, None],
+    ['{}', False, None],
+    ['{"citizens": null}', True, None],
+    ['{"citizens": {"a": 1}}', True, {'a': 1}],
+])
+def test_citizens_not_a_list(data, has_citizens, value):
+    reader = make_reader(data)
+    assert list(reader.citizens()) == []
+    assert_that(reader, has_properties({
+        'has_citizens': has_citizens,
+        'citizens_is_list': False,
+        'citizens_value': value,
+    }))
+
+
+@pytest.mark.parametrize('data', [
+    '[]',
+    '{"citizens": [{"a": 1}',
+    '{"citizens": [{"a": 1}}',
+    '{"citizens": [{"a": 1}],}',
+    '{"citizens": []} []',
+    '{1: 2}',
+])
+def test_parse_errors(data):
+    reader = make_reader(data)
+    with pytest.raises(ParseError):
+        list(reader.citizens())
+
+
+def test_undecodable_body():
+    reader = DataSetStreamReader(io.BytesIO('{"citizens": ["Москва"]}'.encode('cp1251')))
+    with pytest.raises(ParseError):
+        list(reader.citizens())
@@ -1,8 +1,9 @@
 from datetime import date
 
+import numpy as np
 import pytest
 
-from imports.utils import calculate_age
+from imports.utils import calculate_age, calculate_ages, grouped_percentiles
 
 
 @pytest.mark.parametrize(['current_date', 'birth_date', 'result'], [
@@ -14,3 +15,32 @@ from imports.utils import calculate_age
 ])
 def test_calculate_age(current_date, birth_date, result):
     assert calculate_age(current_date=current_date, birth_date=birth_date) == result
+
+
+def test_calculate_ages():
+    current_date = date(year=2019, month=5, day=10)
+    birth_dates = [date(year=2019, month=5, day=10), date(year=1990, month=5, day=10),
+                   date(year=1990, month=7, day=1), date(year=1990, month=1, day=20),
+                   date(year=1990, month=5, day=9), date(year=2000, month=2, day=29),
+                   date(year=1919, month=12, day=31)]
+
+    ages = calculate_ages(current_date,
+                          [d.year for d in birth_dates],
+                          [d.month * 100 + d.day for d in birth_dates])
+
+    assert list(ages) == [calculate_age(current_date, d) for d in birth_dates]
+
+
+def test_grouped_percentiles():
+    rnd = np.random.RandomState(20190825)
+    for _ in range(200):
+        size = rnd.randint(1, 300)
+        groups = rnd.randint(0, 10, size)
+        values = rnd.randint(0, 120, size)
+
+        unique_groups, result = grouped_percentiles(groups, values, [50, 75, 99])
+
+        assert list(unique_groups) == sorted(set(groups))
+        for group, percentiles in zip(unique_groups, result):
+            expected = np.percentile(values[groups == group], [50, 75, 99])
+            assert list(percentiles.round(2)) == list(expected.round(2))
@@ -0,0 +1,177 @@
+"""Differential tests: fast validators must agree with DRF serializers."""
+import copy
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from rest_framework.exceptions import ValidationError
+
+from imports.api.serializers import CitizenSerializer, CreateDataSetSerializer
+from imports.api.validators import CitizenValidator, CreateDataSetValidator
+
+today = datetime.utcnow().date()
+
+INTEGERS = [0, 1, 2, -1, 2 ** 31 - 1, 2 ** 31, 2 ** 40, True, False, 1.0, 1.5, '12', ' 12 ',
+            '1.0', 'x', '', None, [], {}]
+STRINGS = ['Москва', ' Москва ', 'Z', 'Я', '\tZ\n', '', '   ', 256 * 'a', 257 * 'a',
+           ' ' + 256 * 'a' + ' ', '//*', 'ё', 'Ёлка', 'a\x00b', 1, 1.5, True, None, [], {}]
+DATES = ['01.01.2017', '29.02.2000', '29.02.2001', '31.02.2019', '1.1.2017', '2017.01.01',
+         '00.01.2000', '01.13.2000', '01.01.0999', ' 01.01.2017', '01.01.2017 ',
+         '٠١.٠١.٢٠١٧', today.strftime('%d.%m.%Y'),
+         (today - timedelta(days=1)).strftime('%d.%m.%Y'),
+         (today + timedelta(days=1)).strftime('%d.%m.%Y'),
+         '', 0, None, []]
+GENDERS = ['male', 'female', 'Male', ' male', '', None, 1, True, []]
+RELATIVES = [[], [2], [1], [2, 2], [2, 3], ['2'], [2.0], [True], [None], [[2]], None, 'abc',
+             {}, 2]
+
+POOLS = {
+    'citizen_id': INTEGERS,
+    'town': STRINGS,
+    'street': STRINGS,
+    'building': STRINGS,
+    'apartment': INTEGERS,
+    'name': STRINGS,
+    'birth_date': DATES,
+    'gender': GENDERS,
+    'relatives': RELATIVES,
+}
+
+
+def validate(validate_func, data):
+    try:
+        return True, validate_func(data)
+    except ValidationError as exc:
+        return False, exc.detail
+
+
+def assert_citizen_agrees(data):
+    expected = validate(CitizenSerializer().run_validation, data)
+    result = validate(CitizenValidator().run_validation, data)
+    assert result == expected, data
+
+
+def assert_data_set_agrees(data):
+    serializer = CreateDataSetSerializer(data=data)
+    validator = CreateDataSetValidator(data=data)
+    assert validator.is_valid() == serializer.is_valid(), data
+    assert validator.errors == serializer.errors, data
+    assert validator.validated_data == serializer.validated_data, data
+
+
+@pytest.fixture()
+def citizen(citizens):
+    return citizens[0]
+
+
+def test_valid_citizen(citizen):
+    assert CitizenValidator().fast_validation(citizen) is not None
+    assert_citizen_agrees(citizen)
+
+
+@pytest.mark.parametrize('field', list(POOLS))
+def test_citizen_field_values(citizen, field):
+    for value in POOLS[field]:
+        assert_citizen_agrees({**citizen, field: value})
+
+
+@pytest.mark.parametrize('field', list(POOLS))
+def test_citizen_missing_field(citizen, field):
+    citizen.pop(field)
+    assert_citizen_agrees(citizen)
+
+
+@pytest.mark.parametrize('data', [None, [], 'citizen', 1, {}, {'unknown': 1}])
+def test_citizen_not_a_citizen(data):
+    assert_citizen_agrees(data)
+
+
+def test_citizen_unknown_fields(citizen):
+    assert_citizen_agrees({**citizen, 'unknown': 1})
+    assert_citizen_agrees({**citizen, 'unknown': 1, 'other': 2})
+
+
+def test_citizen_random(citizen):
+    rnd = random.Random(20190825)
+    for _ in range(3000):
+        data = dict(citizen)
+        for field, pool in POOLS.items():
+            roll = rnd.random()
+            if roll < 0.05:
+                data.pop(field)
+            elif roll < 0.3:
+                data[field] = rnd.choice(pool)
+        if rnd.random() < 0.05:
+            data['unknown'] = 1
+        assert_citizen_agrees(data)
+
+
+def test_data_set_valid(citizens):
+    assert_data_set_agrees({'citizens': citizens})
+
+
+@pytest.mark.parametrize('data', [
+    None, [], 'data', {}, {'citizens': None}, {'citizens': []}, {'citizens': {}},
+    {'citizens': 'abc'}, {'citizens': [None]}, {'citizens': [{}]}, {'unknown': 1},
+])
+def test_data_set_not_a_data_set(data):
+    assert_data_set_agrees(data)
+
+
+def test_data_set_unknown_fields(citizens):
+    assert_data_set_agrees({'citizens': citizens, 'unknown': 1})
+
+
+def random_data_sets(citizens, seed, count):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        data = []
+        for citizen_id in rnd.sample(range(1, 8), rnd.randint(1, 6)):
+            citizen = {**rnd.choice(citizens), 'citizen_id': citizen_id}
+            citizen['relatives'] = rnd.sample(range(1, 8), rnd.randint(0, 3))
+            if rnd.random() < 0.1:
+                field = rnd.choice(list(POOLS))
+                citizen[field] = rnd.choice(POOLS[field])
+            data.append(citizen)
+
+        # make relatives symmetric most of the time
+        if rnd.random() < 0.7:
+            ids = {c['citizen_id'] for c in data if type(c['citizen_id']) is int}
+            pairs = {(c['citizen_id'], r) for c in data
+                     if type(c['citizen_id']) is int and type(c['relatives']) is list
+                     for r in c['relatives']
+                     if type(r) is int and r in ids and r != c['citizen_id']}
+            for c in data:
+                if type(c['citizen_id']) is int and type(c['relatives']) is list:
+                    c['relatives'] = sorted({r for cid, r in pairs if cid == c['citizen_id']} |
+                                            {cid for cid, r in pairs if r == c['citizen_id']})
+
+        if rnd.random() < 0.1:
+            data.append(dict(rnd.choice(data)))
+        yield {'citizens': data}
+
+
+def test_data_set_random(citizens):
+    for data in random_data_sets(citizens, seed=20190826, count=500):
+        assert_data_set_agrees(data)
+
+
+def test_data_set_parallel(citizens):
+    citizens[0]['town'] = ' Москва '
+    citizens[1]['citizen_id'] = '2'
+    data = {'citizens': citizens}
+    initial_data = copy.deepcopy(data)
+
+    validator = CreateDataSetValidator(data=data, workers=2, chunk_size=1)
+    assert validator.is_valid()
+    assert validator.validated_data == CreateDataSetSerializer(data=data).run_validation(data)
+    assert data == initial_data
+
+
+def test_data_set_parallel_random(citizens):
+    for data in random_data_sets(citizens, seed=20191018, count=100):
+        serial = CreateDataSetValidator(data=data)
+        parallel = CreateDataSetValidator(data=data, workers=3, chunk_size=2)
+        assert parallel.is_valid() == serial.is_valid(), data
+        assert parallel.errors == serial.errors, data
+        assert parallel.validated_data == serial.validated_data, data
@@ -1,8 +1,13 @@
+from datetime import datetime, timedelta
+
 import pytest
 from django.urls import reverse
 from hamcrest import assert_that, has_entries, has_properties, contains_inanyorder
 from rest_framework import status
 
+from imports.api.models import Citizen, DataSet
+from imports.api.serializers import CitizenSerializer
+
 pytestmark = pytest.mark.django_db
 
 
@@ -52,6 +57,75 @@ class TestCreateDataSetView:
             'status_code': status.HTTP_400_BAD_REQUEST,
         }))
 
+    def test_streaming_request(self, api_client, citizens, url, settings):
+        settings.IMPORTS_STREAMING_IMPORT = True
+        settings.IMPORTS_STREAMING_BATCH_SIZE = 2
+
+        response = api_client.post(url, data={'citizens': citizens})
+
+        assert response.status_code == status.HTTP_201_CREATED
+        data_set_id = response.data['data']['import_id']
+        assert_that(Citizen.objects.filter(data_set_id=data_set_id).values_list(
+                'citizen_id', flat=True), contains_inanyorder(1, 2, 3))
+
+    @pytest.mark.parametrize('streaming', [False, True])
+    def test_streaming_bad_request(self, api_client, citizens, url, settings, streaming):
+        settings.IMPORTS_STREAMING_IMPORT = streaming
+        citizens[0]['relatives'] = []
+
+        response = api_client.post(url, data={'citizens': citizens})
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert not Citizen.objects.exists()
+
+    def test_streaming_same_errors(self, api_client, citizens, url, settings):
+        citizens[1]['birth_date'] = '31.02.1990'
+        response = api_client.post(url, data={'citizens': citizens}, format='json')
+
+        settings.IMPORTS_STREAMING_IMPORT = True
+        streaming_response = api_client.post(url, data={'citizens': citizens}, format='json')
+
+        assert streaming_response.status_code == status.HTTP_400_BAD_REQUEST
+        assert streaming_response.json() == response.json()
+
+    @pytest.mark.parametrize('streaming', [False, True])
+    def test_undecodable_request(self, api_client, url, settings, streaming):
+        settings.IMPORTS_STREAMING_IMPORT = streaming
+        body = '{"citizens": [{"town": "Москва"}]}'.encode('cp1251')
+
+        response = api_client.post(url, data=body, content_type='application/json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    @pytest.mark.parametrize('fast_validation, streaming', [
+        (True, False), (False, False), (True, True)])
+    @pytest.mark.parametrize('apartment, status_code', [
+        (2 ** 31 - 1, status.HTTP_201_CREATED),
+        (2 ** 31, status.HTTP_400_BAD_REQUEST),
+    ])
+    def test_apartment_range(self, api_client, citizens, url, settings, fast_validation,
+                             streaming, apartment, status_code):
+        settings.IMPORTS_FAST_VALIDATION = fast_validation
+        settings.IMPORTS_STREAMING_IMPORT = streaming
+        citizens[0]['apartment'] = apartment
+
+        response = api_client.post(url, data={'citizens': citizens}, format='json')
+
+        assert response.status_code == status_code
+        if status_code == status.HTTP_400_BAD_REQUEST:
+            assert list(response.json()['citizens'][0]) == ['apartment']
+
+    def test_parallel_validation_request(self, api_client, citizens, url, settings):
+        settings.IMPORTS_VALIDATION_WORKERS = 2
+        settings.IMPORTS_VALIDATION_CHUNK_SIZE = 1
+
+        response = api_client.post(url, data={'citizens': citizens})
+        assert response.status_code == status.HTTP_201_CREATED
+
+        citizens[0]['relatives'] = []
+        response = api_client.post(url, data={'citizens': citizens})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
     def test_unknown_fields_request(self, api_client, citizens):
         citizens[0]['unknown'] = 'unknown'
         url = reverse('create_dataset')
@@ -64,6 +138,35 @@ class TestCreateDataSetView:
         }))
 
 
+class TestDeleteDataSetView:
+    @pytest.fixture()
+    def url(self, data_set):
+        return reverse('delete_dataset', kwargs={
+            'data_set_id': data_set.id,
+        })
+
+    def test_url(self, url, data_set):
+        assert url == f'/imports/{data_set.id}'
+
+    def test_response(self, api_client, url, data_set):
+        response = api_client.delete(url)
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+        assert not Citizen.objects.filter(data_set=data_set).exists()
+
+        response = api_client.get(reverse('list_citizens', kwargs={'data_set_id': data_set.id}))
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        response = api_client.delete(url)
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_response_large(self, api_client, url, data_set, settings):
+        settings.IMPORTS_DELETE_ASYNC_MIN_CITIZENS = 1
+        response = api_client.delete(url)
+        assert response.status_code == status.HTTP_202_ACCEPTED
+
+        response = api_client.get(reverse('get_birthdays', kwargs={'data_set_id': data_set.id}))
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
 class TestUpdateCitizenView():
     @pytest.fixture()
     def url(self, citizen1):
@@ -113,6 +216,114 @@ class TestUpdateCitizenView():
             })
         }))
 
+    def test_response_same_as_serializer(self, api_client, url, citizen1, citizen2):
+        request_data = {'name': 'Дима', 'relatives': [citizen2.citizen_id]}
+        response = api_client.patch(url, data=request_data)
+
+        citizen1.refresh_from_db()
+        assert response.data == {'data': CitizenSerializer(instance=citizen1).data}
+
+    def test_no_queries_after_update(self, api_client, url, django_assert_num_queries):
+        # savepoint, select data set and citizen, read edges, lock citizens, read edges again,
+        # update, bump revision and release savepoint
+        with django_assert_num_queries(9):
+            api_client.patch(url, data={'name': 'Дима'})
+
+    @pytest.mark.parametrize('if_match', ['*', '"{data_set_id}.1"', '"0.1", "{data_set_id}.1"'])
+    def test_if_match(self, api_client, url, citizen1, if_match):
+        if_match = if_match.format(data_set_id=citizen1.data_set_id)
+        response = api_client.patch(url, data={'name': 'Дима'}, HTTP_IF_MATCH=if_match)
+        assert response.status_code == status.HTTP_200_OK
+
+    @pytest.mark.parametrize('if_match', ['"{data_set_id}.2"', 'W/"{data_set_id}.1"',
+                                          '"0.1"', 'x'])
+    def test_if_match_failed(self, api_client, url, citizen1, if_match):
+        if_match = if_match.format(data_set_id=citizen1.data_set_id)
+        response = api_client.patch(url, data={'name': 'Дима'}, HTTP_IF_MATCH=if_match)
+        citizen1.refresh_from_db()
+        assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+        assert citizen1.name != 'Дима'
+
+    @pytest.mark.parametrize('apartment, status_code', [
+        (2 ** 31 - 1, status.HTTP_200_OK),
+        (2 ** 31, status.HTTP_400_BAD_REQUEST),
+    ])
+    def test_apartment_range(self, api_client, url, citizen1, apartment, status_code):
+        response = api_client.patch(url, data={'apartment': apartment}, format='json')
+        assert response.status_code == status_code
+
+    def test_deleted_meanwhile(self, api_client, url, citizen1, mocker):
+        from imports.api.operations import bump_revision
+
+        def delete_and_bump(data_set_id, revision=None):
+            DataSet.objects.filter(id=data_set_id).update(deleted=True)
+            bump_revision(data_set_id, revision)
+
+        mocker.patch('imports.api.operations.bump_revision', side_effect=delete_and_bump)
+        response = api_client.patch(url, data={'name': 'Дима'}, HTTP_IF_MATCH='"{}.1"'.format(
+                citizen1.data_set_id))
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_if_match_etag_of_read_views(self, api_client, url, citizen1):
+        etag = api_client.get(reverse('list_citizens', kwargs={
+            'data_set_id': citizen1.data_set_id,
+        }))['ETag']
+
+        response = api_client.patch(url, data={'name': 'Дима'}, HTTP_IF_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+
+        response = api_client.patch(url, data={'name': 'Петя'}, HTTP_IF_MATCH=etag)
+        assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+
+
+class TestUpdateCitizensView:
+    @pytest.fixture()
+    def url(self, data_set):
+        return reverse('update_citizens', kwargs={
+            'data_set_id': data_set.id,
+        })
+
+    def test_url(self, url, data_set):
+        assert url == f'/imports/{data_set.id}/citizens/batch'
+
+    def test_response(self, api_client, url, citizen1, citizen2):
+        request_data = {'citizens': [
+            {'citizen_id': citizen1.citizen_id, 'name': 'Дима', 'relatives': []},
+            {'citizen_id': citizen2.citizen_id, 'town': 'СПБ'},
+        ]}
+        response = api_client.patch(url, data=request_data)
+
+        citizen1.refresh_from_db()
+        citizen2.refresh_from_db()
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {'data': [
+            CitizenSerializer(instance=citizen1).data,
+            CitizenSerializer(instance=citizen2).data,
+        ]}
+        assert citizen1.name == 'Дима'
+        assert citizen2.town == 'СПБ'
+
+    def test_bad_request(self, api_client, url, citizen1):
+        request_data = {'citizens': [{'citizen_id': citizen1.citizen_id,
+                                      'relatives': [citizen1.citizen_id]}]}
+        response = api_client.patch(url, data=request_data)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_if_match_failed(self, api_client, url, citizen1):
+        request_data = {'citizens': [{'citizen_id': citizen1.citizen_id, 'name': 'Дима'}]}
+        response = api_client.patch(url, data=request_data,
+                                    HTTP_IF_MATCH=f'"{citizen1.data_set_id}.2"')
+        assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+
+    def test_not_found(self, api_client, url, citizen1):
+        request_data = {'citizens': [{'citizen_id': citizen1.citizen_id, 'name': 'Дима'},
+                                     {'citizen_id': 100500, 'name': 'Дима'}]}
+        response = api_client.patch(url, data=request_data)
+
+        citizen1.refresh_from_db()
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert citizen1.name != 'Дима'
+
 
 class TestListsDataSetCitizensView:
     @pytest.fixture()
@@ -137,7 +348,9 @@ class TestListsDataSetCitizensView:
             'relatives': citizen.relatives_ids,
         }
 
-    def test_response(self, api_client, url, data_set):
+    @pytest.mark.parametrize('engine', ['auto', 'array_agg', 'prefetch'])
+    def test_response(self, api_client, url, data_set, settings, engine):
+        settings.IMPORTS_CITIZENS_LISTING = engine
         response = api_client.get(url)
 
         assert_that(response, has_properties({
@@ -149,6 +362,31 @@ class TestListsDataSetCitizensView:
             })
         }))
 
+    @pytest.mark.parametrize('batch_size', [1, 2, 1000])
+    def test_streaming_response(self, api_client, url, settings, batch_size):
+        expected = api_client.get(url).content
+
+        settings.IMPORTS_STREAM_CITIZENS = True
+        settings.IMPORTS_STREAM_CITIZENS_BATCH_SIZE = batch_size
+        response = api_client.get(url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response['Content-Type'] == 'application/json'
+        assert b''.join(response.streaming_content) == expected
+
+    @pytest.mark.parametrize('create_citizens_data', [[]])
+    def test_streaming_empty_data_set(self, api_client, url, settings):
+        settings.IMPORTS_STREAM_CITIZENS = True
+        response = api_client.get(url)
+        assert b''.join(response.streaming_content) == b'{"data":[]}'
+
+    def test_engines_render_same_json(self, api_client, url, settings):
+        settings.IMPORTS_CITIZENS_LISTING = 'prefetch'
+        expected = api_client.get(url).content
+
+        settings.IMPORTS_CITIZENS_LISTING = 'array_agg'
+        assert api_client.get(url).content == expected
+
 
 class TestBirthdaysView:
     @pytest.fixture()
@@ -160,7 +398,9 @@ class TestBirthdaysView:
     def test_url(self, url, data_set):
         assert url == f'/imports/{data_set.id}/citizens/birthdays'
 
-    def test_response(self, api_client, url, data_set):
+    @pytest.mark.parametrize('engine', ['python', 'sql', 'snapshot'])
+    def test_response(self, api_client, url, data_set, settings, engine):
+        settings.IMPORTS_BIRTHDAYS_ENGINE = engine
         response = api_client.get(url)
         assert_that(response, has_properties({
             'status_code': status.HTTP_200_OK,
@@ -193,6 +433,14 @@ class TestTownAgePercentilesView:
     def test_url(self, url, data_set):
         assert url == f'/imports/{data_set.id}/towns/stat/percentile/age'
 
+    @pytest.mark.parametrize('engine', ['numpy', 'database', 'snapshot'])
+    def test_engines_response(self, api_client, url, settings, engine):
+        settings.IMPORTS_PERCENTILES_ENGINE = 'python'
+        expected = api_client.get(url).content
+
+        settings.IMPORTS_PERCENTILES_ENGINE = engine
+        assert api_client.get(url).content == expected
+
     def test_response(self, api_client, url, data_set):
         response = api_client.get(url)
         assert_that(response, has_properties({
@@ -203,3 +451,64 @@ class TestTownAgePercentilesView:
                 )
             }),
         }))
+
+
+class TestConditionalGet:
+    @pytest.fixture(params=['list_citizens', 'get_birthdays', 'get_age_percentiles'])
+    def url(self, request, data_set):
+        return reverse(request.param, kwargs={
+            'data_set_id': data_set.id,
+        })
+
+    def test_etag(self, api_client, url, data_set):
+        response = api_client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'].startswith(f'"{data_set.id}.{data_set.revision}')
+
+    def test_not_modified(self, api_client, url, django_assert_num_queries):
+        etag = api_client.get(url)['ETag']
+        with django_assert_num_queries(1):
+            response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['ETag'] == etag
+
+    def test_modified_after_update(self, api_client, url, citizen1):
+        etag = api_client.get(url)['ETag']
+        api_client.patch(reverse('update_citizen', kwargs={
+            'data_set_id': citizen1.data_set_id,
+            'citizen_id': citizen1.citizen_id,
+        }), data={'name': 'Дима'})
+
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] != etag
+
+    def test_age_percentiles_modified_next_day(self, api_client, data_set, mocker):
+        url = reverse('get_age_percentiles', kwargs={'data_set_id': data_set.id})
+        etag = api_client.get(url)['ETag']
+        assert etag == f'"{data_set.id}.{data_set.revision}.{datetime.utcnow():%Y%m%d}"'
+
+        tomorrow = datetime.utcnow() + timedelta(days=1)
+        mocker.patch('imports.api.views.datetime', mocker.Mock(utcnow=lambda: tomorrow))
+        response = api_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response['ETag'] == f'"{data_set.id}.{data_set.revision}.{tomorrow:%Y%m%d}"'
+
+    def test_if_match_age_percentiles_etag(self, api_client, citizen1):
+        etag = api_client.get(reverse('get_age_percentiles', kwargs={
+            'data_set_id': citizen1.data_set_id,
+        }))['ETag']
+        url = reverse('update_citizen', kwargs={
+            'data_set_id': citizen1.data_set_id,
+            'citizen_id': citizen1.citizen_id,
+        })
+
+        response = api_client.patch(url, data={'name': 'Дима'}, HTTP_IF_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        response = api_client.patch(url, data={'name': 'Петя'}, HTTP_IF_MATCH=etag)
+        assert response.status_code == status.HTTP_412_PRECONDITION_FAILED
+
+    def test_not_found(self, api_client):
+        response = api_client.get(reverse('list_citizens', kwargs={'data_set_id': 0}),
+                                  HTTP_IF_NONE_MATCH='"0.1"')
+        assert response.status_code == status.HTTP_404_NOT_FOUND